@@ -1,31 +1,354 @@
 import numpy as np
-import random
-from settings import settings
+from settings import settings, real
 from copy import deepcopy
+import json
+from recorder import HistoryRecorder
+from profiling import NULL_PROFILER
+from metrics import MetricsRegistry, hhi
+from network import ExposureNetwork, eisenberg_noe, debt_rank, default_cascade
+
+# Коды типов потоков в колоночной книге (порядок совпадает с ключами histories)
+FLOW_TYPES = ['mbk', 'cb', 'deposit', 'credit']
+FLOW_CODES = {flow_type: code for code, flow_type in enumerate(FLOW_TYPES)}
+
+# Столбцы лестницы погашений Bank.liquidity_ladder: сначала притоки по книге кредитов,
+# затем оттоки по книге депозитов, по каждому типу погашение и купоны
+LADDER_BOOKS = [('credits', 'in', ['credit', 'mbk', 'cb']), ('deposits', 'out', ['deposit', 'mbk', 'cb'])]
+LADDER_COLUMNS = [f'{flow_type}_{direction}_{kind}' for _, direction, flow_types in LADDER_BOOKS
+                  for flow_type in flow_types for kind in ('principal', 'coupon')]
+LADDER_INFLOWS = 2 * len(LADDER_BOOKS[0][2])
+
+# Версия формата контрольных точек BankModel.checkpoint
+CHECKPOINT_FORMAT = 2
+
+
+def _plain(value):
+    # Числа NumPy - в обычные числа Python для JSON
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _generator(state):
+    # Генератор в сохранённом состоянии bit_generator.state
+    rng = np.random.Generator(getattr(np.random, state['bit_generator'])())
+    rng.bit_generator.state = state
+    return rng
+
+
+def liquidity_shares(settings, n_banks, rng=None):
+    """
+    Стартовые доли ликвидности банков.
+    liquid_distribution - либо список долей длины не меньше n_banks, либо название
+    распределения: 'real', 'uniform', 'pareto' (параметр - показатель alpha)
+    или 'lognormal' (параметр - sigma). Сгенерированные доли нормируются на 1
+    и сортируются по убыванию.
+    :return: Массив долей длины n_banks
+    """
+    distribution = settings['liquid_distribution']
+    if isinstance(distribution, str):
+        rng = np.random.default_rng(rng)
+        parameter = settings.get('liquid_distribution_param')
+        if distribution == 'real':
+            shares = np.array(real, dtype=np.float64)
+        elif distribution == 'uniform':
+            return np.full(n_banks, 1 / n_banks)
+        elif distribution == 'pareto':
+            shares = rng.pareto(1.16 if parameter is None else parameter, n_banks) + 1
+        elif distribution == 'lognormal':
+            shares = rng.lognormal(0, 1 if parameter is None else parameter, n_banks)
+        else:
+            raise ValueError(f'Unsupported liquid distribution {distribution!r}')
+        if distribution != 'real':
+            return np.sort(shares / shares.sum())[::-1]
+    else:
+        shares = np.array(distribution, dtype=np.float64)
+
+    if len(shares) < n_banks:
+        raise ValueError(f'liquid_distribution has {len(shares)} shares for {n_banks} banks')
+    return shares[:n_banks]
+
+
+def routing_weights(routing, flow_type, cash, delta, top_rate=0.03):
+    """
+    Вероятности попадания заявки в каждый банк.
+    'uniform' - равновероятно, 'proportional' - пропорционально положительному кэшу,
+    'delta' - по привлекательности: депозиты чаще идут в надёжные банки (большая delta),
+    кредиты - в банки с дешёвыми кредитами (малая delta).
+    :param top_rate: Наибольшая надбавка delta (max из delta_rates), по ней нормируется delta
+    """
+    n_banks = len(cash)
+    if routing == 'uniform':
+        return np.full(n_banks, 1 / n_banks)
+    if routing == 'proportional':
+        weights = np.maximum(cash, 0)
+    elif routing == 'delta':
+        relative = delta / top_rate if top_rate > 0 else np.zeros(n_banks)
+        weights = np.maximum(1 + relative if flow_type == 'deposit' else 2 - relative, 0)
+    else:
+        raise ValueError(f'Unsupported applications routing {routing!r}')
+    total = weights.sum()
+    return weights / total if total > 0 else np.full(n_banks, 1 / n_banks)
+
 
 class HistoryList:
-    def __init__(self, values=None, histories=None, history_values=None):
-        self.values = values if values is not None else []
+    """
+    Колоночная книга потоков банка с календарём событий. Потоки хранятся
+    массивами NumPy (объём, ставка, день выдачи, день погашения, день первой
+    выплаты, период выплат, код типа), а выплаты купонов и погашения
+    заранее раскладываются по корзинам дней в кольцевом календаре.
+    Дневной проход читает одну корзину и не трогает остальную книгу.
+    """
+    _dtypes = {'volume': np.float64, 'rate': np.float64, 'start_day': np.int64, 'maturity_day': np.int64,
+               'first_pay_day': np.int64, 'payment_period': np.int64, 'flow_type': np.int8}
+
+    def __init__(self, values=None, histories=None, history_values=None, keep_history=True):
+        """
+        :param keep_history: Копить ли histories в списках (иначе история ведётся снаружи,
+            например HistoryRecorder по счётчикам volumes)
+        """
+        self.keep_history = keep_history
+        self.size = 0
+        self.day = 0  # номер следующего дневного прохода
+        self._columns = {name: np.empty(16, dtype=dtype) for name, dtype in self._dtypes.items()}
+
+        # Кольцевой календарь: купоны, объёмы и количество погашений по дням и типам
+        self._horizon = 256
+        self._coupons = np.zeros((self._horizon, len(FLOW_TYPES)))
+        self._maturing = np.zeros((self._horizon, len(FLOW_TYPES)))
+        self._maturing_count = np.zeros((self._horizon, len(FLOW_TYPES)), dtype=np.int64)
+
+        # Количество и объём живых потоков по типам (обновляются при добавлении и погашении)
+        self._live_count = np.zeros(len(FLOW_TYPES), dtype=np.int64)
+        self._live_volume = np.zeros(len(FLOW_TYPES))
+
         self.histories = histories if histories is not None else {
             'mbk': [], 'cb': [], 'deposit': [], 'credit': []}
         self.history_values = history_values if history_values is not None else {
             'mbk': [], 'cb': [], 'deposit': [], 'credit': []}
+        if values is not None:
+            self.extend(values)
+
+    # Представления столбцов живых потоков без копирования
+    @property
+    def volume(self):
+        self._compact()
+        return self._columns['volume'][:self.size]
+
+    @property
+    def rate(self):
+        self._compact()
+        return self._columns['rate'][:self.size]
+
+    @property
+    def payment_period(self):
+        self._compact()
+        return self._columns['payment_period'][:self.size]
+
+    @property
+    def flow_type(self):
+        self._compact()
+        return self._columns['flow_type'][:self.size]
+
+    @property
+    def maturity(self):
+        # Дней до погашения на момент следующего дневного прохода
+        self._compact()
+        return self._columns['maturity_day'][:self.size] - self.day
+
+    @property
+    def days_to_pay(self):
+        # Дней до ближайшей выплаты: первая выплата, затем каждые payment_period + 1 дней
+        self._compact()
+        first = self._columns['first_pay_day'][:self.size]
+        step = self._columns['payment_period'][:self.size] + 1
+        passed = np.maximum(self.day - first, 0)
+        return first + -(-passed // step) * step - self.day
+
+    @property
+    def values(self):
+        return list(self)
+
+    def _reserve(self, extra):
+        capacity = len(self._columns['volume'])
+        if self.size + extra <= capacity:
+            return
+        while capacity < self.size + extra:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self._columns[name] = grown
+
+    def _ensure_horizon(self, days):
+        # Расширяем календарь, чтобы в него помещались события на days дней вперёд
+        if days < self._horizon:
+            return
+        horizon = self._horizon
+        while horizon <= days:
+            horizon *= 2
+        slots = (self.day + np.arange(self._horizon)) % self._horizon
+        new_slots = (self.day + np.arange(self._horizon)) % horizon
+        for name in ('_coupons', '_maturing', '_maturing_count'):
+            wheel = getattr(self, name)
+            grown = np.zeros((horizon, wheel.shape[1]), dtype=wheel.dtype)
+            grown[new_slots] = wheel[slots]
+            setattr(self, name, grown)
+        self._horizon = horizon
+
+    def _compact(self):
+        # Физически убираем погашенные потоки, когда их накопилось достаточно
+        if self.size == self._live_count.sum():
+            return
+        keep = self._columns['maturity_day'][:self.size] >= self.day
+        n = int(np.count_nonzero(keep))
+        for column in self._columns.values():
+            column[:n] = column[:self.size][keep]
+        self.size = n
+
+    def append_arrays(self, volume, rate, maturity, payment_period, flow_type, days_to_pay=None):
+        """
+        Добавляет пачку потоков и раскладывает их купоны и погашения по календарю.
+        Поток, добавленный до дневного прохода, участвует уже в нём.
+        :param maturity: Дней до погашения
+        :param flow_type: Коды типов (FLOW_CODES) - массив или одно число
+        :param days_to_pay: Дней до первой выплаты, по умолчанию равно периоду выплат
+        """
+        volume = np.asarray(volume, dtype=np.float64)
+        n = volume.size
+        if n == 0:
+            return
+        rate = np.broadcast_to(np.asarray(rate, dtype=np.float64), n)
+        maturity = np.broadcast_to(np.asarray(maturity, dtype=np.int64), n)
+        payment_period = np.broadcast_to(np.asarray(payment_period, dtype=np.int64), n)
+        flow_type = np.broadcast_to(np.asarray(flow_type, dtype=np.int64), n)
+        days_to_pay = payment_period if days_to_pay is None else \
+            np.broadcast_to(np.asarray(days_to_pay, dtype=np.int64), n)
+
+        self._reserve(n)
+        new = slice(self.size, self.size + n)
+        self._columns['volume'][new] = volume
+        self._columns['rate'][new] = rate
+        self._columns['start_day'][new] = self.day
+        self._columns['maturity_day'][new] = self.day + maturity
+        self._columns['first_pay_day'][new] = self.day + days_to_pay
+        self._columns['payment_period'][new] = payment_period
+        self._columns['flow_type'][new] = flow_type
+        self.size += n
+
+        # Погашения: весь объём потока в день истечения срока
+        self._ensure_horizon(int(maturity.max()))
+        maturity_slot = (self.day + maturity) % self._horizon
+        np.add.at(self._maturing, (maturity_slot, flow_type), volume)
+        np.add.at(self._maturing_count, (maturity_slot, flow_type), 1)
+        self._live_count += np.bincount(flow_type, minlength=len(FLOW_TYPES))
+
+        # Купоны: первая выплата через days_to_pay дней, затем каждые payment_period + 1 дней,
+        # включая день погашения
+        n_coupons = np.where(maturity >= days_to_pay, (maturity - days_to_pay) // (payment_period + 1) + 1, 0)
+        rows = np.repeat(np.arange(n), n_coupons)
+        if rows.size:
+            number = np.arange(rows.size) - np.repeat(np.cumsum(n_coupons) - n_coupons, n_coupons)
+            coupon_day = self.day + days_to_pay[rows] + number * (payment_period[rows] + 1)
+            coupon = volume * rate / (360 / payment_period)
+            np.add.at(self._coupons, (coupon_day % self._horizon, flow_type[rows]), coupon[rows])
+
+        added = np.bincount(flow_type, weights=volume, minlength=len(FLOW_TYPES))
+        self._live_volume += added
+        for code in np.unique(flow_type):
+            self.history_values[FLOW_TYPES[code]].append(added[code])
 
     def append(self, item):
-        self.values.append(item)
-        self.history_values[item.flow_type].append(item.volume)
+        self.append_arrays([item.volume], [item.rate], [item.maturity], [item.payment_period],
+                           [FLOW_CODES[item.flow_type]], [item.days_to_pay])
 
     def extend(self, other):
-        for item in other:
-            self.values.append(item)
-            self.history_values[item.flow_type].append(item.volume)
+        if isinstance(other, FlowBatch):
+            self.append_arrays(other.volume, other.rate, other.maturity, other.payment_period,
+                               FLOW_CODES[other.flow_type])
+            return
+        other = list(other)
+        if not other:
+            return
+        self.append_arrays([item.volume for item in other],
+                           [item.rate for item in other],
+                           [item.maturity for item in other],
+                           [item.payment_period for item in other],
+                           [FLOW_CODES[item.flow_type] for item in other],
+                           [item.days_to_pay for item in other])
 
     def update_history_removed(self, item):
         self.history_values[item.flow_type].append(-item.volume)
 
+    def count(self, flow_type=None):
+        """
+        Количество живых потоков типа flow_type (или всех)
+        """
+        if flow_type is None:
+            return int(self._live_count.sum())
+        return int(self._live_count[FLOW_CODES[flow_type]])
+
+    def total(self, flow_type=None):
+        """
+        Объём живых потоков типа flow_type (или всех)
+        """
+        if flow_type is None:
+            return self._live_volume.sum()
+        return self._live_volume[FLOW_CODES[flow_type]]
+
+    @property
+    def counts(self):
+        # Количество живых потоков по типам в порядке FLOW_TYPES
+        return self._live_count.copy()
+
+    @property
+    def volumes(self):
+        # Объём живых потоков по типам в порядке FLOW_TYPES
+        return self._live_volume.copy()
+
+    def roll(self):
+        """
+        Дневной проход по книге: берёт из календаря купоны и погашения сегодняшнего
+        дня и переходит к следующему дню. Стоимость не зависит от размера книги.
+        :return: (сумма купонов за день, объём погашаемых сегодня потоков)
+        """
+        slot = self.day % self._horizon
+        coupon = self._coupons[slot].sum()
+        matured = self._maturing[slot].copy()
+        matured_count = self._maturing_count[slot].copy()
+        self._coupons[slot] = 0
+        self._maturing[slot] = 0
+        self._maturing_count[slot] = 0
+        self.day += 1
+
+        if matured_count.any():
+            for code in np.flatnonzero(matured_count):
+                self.history_values[FLOW_TYPES[code]].append(-matured[code])
+            self._live_count -= matured_count
+            self._live_volume -= matured
+            # Убираем накопленную ошибку округления у опустевших типов
+            self._live_volume[self._live_count == 0] = 0
+            # Погашенные строки убираем пачкой, когда их становится больше живых
+            if self.size > 2 * self._live_count.sum():
+                self._compact()
+
+        return coupon, matured.sum()
+
+    def ladder(self, horizon):
+        """
+        Лестница погашений: купоны и погашения по типам на horizon дней вперёд,
+        прочитанные из календаря одним срезом. Строка 0 - ближайший дневной проход.
+        :return: (купоны, погашения) - массивы формы (horizon, len(FLOW_TYPES))
+        """
+        ahead = np.arange(horizon)
+        slots = (self.day + ahead) % self._horizon
+        # Событий дальше горизонта календаря нет, а его ячейки уже относятся к следующему кругу
+        within = (ahead < self._horizon)[:, None]
+        return self._coupons[slots] * within, self._maturing[slots] * within
+
     def update_history(self):
         for key in self.history_values.keys():
-            if self.histories[key]:
+            if not self.keep_history:
+                pass
+            elif self.histories[key]:
                 self.histories[key].append(
                     self.histories[key][-1] + sum(self.history_values[key]))
             else:
@@ -33,12 +356,52 @@ class HistoryList:
 
             self.history_values[key] = []
 
+    def get_state(self, prefix, arrays):
+        """
+        Состояние книги для контрольной точки: массивы кладутся в arrays под
+        ключами с префиксом prefix, остальное возвращается словарём
+        """
+        for name, column in self._columns.items():
+            arrays[f'{prefix}.{name}'] = column[:self.size]
+        for name in ('_coupons', '_maturing', '_maturing_count', '_live_count', '_live_volume'):
+            arrays[f'{prefix}.{name}'] = getattr(self, name)
+        for key in FLOW_TYPES:
+            arrays[f'{prefix}.histories.{key}'] = np.array(self.histories[key], dtype=np.float64)
+            arrays[f'{prefix}.history_values.{key}'] = np.array(self.history_values[key], dtype=np.float64)
+        return {'size': self.size, 'day': self.day, 'horizon': self._horizon, 'keep_history': self.keep_history}
+
+    @classmethod
+    def from_state(cls, meta, arrays, prefix):
+        book = cls(keep_history=meta['keep_history'])
+        book._reserve(meta['size'])
+        book.size = meta['size']
+        book.day = meta['day']
+        book._horizon = meta['horizon']
+        for name, column in book._columns.items():
+            column[:book.size] = arrays[f'{prefix}.{name}']
+        for name in ('_coupons', '_maturing', '_maturing_count', '_live_count', '_live_volume'):
+            setattr(book, name, np.array(arrays[f'{prefix}.{name}']))
+        for key in FLOW_TYPES:
+            book.histories[key] = arrays[f'{prefix}.histories.{key}'].tolist()
+            book.history_values[key] = arrays[f'{prefix}.history_values.{key}'].tolist()
+        return book
+
     def __len__(self):
-        return len(self.values)
+        return int(self._live_count.sum())
 
     def __iter__(self):
-        for item in self.values:
-            yield item
+        # Материализуем живые потоки книги в объекты Flow (только для просмотра)
+        maturity = self.maturity
+        days_to_pay = self.days_to_pay
+        for i in range(self.size):
+            flow = Flow.__new__(Flow)
+            flow.flow_type = FLOW_TYPES[self._columns['flow_type'][i]]
+            flow.volume = self._columns['volume'][i]
+            flow.rate = self._columns['rate'][i]
+            flow.maturity = maturity[i]
+            flow.payment_period = self._columns['payment_period'][i]
+            flow.days_to_pay = days_to_pay[i]
+            yield flow
 
     def _string_representation(self):
         return f'{self.values}'
@@ -51,28 +414,30 @@ class HistoryList:
 
 
 class Flow:
-    def __init__(self, flow_type, volume=None, rate = settings['cb_rate']):
+    def __init__(self, flow_type, volume=None, rate=None, rng=None, model_settings=None):
+        """
+        :param rate: По умолчанию ключевая ставка cb_rate
+        :param rng: Генератор (или seed) для объёма и сроков, обычно из потоков модели
+            (см. BankModel.flow); без него поток невоспроизводим, поэтому он обязателен
+        :param model_settings: Настройки модели, по умолчанию settings из settings.py
+        """
+        if flow_type not in FLOW_CODES:
+            raise ValueError(f'Unimplemented type of {flow_type} was given')
+        if rng is None:
+            raise ValueError('Flow needs a generator, for example from BankModel.streams')
+        model_settings = settings if model_settings is None else model_settings
         self.flow_type = flow_type
         self.volume = volume
-        self.rate = rate
+        self.rate = model_settings['cb_rate'] if rate is None else rate
+        rng = np.random.default_rng(rng)
 
-        # Депозит или Кредит
-        if (flow_type == 'deposit' or 'credit') and volume is None:
-            self.volume = round(np.random.uniform(settings[f'{flow_type}_volume_bound'][0],
-                                                settings[f'{flow_type}_volume_bound'][1]))
-            self.maturity = random.choice(
-                settings[f'{flow_type}_maturity'])
-            self.payment_period = random.choice(settings['payment_period'])
-            self.days_to_pay = self.payment_period
-
-        elif (flow_type == 'mbk' or 'cb'):
-            self.maturity = random.choice(
-                settings[f'{flow_type}_maturity'])
-            self.payment_period = random.choice(settings['payment_period'])
-            self.days_to_pay = self.payment_period
-
-        else:
-            raise ValueError(f'Unimplemented type of {flow_type} was given')
+        # Объём депозита или кредита без заданного объёма разыгрывается
+        if flow_type in ('deposit', 'credit') and volume is None:
+            self.volume = round(rng.uniform(model_settings[f'{flow_type}_volume_bound'][0],
+                                            model_settings[f'{flow_type}_volume_bound'][1]))
+        self.maturity = rng.choice(model_settings[f'{flow_type}_maturity'])
+        self.payment_period = rng.choice(model_settings['payment_period'])
+        self.days_to_pay = self.payment_period
 
     def update_rate(self, delta):
         """
@@ -100,99 +465,305 @@ class Flow:
         return self._string_representation()
 
 
+class FlowBatch:
+    """
+    Пачка заявок одного типа в виде массивов (объём, ставка, срок, период
+    выплат, номер банка-получателя). Генерируется за несколько векторных
+    вызовов на весь день и режется по банкам без работы с отдельными потоками.
+    """
+    def __init__(self, flow_type, volume, rate, maturity, payment_period, bank=None):
+        self.flow_type = flow_type
+        self.volume = volume
+        self.rate = rate
+        self.maturity = maturity
+        self.payment_period = payment_period
+        self.bank = bank if bank is not None else np.zeros(len(volume), dtype=np.int64)
+
+    @classmethod
+    def empty(cls, flow_type):
+        return cls(flow_type, np.empty(0), np.empty(0), np.empty(0, dtype=np.int64),
+                   np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def generate(cls, flow_type, n, n_banks, settings, rng=None, weights=None):
+        """
+        Генерирует n заявок типа flow_type и случайно назначает их банкам.
+        Количество заявок на банк берётся из одного мультиномиального распределения,
+        заявки независимы, поэтому банки получают подряд идущие куски пачки.
+        :param n_banks: Количество банков, между которыми распределяются заявки
+        :param rng: np.random.Generator (или seed), из которого берутся случайные числа
+        :param weights: Вероятности выбора банков (routing_weights), по умолчанию равные
+        """
+        rng = np.random.default_rng(rng)
+        low, high = settings[f'{flow_type}_volume_bound']
+        weights = np.full(n_banks, 1 / n_banks) if weights is None else weights
+        return cls(flow_type,
+                   volume=np.round(rng.uniform(low, high, n)),
+                   rate=np.full(n, settings['cb_rate']),
+                   maturity=rng.choice(settings[f'{flow_type}_maturity'], n),
+                   payment_period=rng.choice(settings['payment_period'], n),
+                   bank=np.repeat(np.arange(n_banks), rng.multinomial(n, weights)))
+
+    def split(self, n_banks):
+        """
+        Режет пачку на срезы по банкам-получателям (порядок заявок внутри банка сохраняется)
+        :return: Список пачек длины n_banks
+        """
+        ordered = self
+        if np.any(self.bank[1:] < self.bank[:-1]):
+            ordered = self[np.argsort(self.bank, kind='stable')]
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(self.bank, minlength=n_banks))))
+        return [ordered[bounds[i]:bounds[i + 1]] for i in range(n_banks)]
+
+    def update_rate(self, delta):
+        """
+        Векторный аналог Flow.update_rate: депозиты дешевле, кредиты дороже на delta
+        """
+        if self.flow_type == 'deposit':
+            self.rate = self.rate - delta
+        elif self.flow_type == 'credit':
+            self.rate = self.rate + delta
+
+        assert np.all(self.rate > 0.01)
+
+    def __getitem__(self, key):
+        return FlowBatch(self.flow_type, self.volume[key], self.rate[key], self.maturity[key],
+                         self.payment_period[key], self.bank[key])
+
+    def __len__(self):
+        return len(self.volume)
+
+    def _string_representation(self):
+        return f'{len(self)} {self.flow_type} applications'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+class ApplicationLedger:
+    """
+    Журнал сгенерированных за день заявок одного типа. Поля хранятся по столбцам
+    в растущих массивах, границы дней - в массиве смещений.
+    retention: 'off' - ничего не хранить, 'full' - хранить всё,
+    целое N - хранить только последние N дней.
+    """
+    _dtypes = {'volume': np.float64, 'rate': np.float64, 'maturity': np.int64,
+               'payment_period': np.int64, 'bank': np.int64}
+
+    def __init__(self, flow_type, retention='full'):
+        if retention not in ('off', 'full') and not (isinstance(retention, int) and retention > 0):
+            raise ValueError(f'Unsupported ledger retention {retention!r}')
+        self.flow_type = flow_type
+        self.retention = retention
+        self.n_days = 0  # сколько дней записано за всё время
+        self.n_applications = 0  # сколько заявок записано за всё время
+        self.first_day = 0  # первый хранимый день
+        self._offsets = [0]  # границы хранимых дней в массивах
+        self._start = 0  # начало первого хранимого дня в массивах
+        self._size = 0
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in self._dtypes.items()}
+
+    def record(self, batch):
+        """
+        Дописывает заявки очередного дня
+        :param batch: FlowBatch со всеми заявками дня
+        """
+        self.n_days += 1
+        self.n_applications += len(batch)
+        if self.retention == 'off':
+            self.first_day = self.n_days
+            return
+
+        n = len(batch)
+        if self._size + n > len(self._columns['volume']):
+            self._compact(self._size + n)
+        for name in self._dtypes:
+            self._columns[name][self._size:self._size + n] = getattr(batch, name)
+        self._size += n
+        self._offsets.append(self._size)
+
+        # Забываем дни, которые вышли за окно хранения
+        if self.retention != 'full' and len(self._offsets) - 1 > self.retention:
+            drop = len(self._offsets) - 1 - self.retention
+            self._offsets = self._offsets[drop:]
+            self._start = self._offsets[0]
+            self.first_day += drop
+
+    def _compact(self, required):
+        # Сдвигаем хранимые дни в начало и при необходимости увеличиваем ёмкость
+        live = self._size - self._start
+        capacity = max(len(self._columns['volume']), 16)
+        while capacity < required - self._start:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:live] = column[self._start:self._size]
+            self._columns[name] = grown
+        self._offsets = [offset - self._start for offset in self._offsets]
+        self._size = live
+        self._start = 0
+
+    def day(self, day):
+        """
+        Возвращает заявки дня day (номер шага, начиная с 0) в виде FlowBatch
+        """
+        if not self.first_day <= day < self.n_days:
+            raise KeyError(f'Day {day} is not retained in the {self.flow_type} ledger '
+                           f'(retained days: {self.first_day}..{self.n_days - 1})')
+        i = day - self.first_day
+        rows = slice(self._offsets[i], self._offsets[i + 1])
+        return FlowBatch(self.flow_type, **{name: column[rows].copy() for name, column in self._columns.items()})
+
+    def days(self):
+        return range(self.first_day, self.n_days)
+
+    def get_state(self, prefix, arrays):
+        """
+        Состояние журнала для контрольной точки (см. HistoryList.get_state)
+        """
+        for name, column in self._columns.items():
+            arrays[f'{prefix}.{name}'] = column[self._start:self._size]
+        return {'flow_type': self.flow_type, 'retention': self.retention, 'n_days': self.n_days,
+                'n_applications': self.n_applications, 'first_day': self.first_day,
+                'offsets': [offset - self._start for offset in self._offsets]}
+
+    @classmethod
+    def from_state(cls, meta, arrays, prefix):
+        ledger = cls(meta['flow_type'], meta['retention'])
+        ledger.n_days = meta['n_days']
+        ledger.n_applications = meta['n_applications']
+        ledger.first_day = meta['first_day']
+        ledger._offsets = list(meta['offsets'])
+        ledger._columns = {name: np.array(arrays[f'{prefix}.{name}'], dtype=dtype)
+                           for name, dtype in cls._dtypes.items()}
+        ledger._size = len(ledger._columns['volume'])
+        return ledger
+
+    def counts(self):
+        """
+        Количество заявок по хранимым дням
+        """
+        return np.diff(self._offsets)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def __len__(self):
+        return self.n_days - self.first_day
+
+    def __getitem__(self, day):
+        return self.day(day)
+
+    def __iter__(self):
+        for day in self.days():
+            yield self.day(day)
+
+    def _string_representation(self):
+        return f'{self.flow_type.title()} ledger: {len(self)} of {self.n_days} days retained'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def ledger_retention(settings, recorder):
+    """
+    Хранение журнала заявок по настройке ledger_retention. По умолчанию (None)
+    журнал хранится целиком, а при записи траекторий на диск не хранится вовсе:
+    иначе он рос бы в памяти, которую такой recorder должен ограничивать.
+    'full' вместе с записью на диск - ошибка.
+    """
+    retention = settings.get('ledger_retention')
+    if recorder.path is None:
+        return 'full' if retention is None else retention
+    if retention == 'full':
+        raise ValueError(f"Ledger retention 'full' grows in memory while trajectories go to {recorder.path!r}; "
+                         f"use 'off' or a number of days")
+    return 'off' if retention is None else retention
+
+
 class Bank:
-    def __init__(self, name):
+    def __init__(self, name, rng=None, model_settings=None, keep_history=True):
+        """
+        :param model_settings: Настройки модели, по умолчанию settings из settings.py
+        :param keep_history: Копить ли cash_history, delta_history, reliability_history и
+            историю книг в списках
+        """
         self.name = name
+        self.keep_history = keep_history
+        self.settings = settings if model_settings is None else model_settings
+        self.rng = np.random.default_rng(rng)
         self.cash = 0
-        self.risk_tolerance = np.random.uniform(0,0.1)
+        self.risk_tolerance = self.rng.uniform(0,0.1)
         self.reserves_to_cb = 0
 
-        self.deposits = HistoryList()
-        self.credits = HistoryList()
+        self.deposits = HistoryList(keep_history=keep_history)
+        self.credits = HistoryList(keep_history=keep_history)
 
-        self.deposit_apps = []
-        self.credit_apps = []
+        self.deposit_apps = FlowBatch.empty('deposit')
+        self.credit_apps = FlowBatch.empty('credit')
 
         self.cash_history = []
         self.delta_history = []
         self.reliability_history = []
 
         self.delta = 0
-        self.fixed_costs = settings['bank_fixed_costs']
-        self.operating_costs = settings['bank_operating_costs']
+        self.fixed_costs = self.settings['bank_fixed_costs']
+        self.operating_costs = self.settings['bank_operating_costs']
 
     def set_reliability(self):
-        self.reliability = self.cash / 2e6
-        self.reliability_history.append(self.reliability)
+        # С горизонтом прогноза надёжность считается по минимальному прогнозному кэшу
+        horizon = self.settings.get('reliability_horizon', 0)
+        cash = self.cash
+        if horizon:
+            gap = self.liquidity_gap(horizon)
+            cash = min(cash, gap.min())
+        self.reliability = cash / self.settings.get('reliability_scale', 2e6)
+        if self.keep_history:
+            self.reliability_history.append(self.reliability)
 
     def set_delta(self):
-        if self.reliability >= 1:
-            delta = 0.03
-        elif self.reliability > 0.75:
-            delta = 0.02
-        elif self.reliability > 0.6:
-            delta = 0.01
+        top, high, low = self.settings.get('delta_thresholds', (1, 0.75, 0.6))
+        top_rate, high_rate, low_rate = self.settings.get('delta_rates', (0.03, 0.02, 0.01))
+        if self.reliability >= top:
+            delta = top_rate
+        elif self.reliability > high:
+            delta = high_rate
+        elif self.reliability > low:
+            delta = low_rate
         else:
             delta = 0
 
         self.delta = delta
-        self.delta_history.append(self.delta)
+        if self.keep_history:
+            self.delta_history.append(self.delta)
 
     def validate(self):
         # 1. Принять все депозиты, назначить им ставки
-        for deposit in self.deposit_apps:
-            deposit.update_rate(self.delta)
-            self.deposits.append(deposit)
-            self.reserves_to_cb += settings['cb_reserve_rate'] * deposit.volume
+        self.deposit_apps.update_rate(self.delta)
+        self.deposits.extend(self.deposit_apps)
+        self.reserves_to_cb += self.settings['cb_reserve_rate'] * self.deposit_apps.volume.sum()
 
         # Принять кредит, если есть кэш на него
-        free_cash = deepcopy(self.cash)
-        # Массив для подвержденных заявок (тк он отличается от массива всех заявок)
-        approved = []
-        for credit in self.credit_apps:
-            credit.update_rate(self.delta)
-            if free_cash >= credit.volume:  # почему-то не работает
-                self.credits.append(credit)
-                approved.append(credit)
-                free_cash -= credit.volume
-            elif free_cash < credit.volume:
-                prob = np.random.uniform(0, 0.3)  # генерируем случайную "рисковость" актива
-                if prob <= self.risk_tolerance:  # если его рисковость устраивает банк - выдает кредит
-                    self.credits.append(credit)
-                    approved.append(credit)
-                    free_cash -= credit.volume
+        self.credit_apps.update_rate(self.delta)
+        # Маска подвержденных заявок (тк она отличается от массива всех заявок)
+        approved = self.underwrite(self.credit_apps.volume)
+        self.credits.extend(self.credit_apps[approved])
 
         # 2. Посчитать текущие обязательства
 
         # Кредиты, которые выдаст по заявкам
-        credits_to_give = sum(credit.volume for credit in approved)
-
-        # Проценты по депозитам, которые нужно выплатить сегодня
-        deposit_coupon_to_return = sum(
-           deposit.volume * deposit.rate/(360/deposit.payment_period) for deposit in self.deposits if deposit.days_to_pay == 0)
-
-        # Разделить депозиты на те, что возвращаем сегодня и на те, что пока что остаются
-        self.deposits_to_return = []
-        deposits_to_stay = []
-
-        for deposit in self.deposits:
-            # Если депозит истекает сегодня
-            if deposit.maturity == 0:
-                self.deposits_to_return.append(deposit)
-                self.deposits.update_history_removed(deposit)
-            # Если депозит не истекает сегодня
-            else:
-                # Уменьшаем срок до истечения на 1.
-                deposit.maturity -= 1
-                # Уменьшаем количество дней до следующей выплаты, а если сейчас ноль, то ставим новый период
-                deposit.days_to_pay = deposit.payment_period if deposit.days_to_pay == 0 else deposit.days_to_pay - 1
-                deposits_to_stay.append(deposit)
-
+        credits_to_give = self.credit_apps.volume[approved].sum()
 
-        self.deposits = HistoryList(
-                values=deposits_to_stay, histories=self.deposits.histories, history_values=self.deposits.history_values)
-
-        deposits_volume_to_return = sum(deposit.volume for deposit in self.deposits_to_return)
+        # Проценты по депозитам, которые нужно выплатить сегодня, и объём депозитов,
+        # которые возвращаем сегодня; остальные депозиты остаются в книге
+        deposit_coupon_to_return, deposits_volume_to_return = self.deposits.roll()
 
         # Сумма всех обязательств банка на сегодня
         self.current_obligations = (deposits_volume_to_return + deposit_coupon_to_return + credits_to_give) \
@@ -202,31 +773,11 @@ class Bank:
 
         # 3. Посчитать текущие притоки
         # Депозиты, которые поступят на счет банка
-        deposits_to_get = sum(deposit.volume for deposit in self.deposit_apps)
-
-        # Проценты по кредитам, которые должны прийти сегодня
-        credit_coupon_to_get = sum(
-           credit.volume * credit.rate/(360/credit.payment_period) for credit in self.credits if credit.days_to_pay == 0)
-
-        # Разделяем кредиты на те, которые нам будут возвращать сегодня и те, которые останутся
-        self.credits_to_get = []
-        credits_to_stay = []
-        for credit in self.credits:
-            # Если истекает сегодня
-            if credit.maturity == 0:
-                self.credits_to_get.append(credit)
-                self.credits.update_history_removed(credit)
-            # Если кредит не истекает сегодня
-            else:
-                credit.maturity -= 1
-                credit.days_to_pay = credit.payment_period if credit.days_to_pay == 0 else credit.days_to_pay - 1
-                credits_to_stay.append(credit)
+        deposits_to_get = self.deposit_apps.volume.sum()
 
-        self.credits = HistoryList(
-            values=credits_to_stay, histories=self.credits.histories, history_values=self.credits.history_values)
-
-        # Сумма кредитов, которые банку вернут сегодня
-        credits_volume_to_get = sum(credit.volume for credit in self.credits_to_get)
+        # Проценты по кредитам, которые должны прийти сегодня, и сумма кредитов,
+        # которые банку вернут сегодня
+        credit_coupon_to_get, credits_volume_to_get = self.credits.roll()
 
         # Сумма всех притоков денег банку за день
         self.current_inflows = credits_volume_to_get + credit_coupon_to_get + deposits_to_get
@@ -236,6 +787,41 @@ class Bank:
 
 
 
+    def underwrite(self, volume):
+        """
+        Одобрение пачки кредитных заявок по очереди: заявка одобряется, если на неё
+        хватает свободного кэша, иначе - если её случайная "рисковость" из U(0, 0.3)
+        устраивает банк (не выше risk_tolerance). Одобренная заявка уменьшает свободный кэш.
+        Рисковость разыгрывается для всех заявок одним вызовом, а подряд идущие заявки,
+        которые помещаются в кэш, находятся по кумулятивной сумме объёмов.
+        :return: Маска одобренных заявок
+        """
+        n = len(volume)
+        risky = self.rng.uniform(0, 0.3, n) <= self.risk_tolerance
+        approved = np.zeros(n, dtype=bool)
+        # Минимальный объём среди оставшихся заявок: когда кэша меньше, помещаться больше нечему
+        smallest = np.minimum.accumulate(volume[::-1])[::-1]
+        # Кумулятивная сумма считается один раз, поиск идёт со сдвигом на уже пройденные заявки
+        cumulative = np.cumsum(volume)
+        free_cash = self.cash
+        position = 0
+        while position < n:
+            if free_cash < smallest[position]:
+                approved[position:] = risky[position:]
+                break
+            passed = cumulative[position - 1] if position else 0.0
+            fits = int(np.searchsorted(cumulative[position:], passed + free_cash, side='right'))
+            approved[position:position + fits] = True
+            free_cash -= volume[position:position + fits].sum()
+            position += fits
+            # Первая не поместившаяся заявка идёт по рисковому пути
+            if position < n:
+                if risky[position]:
+                    approved[position] = True
+                    free_cash -= volume[position]
+                position += 1
+        return approved
+
     def solve(self):
 
         # Пересчет издержек в зависимости от объема операционной деятельности
@@ -253,7 +839,7 @@ class Bank:
         #assert self.solved == True
 
         if not self.solved:  # если не может покрыть долги сам - идет на МБК
-            self.loan_amount = - self.cash + np.random.randint(1e5, 1e6)
+            self.loan_amount = - self.cash + self.rng.integers(1e5, 1e6)
 
     def restart(self):
         # Обновим историю в кредитах и депозитах
@@ -261,8 +847,8 @@ class Bank:
         self.credits.update_history()
 
         # Обнуляем состояния переменных
-        self.deposit_apps = []
-        self.credit_apps = []
+        self.deposit_apps = FlowBatch.empty('deposit')
+        self.credit_apps = FlowBatch.empty('credit')
 
         #assert self.solved, 'Bank must be solved at the end of day'
         self.current_obligations = 0
@@ -271,10 +857,8 @@ class Bank:
 
         #assert self.loan_amount == 0, f'Loan amount must be zero during clearing. Current loan amount is {self.loan_amount}'
 
-        self.deposits_to_return = []
-        self.credits_to_get = []
-
-        self.cash_history.append(self.cash)
+        if self.keep_history:
+            self.cash_history.append(self.cash)
 
         self.set_reliability()
         self.set_delta()
@@ -282,6 +866,57 @@ class Bank:
 
 
 
+    def liquidity_ladder(self, horizon):
+        """
+        Прогноз притоков и оттоков банка на horizon дней по его книгам: погашения
+        и купоны кредитов (притоки) и депозитов (оттоки) по типам потоков, без новых заявок
+        :return: Массив (horizon, len(LADDER_COLUMNS)) в порядке LADDER_COLUMNS
+        """
+        columns = []
+        for book, _, flow_types in LADDER_BOOKS:
+            coupons, principal = getattr(self, book).ladder(horizon)
+            for flow_type in flow_types:
+                columns.append(principal[:, FLOW_CODES[flow_type]])
+                columns.append(coupons[:, FLOW_CODES[flow_type]])
+        return np.stack(columns, axis=1)
+
+    def liquidity_gap(self, horizon):
+        """
+        Прогнозный кэш банка на конец каждого из horizon дней: текущий кэш плюс
+        накопленные чистые притоки по лестнице погашений
+        """
+        ladder = self.liquidity_ladder(horizon)
+        net = ladder[:, :LADDER_INFLOWS].sum(axis=1) - ladder[:, LADDER_INFLOWS:].sum(axis=1)
+        return self.cash + np.cumsum(net)
+
+    # Скалярное состояние банка между шагами модели (None - атрибут ещё не задан)
+    _state_attributes = ['cash', 'risk_tolerance', 'reserves_to_cb', 'delta', 'reliability', 'fixed_costs',
+                         'operating_costs', 'current_obligations', 'current_inflows', 'solved', 'loan_amount']
+
+    def get_state(self, prefix, arrays):
+        """
+        Состояние банка между шагами модели для контрольной точки: скаляры
+        возвращаются словарём, книги и истории кладутся в arrays
+        """
+        meta = {'name': self.name, 'keep_history': self.keep_history,
+                'attributes': {name: _plain(getattr(self, name, None)) for name in self._state_attributes},
+                'deposits': self.deposits.get_state(f'{prefix}.deposits', arrays),
+                'credits': self.credits.get_state(f'{prefix}.credits', arrays)}
+        for name in ('cash_history', 'delta_history', 'reliability_history'):
+            arrays[f'{prefix}.{name}'] = np.array(getattr(self, name), dtype=np.float64)
+        return meta
+
+    def set_state(self, meta, arrays, prefix):
+        self.name = meta['name']
+        self.keep_history = meta['keep_history']
+        for name, value in meta['attributes'].items():
+            if value is not None:
+                setattr(self, name, value)
+        self.deposits = HistoryList.from_state(meta['deposits'], arrays, f'{prefix}.deposits')
+        self.credits = HistoryList.from_state(meta['credits'], arrays, f'{prefix}.credits')
+        for name in ('cash_history', 'delta_history', 'reliability_history'):
+            setattr(self, name, arrays[f'{prefix}.{name}'].tolist())
+
     def get_cash(self):
         print(f"Net Assets of bank '{self.name}' = {self.cash}")
 
@@ -497,26 +1132,87 @@ class Market:
     def __repr__(self):
         return self._string_representation()
 
+class RandomStreams:
+    """
+    Источники случайности модели по назначениям.
+    В режиме 'shared' все назначения берут числа из одного генератора rng.
+    В режиме 'common' у каждого назначения, дня и банка свой генератор из
+    SeedSequence(entropy, spawn_key=(назначение, день, банк)): изменение одной
+    части модели (например, объёма заявок после шока) не сдвигает случайные
+    числа остальных частей и следующих дней - это общие случайные числа
+    для парного сравнения сценариев.
+    """
+    PURPOSES = ['world', 'deposit', 'credit', 'underwriting', 'funding', 'interbank', 'loans']
+
+    def __init__(self, rng=None, common=False, entropy=None):
+        self.rng = np.random.default_rng(rng)
+        self.common = common
+        if common and entropy is None:
+            entropy = int(self.rng.integers(2 ** 63))
+        self.entropy = entropy
+        self._codes = {purpose: code for code, purpose in enumerate(self.PURPOSES)}
+
+    def get(self, purpose, day=0, bank=None):
+        """
+        Генератор для назначения purpose в день day (и банка номер bank)
+        """
+        if not self.common:
+            return self.rng
+        key = (self._codes[purpose], day, 0 if bank is None else bank + 1)
+        return np.random.Generator(np.random.PCG64(np.random.SeedSequence(self.entropy, spawn_key=key)))
+
+    def _string_representation(self):
+        return f'Common random streams {self.entropy}' if self.common else 'Shared random stream'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
 class BankModel:
-    def __init__(self, start_settings):
+    def __init__(self, start_settings, rng=None, recorder=None, profiler=None, metrics=None, shocks=None):
+        """
+        :param rng: np.random.Generator (или seed) - источник случайности модели; при
+            random_streams='common' из него берётся только entropy потоков RandomStreams
+        :param recorder: HistoryRecorder для траекторий модели. По умолчанию всё хранится
+            в памяти; если у него задан path, куски пишутся на диск, а банки не копят
+            историю в списках
+        :param profiler: profiling.StepProfiler для замера фаз шага; по умолчанию выключено
+        :param metrics: metrics.MetricsRegistry записываемых метрик; по умолчанию встроенные
+            метрики с шагом записи из настроек
+        :param shocks: Шоки настроек {номер шага: {ключ настроек: значение}}, см. schedule_shock
+        """
 
         #self.start_settings = start_settings
         self.settings = start_settings
+        self.streams = RandomStreams(rng, self.settings.get('random_streams', 'shared') == 'common')
+        self.rng = self.streams.rng
+        self.shocks = {}
+        for step, changes in (shocks or {}).items():
+            self.schedule_shock(step, **changes)
+        self.recorder = HistoryRecorder() if recorder is None else recorder
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.metrics = MetricsRegistry.default(self.settings) if metrics is None else metrics
+        self.day = 0
+        keep_history = self.recorder.path is None
 
         # В модели есть Банки и Центральный Банк
-        self.banks = [Bank(f'Bank_{id}') for id in range(1, 21)]
-        self.cb = Bank('Central_Bank')
+        n_banks = self.settings.get('banks_number', 20)
+        self.banks = [Bank(f'Bank_{id}', self.streams.get('world', bank=id - 1), self.settings, keep_history)
+                      for id in range(1, n_banks + 1)]
+        self.cb = Bank('Central_Bank', self.streams.get('world', bank=n_banks), self.settings, keep_history)
+        self._positions = {id(bank): i for i, bank in enumerate(self.banks)}
+        # Кто кому должен по МБК и кто должен ЦБ
+        self.exposures = ExposureNetwork(n_banks)
         self.solved_banks = []
         self.unsolved_banks = []
 
-        # Массивы всей модели для отрисовки графиков
-        self.system_liquidity_history = []
-        self.system_mbk_credits = []
-        self.cb_credits_history = []
-        self.hhi_history = []
-        self.banks_dict = {bank.name: bank.cash_history for bank in self.banks}
-        self.system_credits_history = []
-        self.system_deposits_history = []
+        # Журналы всех сгенерированных заявок
+        retention = ledger_retention(self.settings, self.recorder)
+        self.system_deposits = ApplicationLedger('deposit', retention)
+        self.system_credits = ApplicationLedger('credit', retention)
 
 
     def create_world(self, cb_cash=1e12):
@@ -526,170 +1222,411 @@ class BankModel:
         :return: Создает стартовое состояние мира
         """
         self.cb.cash += cb_cash
-        self.cb.cash_history.append(self.cb.cash)
+        if self.cb.keep_history:
+            self.cb.cash_history.append(self.cb.cash)
 
         # Добавляем банкам ликвидность согласно стартовым настройкам
+        shares = liquidity_shares(self.settings, len(self.banks), self.streams.get('world'))
         for bank in range(len(self.banks)):
-            self.banks[bank].cash = np.array(settings["liquid_distribution"])[bank] * 1e10
-            self.banks[bank].cash_history.append(self.banks[bank].cash)
+            self.banks[bank].cash = shares[bank] * 1e10
+            if self.banks[bank].keep_history:
+                self.banks[bank].cash_history.append(self.banks[bank].cash)
             self.banks[bank].set_reliability()
             self.banks[bank].set_delta()
 
-        self.system_liquidity_history.append(sum([bank.cash for bank in self.banks]))
-
-    def hhi_index(self, system_liquidity):
-        return sum([(((bank.cash/system_liquidity)*100)**2) for bank in self.banks])
-
-    def run(self, n_steps):
-        """
-        Запускает симуляцию, которая длится n_steps дней
-        :param n_steps: Количество шагов модели
-        :return: Данные модели
-        """
-        self.system_deposits = []
-        self.system_credits = []
-
-        for _ in range(n_steps):
-
-            # 4 - генерация Потоков
-            deposit_supply = []
-            credit_supply = []
+        self.metrics.record_initial(self, self.recorder)
 
-            for _ in range(np.random.randint(self.settings["deposit_amount_bound"][0],
-                                             self.settings["deposit_amount_bound"][1])):  # генерируем депозиты
-                deposit = Flow('deposit')
-                deposit_supply.append(deposit)  # создаем массив из сгенерированных депозитов
+    # Траектории модели для отрисовки графиков
+    @property
+    def system_liquidity_history(self):
+        return self.recorder.series('system_liquidity')
 
-            self.system_deposits.append(deepcopy(deposit_supply))  # записываем сгенерированные депозиты в историю
+    @property
+    def system_mbk_credits(self):
+        return self.recorder.series('mbk_credits')
 
-            for _ in range(np.random.randint(self.settings["credit_amount_bound"][0], self.settings["credit_amount_bound"][1])):
-                credit = Flow('credit')
-                credit_supply.append(credit)
+    @property
+    def cb_credits_history(self):
+        return self.recorder.series('cb_credits')
 
-            self.system_credits.append(deepcopy(credit_supply))  # записываем сгенерированные кредиты в историю
+    @property
+    def hhi_history(self):
+        return self.recorder.series('hhi')
 
-            # 5 - Распределение заявок на депозиты и кредиты по банкам
-            for deposit in deposit_supply:
-                selected_bank = np.random.choice(range(20))
-                self.banks[selected_bank].deposit_apps.append(deposit)  # отправляем ему заявку на депозит
+    @property
+    def system_credits_history(self):
+        return self.recorder.series('credits_volume')
 
-            for credit in credit_supply:
-                selected_bank = np.random.choice(range(20))  # выбираем рандомный банк
-                self.banks[selected_bank].credit_apps.append(credit)  # записываем в потенциальные заявки рандомный кредит
+    @property
+    def system_deposits_history(self):
+        return self.recorder.series('deposits_volume')
 
-            # 6 - Прием потоков и назначение ставок - включить в процесс валидации
-            for bank in self.banks:
-                bank.validate()
-                self.cb.cash += bank.reserves_to_cb
-                bank.solve()
-                if bank.solved:
-                    self.solved_banks.append(bank)
-                else:
-                    self.unsolved_banks.append(bank)
+    @property
+    def banks_dict(self):
+        cash = self.recorder.series('bank_cash')
+        return {bank.name: cash[:, i] for i, bank in enumerate(self.banks)}
 
-            self.cb.validate()
-            self.cb.solve()
-
-            # Незакрывшиеся банки отправляем на МБК
-            indeces = list(range(len(self.solved_banks)))
-            for bank in self.unsolved_banks:
-                # Для каждого банка пытаемся найти кредитора среди всех остальных
-                # Один кредитор может выдать больше одного кредита
-
-                np.random.shuffle(indeces)
-                result = False
-                for idx in indeces:
-                    result = banks_commitment(borrower=bank, creditor=self.solved_banks[idx])
-                    if result:
-                        break
-                # Если не закредитовался на МБК, санация ЦБ
-                if not result:
-                    central_bank_rescue(self.cb, bank)
-                    bank.solved = True
-
-            [bank.restart() for bank in self.banks]
-            self.solved_banks = []
-            self.unsolved_banks = []
-
-            system_liquidity = sum([bank.cash for bank in self.banks])
-            self.system_liquidity_history.append(system_liquidity + self.cb.cash)
-
-            mbk_count = 0
-            cb_count = 0
-            #deposit_count = 0
-            for bank in self.banks:
-                for credit in bank.credits.values:
-                    if credit.flow_type == 'mbk':
-                        mbk_count += 1
-
-            for credit in self.cb.credits.values:
-                if credit.flow_type == 'cb':
-                    cb_count += 1
-
-                #     elif credit.flow_type == 'credit':
-                #         credit_count += 1
-                # for deposit in bank.deposits.values:
-                #     if deposit.flow_type == 'deposit':
-                #         deposit_count += 1
-
-            self.system_mbk_credits.append(mbk_count)
-            self.system_credits_history.append(sum([credit.volume for credit in bank.credits for bank in self.banks]))
-            self.system_deposits_history.append(sum([deposit.volume for deposit in bank.deposits for bank in self.banks]))
-            self.cb.cash_history.append(self.cb.cash)
-            self.cb_credits_history.append(cb_count)
+    def get_state(self):
+        """
+        Полное состояние модели между шагами: описание (JSON-совместимый словарь)
+        и словарь массивов NumPy с книгами, журналами, историями и записанными рядами
+        """
+        arrays = {}
+        meta = {'format': CHECKPOINT_FORMAT,
+                'settings': self.settings,
+                'day': self.day,
+                'rng': self.rng.bit_generator.state,
+                'streams': {'common': self.streams.common, 'entropy': self.streams.entropy},
+                'shocks': [[step, changes] for step, changes in self.shocks.items()],
+                'banks': [bank.get_state(f'bank{i}', arrays) for i, bank in enumerate(self.banks)],
+                'cb': self.cb.get_state('cb', arrays),
+                # Свои генераторы банков; None - банк берёт числа из генератора модели
+                'bank_rngs': [None if bank.rng is self.rng else bank.rng.bit_generator.state
+                              for bank in self.banks + [self.cb]],
+                'system_deposits': self.system_deposits.get_state('system_deposits', arrays),
+                'system_credits': self.system_credits.get_state('system_credits', arrays),
+                'exposures': self.exposures.get_state('exposures', arrays),
+                'series': self.recorder.names()}
+        self.recorder.flush()
+        for name in meta['series']:
+            arrays[f'series.{name}'] = self.recorder.series(name)
+        return meta, arrays
+
+    @classmethod
+    def from_state(cls, meta, arrays, rng=None, recorder=None, profiler=None, metrics=None):
+        """
+        Восстанавливает модель из get_state
+        :param rng: Новый источник случайности; по умолчанию - генератор в том же состоянии,
+            что и при сохранении, и продолжение прогона совпадает с исходным бит в бит
+        """
+        if meta.get('format') != CHECKPOINT_FORMAT:
+            raise ValueError(f'Unsupported checkpoint format {meta.get("format")!r}')
+        model = cls(meta['settings'], recorder=recorder, profiler=profiler, metrics=metrics,
+                    shocks=dict(meta['shocks']))
+        if rng is None:
+            rng = _generator(meta['rng'])
+            model.streams = RandomStreams(rng, meta['streams']['common'], meta['streams']['entropy'])
+        else:
+            model.streams = RandomStreams(rng, meta['streams']['common'])
+        model.rng = model.streams.rng
+        model.day = meta['day']
+        for i, bank in enumerate(model.banks):
+            bank.set_state(meta['banks'][i], arrays, f'bank{i}')
+        model.cb.set_state(meta['cb'], arrays, 'cb')
+        for bank, state in zip(model.banks + [model.cb], meta['bank_rngs']):
+            bank.rng = model.rng if state is None else _generator(state)
+        model.system_deposits = ApplicationLedger.from_state(meta['system_deposits'], arrays, 'system_deposits')
+        model.system_credits = ApplicationLedger.from_state(meta['system_credits'], arrays, 'system_credits')
+        model.exposures = ExposureNetwork.from_state(meta['exposures'], arrays, 'exposures')
+        for name in meta['series']:
+            model.recorder.extend(name, arrays[f'series.{name}'])
+        return model
+
+    def checkpoint(self, path, compress=False):
+        """
+        Сохраняет полное состояние модели в один файл .npz без pickle:
+        массивы - как есть, описание - JSON в отдельном массиве байтов
+        :param compress: Сжимать массивы (файл меньше, запись медленнее)
+        """
+        meta, arrays = self.get_state()
+        header = np.frombuffer(json.dumps(meta, default=_plain).encode(), dtype=np.uint8)
+        with open(path, 'wb') as file:
+            (np.savez_compressed if compress else np.savez)(file, header=header, **arrays)
 
-            self.hhi_history.append(self.hhi_index(system_liquidity))
-            self.banks_dict = {bank.name: bank.cash_history for bank in self.banks}
+    @classmethod
+    def restore(cls, path, rng=None, recorder=None, profiler=None, metrics=None):
+        """
+        Загружает модель, сохранённую checkpoint
+        """
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(data['header'].tobytes())
+            arrays = {name: data[name] for name in data.files if name != 'header'}
+        return cls.from_state(meta, arrays, rng, recorder, profiler, metrics)
 
+    def fork(self, n, seed):
+        """
+        Создаёт n независимых копий модели из текущего состояния. Копии получают
+        свои потоки из SeedSequence(seed).spawn(n); продолжить тот же поток, что и
+        у модели, можно через from_state(*get_state())
+        :param seed: Seed копий (целое число или SeedSequence), обязателен
+        :return: Список моделей
+        """
+        if seed is None:
+            raise ValueError('fork needs a seed, otherwise the branches are not reproducible')
+        meta, arrays = self.get_state()
+        return [BankModel.from_state(meta, arrays, rng=np.random.default_rng(child))
+                for child in np.random.SeedSequence(seed).spawn(n)]
 
+    def liquidity_ladders(self, horizon):
+        """
+        Лестницы погашений всех банков (без ЦБ)
+        :return: Массив (количество банков, horizon, len(LADDER_COLUMNS))
+        """
+        return np.stack([bank.liquidity_ladder(horizon) for bank in self.banks])
 
-def banks_commitment(borrower, creditor):
+    def liquidity_ladder(self, horizon, include_cb=False):
+        """
+        Лестница погашений сектора: сумма лестниц банков (и ЦБ)
+        :return: Массив (horizon, len(LADDER_COLUMNS))
+        """
+        ladder = self.liquidity_ladders(horizon).sum(axis=0)
+        return ladder + self.cb.liquidity_ladder(horizon) if include_cb else ladder
 
-    creditor_ability = creditor.cash
+    def clearing_vector(self, external_assets=None):
+        """
+        Платежи и дефолты по Эйзенбергу-Ное на текущей сети МБК (см. network.eisenberg_noe)
+        :param external_assets: Активы банков вне МБК, по умолчанию - их кэш
+        """
+        if external_assets is None:
+            external_assets = np.array([bank.cash for bank in self.banks], dtype=np.float64)
+        return eisenberg_noe(self.exposures, external_assets)
 
-    # Проверяем, может ли потенциальный кредитор выдать кредит на всю сумму текущего долга
-    if creditor_ability >= borrower.loan_amount:
-        loan_flow = Flow('mbk', borrower.loan_amount)
+    def debt_rank(self, shocked, shock=1.0):
+        """
+        DebtRank шока банков shocked, капитал банка - его кэш (см. network.debt_rank)
+        """
+        equity = np.array([bank.cash for bank in self.banks], dtype=np.float64)
+        return debt_rank(self.exposures, equity, shocked, shock)
 
-        # В случае успеха добавляем поток как кредит одной стороне и как депозит другой
-        borrower.deposits.append(loan_flow)
-        creditor.credits.append(deepcopy(loan_flow))
-        # self.mbk.append()
+    def default_cascade(self, defaulted, loss_given_default=1.0):
+        """
+        Каскад дефолтов от банков defaulted, капитал банка - его кэш (см. network.default_cascade)
+        """
+        equity = np.array([bank.cash for bank in self.banks], dtype=np.float64)
+        return default_cascade(self.exposures, equity, defaulted, loss_given_default)
 
-        borrower.cash += borrower.loan_amount
-        creditor.cash -= borrower.loan_amount
+    def schedule_shock(self, step, **changes):
+        """
+        Планирует шок: перед шагом номер step (day модели в начале шага) настройки
+        меняются на changes, например schedule_shock(365, cb_rate=0.2)
+        """
+        self.shocks.setdefault(int(step), {}).update(changes)
 
-        # Помечаем банк как разрешённый и возвращаем маркер успеха
-        borrower.solved = True
-        borrower.loan_amount = 0
+    def impose_shock(self, changes):
+        """
+        Применяет изменения настроек к модели и банкам. Исходный словарь настроек
+        не меняется - модель переходит на свою копию
+        """
+        self.settings = dict(self.settings, **changes)
+        for bank in self.banks + [self.cb]:
+            bank.settings = self.settings
+            bank.fixed_costs = self.settings['bank_fixed_costs']
+            bank.operating_costs = self.settings['bank_operating_costs']
 
-        return True
-    # Если у кредитора недостаточно денег, чтобы покрыть весь объём, то он отдаёт максимум, который может
-    else:
+    def clear_interbank(self):
+        """
+        Рынок МБК за день: распределяет потребности незакрывшихся банков (loan_amount)
+        по кэшу закрывшихся одним вызовом clear_interbank и записывает получившиеся
+        кредиты МБК и ЦБ в книги пачками
+        """
+        if not self.unsolved_banks:
+            return
+        creditor_cash = np.array([bank.cash for bank in self.solved_banks], dtype=np.float64)
+        loan_amounts = np.array([bank.loan_amount for bank in self.unsolved_banks], dtype=np.float64)
+        (mbk_borrower, mbk_creditor, mbk_volume), (cb_borrower, cb_volume) = clear_interbank(
+            loan_amounts, creditor_cash, self.streams.get('interbank', self.day),
+            self.settings.get('mbk_matching', 'random'))
+
+        self.profiler.count('mbk_attempts', len(mbk_volume))
+        self.profiler.count('cb_rescues', len(cb_volume))
+
+        for bank, cash in zip(self.solved_banks, creditor_cash):
+            bank.cash = cash
+        for bank, loan_amount in zip(self.unsolved_banks, loan_amounts):
+            bank.cash += loan_amount
+            bank.loan_amount = 0
+            bank.solved = True
+        self.cb.cash -= cb_volume.sum()
+
+        rng = self.streams.get('loans', self.day)
+        borrowers = np.array([self._positions[id(bank)] for bank in self.unsolved_banks])
+        creditors = np.array([self._positions[id(bank)] for bank in self.solved_banks], dtype=np.int64)
+        maturity = self._book_loans('mbk', [self.unsolved_banks[i] for i in mbk_borrower],
+                                    [self.solved_banks[i] for i in mbk_creditor], mbk_volume, rng)
+        # Кредит выдан после дневного прохода книг и гасится на проходе через maturity + 1 дней
+        self.exposures.add(creditors[mbk_creditor], borrowers[mbk_borrower], mbk_volume, self.day + 1 + maturity)
+        maturity = self._book_loans('cb', [self.unsolved_banks[i] for i in cb_borrower],
+                                    [self.cb] * len(cb_volume), cb_volume, rng)
+        self.exposures.add(np.full(len(cb_volume), self.exposures.cb), borrowers[cb_borrower], cb_volume,
+                           self.day + 1 + maturity)
+
+    def _book_loans(self, flow_type, borrowers, creditors, volume, rng):
+        # Кредит записывается заёмщику в депозиты, а кредитору - в кредиты; возвращает сроки кредитов
+        if len(volume) == 0:
+            return np.empty(0, dtype=np.int64)
+        maturity = rng.choice(self.settings[f'{flow_type}_maturity'], len(volume))
+        payment_period = rng.choice(self.settings['payment_period'], len(volume))
+        for book, banks in (('deposits', borrowers), ('credits', creditors)):
+            owners = np.array([id(bank) for bank in banks])
+            for bank in {id(bank): bank for bank in banks}.values():
+                mine = owners == id(bank)
+                getattr(bank, book).append_arrays(volume[mine], self.settings['cb_rate'], maturity[mine],
+                                                  payment_period[mine], FLOW_CODES[flow_type])
+        return maturity
+
+    def flows(self, flow_type, n, volume=None, rate=None, purpose='loans', bank=None):
+        """
+        Отдельные потоки Flow со случайными числами из потоков модели: в режиме
+        'common' - из потока (purpose, текущий день, bank), поэтому повторный вызов
+        с тем же ключом в тот же день даёт те же потоки
+        :param n: Количество потоков
+        :return: Список Flow
+        """
+        rng = self.streams.get(purpose, self.day, bank)
+        return [Flow(flow_type, volume, rate, rng, self.settings) for _ in range(n)]
 
-        loan_flow = Flow('mbk', creditor_ability)
+    def book_totals(self, book):
+        """
+        Текущие количество и объём потоков по банкам и типам
+        :param book: 'deposits' или 'credits'
+        :return: Два массива формы (количество банков, len(FLOW_TYPES))
+        """
+        counts = np.array([getattr(bank, book).counts for bank in self.banks])
+        volumes = np.array([getattr(bank, book).volumes for bank in self.banks])
+        return counts, volumes
 
-        borrower.deposits.append(loan_flow)
-        creditor.credits.append(deepcopy(loan_flow))
+    def hhi_index(self):
+        return hhi(np.array([bank.cash for bank in self.banks], dtype=np.float64))
 
-        borrower.cash += creditor_ability
-        creditor.cash -= creditor_ability
+    def run(self, n_steps):
+        """
+        Запускает симуляцию, которая длится n_steps дней
+        :param n_steps: Количество шагов модели
+        :return: Данные модели
+        """
+        profiler = self.profiler
+        for _ in range(n_steps):
+            profiler.start_step()
+            if self.day in self.shocks:
+                self.impose_shock(self.shocks[self.day])
+            self.exposures.expire(self.day)
+
+            # 4 - генерация Потоков: все заявки дня генерируются пачкой
+            with profiler.phase('generation'):
+                deposit_rng = self.streams.get('deposit', self.day)
+                credit_rng = self.streams.get('credit', self.day)
+                n_banks = len(self.banks)
+                routing = self.settings.get('applications_routing', 'uniform')
+                top_rate = max(self.settings.get('delta_rates', (0.03, 0.02, 0.01)))
+                cash = np.array([bank.cash for bank in self.banks], dtype=np.float64)
+                delta = np.array([bank.delta for bank in self.banks], dtype=np.float64)
+                deposit_supply = FlowBatch.generate(
+                    'deposit', deposit_rng.integers(self.settings["deposit_amount_bound"][0],
+                                                    self.settings["deposit_amount_bound"][1]), n_banks, self.settings,
+                    deposit_rng, routing_weights(routing, 'deposit', cash, delta, top_rate))
+                self.system_deposits.record(deposit_supply)  # записываем сгенерированные депозиты в историю
+
+                credit_supply = FlowBatch.generate(
+                    'credit', credit_rng.integers(self.settings["credit_amount_bound"][0],
+                                                  self.settings["credit_amount_bound"][1]), n_banks, self.settings,
+                    credit_rng, routing_weights(routing, 'credit', cash, delta, top_rate))
+                self.system_credits.record(credit_supply)  # записываем сгенерированные кредиты в историю
+            profiler.count('flows_scanned', len(deposit_supply) + len(credit_supply))
+
+            # 5 - Распределение заявок на депозиты и кредиты по банкам (банк получает свой срез пачки)
+            with profiler.phase('distribution'):
+                for bank, deposit_apps, credit_apps in zip(self.banks, deposit_supply.split(n_banks),
+                                                           credit_supply.split(n_banks)):
+                    bank.deposit_apps = deposit_apps
+                    bank.credit_apps = credit_apps
 
-        # Уменьшаем текущий долг и возвращаем маркер незакрытого банка
-        borrower.loan_amount -= creditor_ability
-        return False
+            # 6 - Прием потоков и назначение ставок - включить в процесс валидации
+            for number, bank in enumerate(self.banks):
+                with profiler.phase('validate', number):
+                    bank.rng = self.streams.get('underwriting', self.day, number)
+                    bank.validate()
+                    self.cb.cash += bank.reserves_to_cb
+                with profiler.phase('solve'):
+                    bank.rng = self.streams.get('funding', self.day, number)
+                    bank.solve()
+                if bank.solved:
+                    self.solved_banks.append(bank)
+                else:
+                    self.unsolved_banks.append(bank)
+            profiler.count('unsolved_banks', len(self.unsolved_banks))
+
+            with profiler.phase('cb'):
+                self.cb.validate()
+                self.cb.solve()
+
+            # Незакрывшиеся банки отправляем на МБК, остаток долга покрывает ЦБ
+            with profiler.phase('clearing'):
+                self.clear_interbank()
+
+            with profiler.phase('restart'):
+                [bank.restart() for bank in self.banks]
+                self.solved_banks = []
+                self.unsolved_banks = []
+
+            self.day += 1
+            if self.cb.keep_history:
+                self.cb.cash_history.append(self.cb.cash)
+            with profiler.phase('metrics'):
+                self.metrics.record(self, self.recorder, self.day)
+
+            profiler.end_step()
+
+        self.recorder.flush()
+
+
+def clear_interbank(loan_amounts, creditor_cash, rng, matching='random'):
+    """
+    Клиринг рынка МБК за день. Заёмщики по очереди забирают у кредиторов весь их
+    кэш, пока не покроют потребность, остаток покрывает ЦБ.
+    matching='random' - каждый заёмщик обходит кредиторов в своём случайном порядке
+    (включая пустые кредиты от уже опустошённых кредиторов);
+    matching='queue' - одна случайная очередь кредиторов на всех заёмщиков,
+    распределение считается одним проходом по кумулятивным суммам.
+    :param loan_amounts: Потребности заёмщиков в порядке очереди
+    :param creditor_cash: Кэш кредиторов, уменьшается на месте
+    :return: ((заёмщик, кредитор, объём) кредитов МБК, (заёмщик, объём) кредитов ЦБ)
+    """
+    if matching == 'random':
+        borrowers, creditors, volumes, rescued, remainder = [], [], [], [], []
+        for borrower, need in enumerate(loan_amounts):
+            order = rng.permutation(len(creditor_cash))
+            available = creditor_cash[order]
+            cumulative = np.cumsum(available)
+            finished = np.flatnonzero(cumulative >= need)
+            # Кредиторы до закрывшего долг отдают весь кэш, закрывший - остаток долга
+            tried = finished[0] + 1 if len(finished) else len(order)
+            allocation = np.minimum(available[:tried], need - (cumulative[:tried] - available[:tried]))
+            creditor_cash[order[:tried]] -= allocation
+            borrowers.append(np.full(tried, borrower))
+            creditors.append(order[:tried])
+            volumes.append(allocation)
+            # Если не закредитовался на МБК, санация ЦБ
+            if not len(finished):
+                rescued.append(borrower)
+                remainder.append(need - allocation.sum())
+        borrower = np.concatenate(borrowers) if borrowers else np.empty(0, dtype=np.int64)
+        creditor = np.concatenate(creditors) if creditors else np.empty(0, dtype=np.int64)
+        volume = np.concatenate(volumes) if volumes else np.empty(0)
+        rescued = np.array(rescued, dtype=np.int64)
+        remainder = np.array(remainder, dtype=np.float64)
+
+    elif matching == 'queue':
+        order = rng.permutation(len(creditor_cash))
+        supply = np.cumsum(creditor_cash[order])
+        demand = np.cumsum(loan_amounts)
+        # Отрезки между соседними точками обеих кумулятивных сумм - это отдельные кредиты
+        covered = min(supply[-1] if len(supply) else 0, demand[-1] if len(demand) else 0)
+        points = np.unique(np.concatenate(([0], supply[supply < covered], demand[demand < covered], [covered])))
+        middle = (points[:-1] + points[1:]) / 2
+        borrower = np.searchsorted(demand, middle, side='right')
+        creditor = order[np.searchsorted(supply, middle, side='right')]
+        volume = np.diff(points)
+        np.subtract.at(creditor_cash, creditor, volume)
+        # Разности кумулятивных сумм оставляют опустошённым кредиторам ошибку округления
+        creditor_cash[order[supply <= covered]] = 0
+
+        # ЦБ покрывает непокрытую кредиторами часть потребностей
+        rescued = np.flatnonzero(demand > covered)
+        remainder = demand[rescued] - np.maximum(demand[rescued] - loan_amounts[rescued], covered)
 
-# Санация центральным банком
-def central_bank_rescue(central_bank, bank):
-    # Центральный банк возмещает под небольшой процент долг банка
-    loan_amount = bank.loan_amount
-    loan_flow = Flow('cb', loan_amount)
-    central_bank.credits.append(loan_flow)
-    bank.deposits.append(deepcopy(loan_flow))
+    else:
+        raise ValueError(f'Unsupported MBK matching {matching!r}')
 
-    bank.cash += loan_amount
-    central_bank.cash -= loan_amount
-    bank.loan_amount = 0
-    return True
+    return (borrower, creditor, volume), (rescued, remainder)
 
 
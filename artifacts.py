@@ -0,0 +1,96 @@
+import json
+import os
+import numpy as np
+
+
+def _write(path, kind, arrays, meta):
+    os.makedirs(path, exist_ok=True)
+    series = {}
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        np.save(os.path.join(path, f'{name}.npy'), values)
+        series[name] = {'shape': list(values.shape), 'dtype': values.dtype.str}
+    meta = dict(meta, kind=kind, series=series)
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=1, default=float, ensure_ascii=False)
+
+
+def save_artifact(model, path, seed=None):
+    """
+    Сохраняет результаты прогона BankModel: каждый ряд записи - отдельный .npy
+    (читается через отображение в память), настройки, seed, число шагов и шаги записи
+    метрик - в meta.json
+    :param seed: seed прогона, если известен
+    """
+    recorder = model.recorder
+    recorder.flush()
+    arrays = {name: recorder.series(name) for name in recorder.names()}
+    meta = {'settings': model.settings,
+            'seed': seed,
+            'steps': model.day,
+            'banks': [bank.name for bank in model.banks],
+            'metrics': model.metrics.strides()}
+    _write(path, 'model', arrays, meta)
+
+
+def save_ensemble(result, path, settings=None):
+    """
+    Сохраняет траектории ансамбля (EnsembleResult): по массиву (прогоны, шаги) на ряд
+    """
+    meta = {'settings': settings, 'seed': result.seed, 'steps': result.steps, 'runs': len(result),
+            'metrics': result.metrics}
+    _write(path, 'ensemble', result.trajectories, meta)
+
+
+class Artifact:
+    """
+    Сохранённый результат. Ряды открываются лениво через np.memmap при первом обращении,
+    поэтому загрузка артефакта не читает данные с диска.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.kind = self.meta['kind']
+        self.settings = self.meta['settings']
+        self.seed = self.meta['seed']
+        self.steps = self.meta['steps']
+        self._opened = {}
+
+    def names(self):
+        return list(self.meta['series'])
+
+    def __getitem__(self, name):
+        if name not in self._opened:
+            if name not in self.meta['series']:
+                raise KeyError(f'Series {name!r} is not in artifact {self.path}')
+            self._opened[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._opened[name]
+
+    def __contains__(self, name):
+        return name in self.meta['series']
+
+    def days(self, name):
+        """
+        Дни модели, в которые записаны значения ряда name (ось X графиков)
+        """
+        # У ансамбля ряды - массивы (прогоны, записи)
+        length = self.meta['series'][name]['shape'][-1 if self.kind == 'ensemble' else 0]
+        metric = self.meta.get('metrics', {}).get(name)
+        if metric is None:
+            return np.arange(length)
+        first = 0 if metric['initial'] else metric['stride']
+        return first + metric['stride'] * np.arange(length)
+
+    def _string_representation(self):
+        return f'{self.kind.title()} artifact {self.path}: {self.steps} steps, {len(self.names())} series'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def load_artifact(path):
+    return Artifact(path)
@@ -0,0 +1,403 @@
+import itertools
+import numpy as np
+from agents import liquidity_shares, routing_weights, clear_interbank
+from ensemble import EnsembleResult, tracked_strides
+from settings import settings as default_settings
+
+
+class BatchedBankModel:
+    """
+    Пакетный движок: K независимых миров по n_banks банков, которые шагают
+    синхронно. Состояние банков хранится массивами формы (K, n_banks), а книги
+    депозитов и кредитов - кольцевыми календарями (дни, K, n_banks) с уже
+    разложенными купонами и погашениями. Каждая фаза шага BankModel.run
+    выполняется несколькими операциями NumPy сразу для всех миров.
+    """
+    def __init__(self, start_settings=None, n_worlds=1, rng=None):
+        self.settings = default_settings if start_settings is None else start_settings
+        self.rng = np.random.default_rng(rng)
+        self.n_worlds = n_worlds
+        self.n_banks = n_banks = self.settings.get('banks_number', 20)
+        shape = (n_worlds, n_banks)
+        self.matching = self.settings.get('mbk_matching', 'random')
+        if self.matching not in ('random', 'queue'):
+            raise ValueError(f'Unsupported MBK matching {self.matching!r}')
+
+        self.cash = np.zeros(shape)
+        self.risk_tolerance = self.rng.uniform(0, 0.1, shape)
+        self.reliability = np.zeros(shape)
+        self.delta = np.zeros(shape)
+        self.cb_cash = np.zeros(n_worlds)
+
+        # Календарь должен вмещать самый длинный поток, добавленный после дневного прохода
+        maturities = itertools.chain(*(self.settings[f'{flow_type}_maturity']
+                                       for flow_type in ('deposit', 'credit', 'mbk', 'cb')))
+        self.horizon = max(maturities) + 2
+        self.day = 0
+
+        # Книги банков: купоны и погашения по дням, живые объёмы и количество МБК-кредитов
+        self.deposit_coupons = np.zeros((self.horizon,) + shape)
+        self.deposit_maturing = np.zeros((self.horizon,) + shape)
+        self.credit_coupons = np.zeros((self.horizon,) + shape)
+        self.credit_maturing = np.zeros((self.horizon,) + shape)
+        self.mbk_maturing = np.zeros((self.horizon,) + shape, dtype=np.int64)
+        self.deposit_volume = np.zeros(shape)
+        self.credit_volume = np.zeros(shape)
+        self.mbk_count = np.zeros(shape, dtype=np.int64)
+
+        # Книга кредитов ЦБ
+        self.cb_coupons = np.zeros((self.horizon, n_worlds))
+        self.cb_maturing = np.zeros((self.horizon, n_worlds))
+        self.cb_maturing_count = np.zeros((self.horizon, n_worlds), dtype=np.int64)
+        self.cb_count = np.zeros(n_worlds, dtype=np.int64)
+
+        # Траектории: по одному массиву (K,) на шаг
+        self.system_liquidity_history = []
+        self.system_mbk_credits = []
+        self.cb_credits_history = []
+        self.hhi_history = []
+        self.system_credits_history = []
+        self.system_deposits_history = []
+        self.cb_cash_history = []
+
+    def create_world(self, cb_cash=1e12):
+        """
+        Распределяет ликвидность между банками и назначает стартовый кэш ЦБ во всех мирах
+        :param cb_cash: Объем стартовых резервов Центробанка
+        """
+        self.cb_cash += cb_cash
+        self.cb_cash_history.append(self.cb_cash.copy())
+        # Сгенерированные распределения ликвидности в каждом мире свои
+        self.cash[:] = [liquidity_shares(self.settings, self.n_banks, self.rng) * 1e10
+                        for _ in range(self.n_worlds)]
+        self.set_reliability()
+        self.set_delta()
+        self.system_liquidity_history.append(self.cash.sum(axis=1))
+
+    def set_reliability(self):
+        # С горизонтом прогноза надёжность считается по минимальному прогнозному кэшу (см. Bank.liquidity_gap)
+        horizon = self.settings.get('reliability_horizon', 0)
+        cash = self.cash
+        if horizon:
+            ahead = np.arange(horizon)
+            slots = (self.day + ahead) % self.horizon
+            within = (ahead < self.horizon)[:, None, None]
+            net = (self.credit_coupons[slots] + self.credit_maturing[slots] -
+                   self.deposit_coupons[slots] - self.deposit_maturing[slots]) * within
+            cash = np.minimum(cash, (cash + np.cumsum(net, axis=0)).min(axis=0))
+        self.reliability = cash / self.settings.get('reliability_scale', 2e6)
+
+    def set_delta(self):
+        top, high, low = self.settings.get('delta_thresholds', (1, 0.75, 0.6))
+        self.delta = np.select([self.reliability >= top, self.reliability > high, self.reliability > low],
+                               self.settings.get('delta_rates', (0.03, 0.02, 0.01)), default=0)
+
+    def hhi_index(self, system_liquidity):
+        return (((self.cash / system_liquidity[:, None]) * 100) ** 2).sum(axis=1)
+
+    def _generate(self, flow_type):
+        """
+        Заявки дня во всех мирах
+        :return: (мир, банк, объём, номер сочетания срок/период выплат) для каждой заявки
+        """
+        low, high = self.settings[f'{flow_type}_amount_bound']
+        counts = self.rng.integers(low, high, self.n_worlds)
+        n = counts.sum()
+        world = np.repeat(np.arange(self.n_worlds), counts)
+
+        # Количество заявок на банк - мультиномиальное распределение в каждом мире
+        routing = self.settings.get('applications_routing', 'uniform')
+        top_rate = max(self.settings.get('delta_rates', (0.03, 0.02, 0.01)))
+        weights = np.array([routing_weights(routing, flow_type, cash, delta, top_rate)
+                            for cash, delta in zip(self.cash, self.delta)])
+        per_bank = self.rng.multinomial(counts, weights)
+        bank = np.tile(np.arange(self.n_banks), self.n_worlds)
+        bank = np.repeat(bank, per_bank.reshape(-1))
+        volume = np.round(self.rng.uniform(*self.settings[f'{flow_type}_volume_bound'], n))
+        maturity = self.rng.integers(0, len(self.settings[f'{flow_type}_maturity']), n)
+        period = self.rng.integers(0, len(self.settings['payment_period']), n)
+        combo = maturity * len(self.settings['payment_period']) + period
+        return world, bank, volume, combo
+
+    def _aggregate(self, world, bank, values, combo, n_combos):
+        # Сумма значений по (мир, банк, сочетание срок/период)
+        index = (world * self.n_banks + bank) * n_combos + combo
+        return np.bincount(index, weights=values,
+                           minlength=self.n_worlds * self.n_banks * n_combos).reshape(
+            self.n_worlds, self.n_banks, n_combos)
+
+    def _schedule(self, coupons, maturing, volume, rate, flow_type, start):
+        """
+        Раскладывает агрегированные по сочетаниям срок/период потоки по календарю
+        :param volume: Массив (K, n_banks, сочетания)
+        """
+        combos = itertools.product(self.settings[f'{flow_type}_maturity'], self.settings['payment_period'])
+        for combo, (maturity, period) in enumerate(combos):
+            amount = volume[..., combo]
+            if not amount.any():
+                continue
+            maturing[(start + maturity) % self.horizon] += amount
+            coupon_days = (start + np.arange(period, maturity + 1, period + 1)) % self.horizon
+            coupons[coupon_days] += (amount * rate / (360 / period))[None]
+
+    def _schedule_loans(self, world, borrower, lender, volume):
+        """
+        Раскладывает по календарям кредиты МБК (lender >= 0) и кредиты ЦБ (lender == -1),
+        выданные после дневного прохода
+        """
+        start = self.day + 1
+        maturity_key = np.where(lender >= 0, 'mbk', 'cb')
+        maturity = np.empty(len(volume), dtype=np.int64)
+        for flow_type in ('mbk', 'cb'):
+            chosen = maturity_key == flow_type
+            maturity[chosen] = self.rng.choice(self.settings[f'{flow_type}_maturity'], chosen.sum())
+        period = self.rng.choice(self.settings['payment_period'], len(volume))
+
+        maturity_slot = (start + maturity) % self.horizon
+        coupon = volume * self.settings['cb_rate'] / (360 / period)
+        n_coupons = np.where(maturity >= period, (maturity - period) // (period + 1) + 1, 0)
+        rows = np.repeat(np.arange(len(volume)), n_coupons)
+        number = np.arange(rows.size) - np.repeat(np.cumsum(n_coupons) - n_coupons, n_coupons)
+        coupon_slot = (start + period[rows] + number * (period[rows] + 1)) % self.horizon
+
+        # Заёмщик получает поток в книгу депозитов
+        np.add.at(self.deposit_maturing, (maturity_slot, world, borrower), volume)
+        np.add.at(self.deposit_coupons, (coupon_slot, world[rows], borrower[rows]), coupon[rows])
+        np.add.at(self.deposit_volume, (world, borrower), volume)
+
+        # Кредитор - банк (МБК) или ЦБ
+        mbk = lender >= 0
+        mbk_rows = mbk[rows]
+        np.add.at(self.credit_maturing, (maturity_slot[mbk], world[mbk], lender[mbk]), volume[mbk])
+        np.add.at(self.mbk_maturing, (maturity_slot[mbk], world[mbk], lender[mbk]), 1)
+        np.add.at(self.credit_coupons, (coupon_slot[mbk_rows], world[rows][mbk_rows], lender[rows][mbk_rows]),
+                  coupon[rows][mbk_rows])
+        np.add.at(self.credit_volume, (world[mbk], lender[mbk]), volume[mbk])
+        np.add.at(self.mbk_count, (world[mbk], lender[mbk]), 1)
+
+        cb = ~mbk
+        np.add.at(self.cb_maturing, (maturity_slot[cb], world[cb]), volume[cb])
+        np.add.at(self.cb_maturing_count, (maturity_slot[cb], world[cb]), 1)
+        np.add.at(self.cb_coupons, (coupon_slot[~mbk_rows], world[rows][~mbk_rows]), coupon[rows][~mbk_rows])
+        np.add.at(self.cb_count, world[cb], 1)
+
+    def _underwrite(self, world, bank, volume):
+        """
+        Одобрение кредитных заявок в порядке поступления: кредит выдаётся, если на него
+        хватает свободного кэша, иначе - если его "рисковость" устраивает банк.
+        Проход идёт по номеру заявки внутри банка сразу для всех банков всех миров.
+        :return: Маска одобренных заявок
+        """
+        group = world * self.n_banks + bank
+        order = np.argsort(group, kind='stable')
+        group_sorted = group[order]
+        counts = np.bincount(group_sorted, minlength=self.n_worlds * self.n_banks)
+        position = np.arange(len(group)) - np.repeat(np.cumsum(counts) - counts, counts)
+        depth = counts.max() if len(counts) else 0
+
+        volumes = np.zeros((self.n_worlds * self.n_banks, depth))
+        present = np.zeros((self.n_worlds * self.n_banks, depth), dtype=bool)
+        volumes[group_sorted, position] = volume[order]
+        present[group_sorted, position] = True
+        risk = self.rng.uniform(0, 0.3, volumes.shape)
+
+        free_cash = self.cash.reshape(-1).copy()
+        tolerance = self.risk_tolerance.reshape(-1)
+        approved_sorted = np.zeros(volumes.shape, dtype=bool)
+        for j in range(depth):
+            approve = present[:, j] & ((free_cash >= volumes[:, j]) | (risk[:, j] <= tolerance))
+            free_cash -= np.where(approve, volumes[:, j], 0)
+            approved_sorted[:, j] = approve
+
+        approved = np.empty(len(group), dtype=bool)
+        approved[order] = approved_sorted[group_sorted, position]
+        return approved
+
+    def _clear_interbank(self, solved, loan_amount):
+        """
+        Рынок МБК: каждый незакрывшийся банк по очереди обходит закрывшиеся банки
+        в случайном порядке и забирает весь их кэш, пока не покроет долг.
+        Остаток покрывает ЦБ. При mbk_matching='queue' очередь кредиторов одна на мир.
+        """
+        if self.matching == 'queue':
+            return self._clear_interbank_queue(solved, loan_amount)
+        loans = []
+        positions = np.arange(self.n_banks)
+        for borrower in range(self.n_banks):
+            worlds = np.flatnonzero(~solved[:, borrower])
+            if len(worlds) == 0:
+                continue
+            need = loan_amount[worlds, borrower]
+
+            # Случайный порядок кредиторов: закрывшиеся банки в начале
+            keys = self.rng.random((len(worlds), self.n_banks))
+            keys[~solved[worlds]] = np.inf
+            order = np.argsort(keys, axis=1)
+            n_creditors = solved[worlds].sum(axis=1)
+            valid = positions < n_creditors[:, None]
+
+            available = np.where(valid, np.take_along_axis(self.cash[worlds], order, axis=1), 0)
+            cumulative = np.cumsum(available, axis=1)
+            finished = valid & (cumulative >= need[:, None])
+            has_finisher = finished.any(axis=1)
+            finisher = np.where(has_finisher, finished.argmax(axis=1), n_creditors - 1)
+            tried = valid & (positions <= finisher[:, None])
+            allocation = np.where(tried, np.minimum(available, need[:, None] - (cumulative - available)), 0)
+
+            loan_world, loan_position = np.nonzero(tried)
+            lender = order[loan_world, loan_position]
+            volume = allocation[loan_world, loan_position]
+            self.cash[worlds[loan_world], lender] -= volume
+            self.cash[worlds, borrower] += need
+            loans.append((worlds[loan_world], np.full(len(volume), borrower), lender, volume))
+
+            # Санация ЦБ на остаток долга
+            rescued = ~has_finisher
+            remainder = need[rescued] - allocation[rescued].sum(axis=1)
+            self.cb_cash[worlds[rescued]] -= remainder
+            loans.append((worlds[rescued], np.full(rescued.sum(), borrower),
+                          np.full(rescued.sum(), -1), remainder))
+
+        if loans:
+            world, borrower, lender, volume = (np.concatenate(column) for column in zip(*loans))
+            self._schedule_loans(world, borrower, lender, volume)
+
+    def _clear_interbank_queue(self, solved, loan_amount):
+        # Общая очередь кредиторов: мир за миром тем же clear_interbank, что и у BankModel
+        loans = []
+        for world in np.flatnonzero(~solved.all(axis=1)):
+            creditors = np.flatnonzero(solved[world])
+            borrowers = np.flatnonzero(~solved[world])
+            creditor_cash = self.cash[world, creditors].copy()
+            need = loan_amount[world, borrowers]
+            (mbk_borrower, mbk_creditor, mbk_volume), (cb_borrower, cb_volume) = clear_interbank(
+                need, creditor_cash, self.rng, 'queue')
+            self.cash[world, creditors] = creditor_cash
+            self.cash[world, borrowers] += need
+            self.cb_cash[world] -= cb_volume.sum()
+            loans.append((np.full(len(mbk_volume), world), borrowers[mbk_borrower], creditors[mbk_creditor],
+                          mbk_volume))
+            loans.append((np.full(len(cb_volume), world), borrowers[cb_borrower], np.full(len(cb_volume), -1),
+                          cb_volume))
+
+        if loans:
+            world, borrower, lender, volume = (np.concatenate(column) for column in zip(*loans))
+            self._schedule_loans(world, borrower, lender, volume)
+
+    def step(self):
+        settings = self.settings
+        n_combos = {flow_type: len(settings[f'{flow_type}_maturity']) * len(settings['payment_period'])
+                    for flow_type in ('deposit', 'credit')}
+
+        # 4-5 - генерация заявок и распределение по банкам
+        deposit_world, deposit_bank, deposit_volume, deposit_combo = self._generate('deposit')
+        credit_world, credit_bank, credit_volume, credit_combo = self._generate('credit')
+
+        # 6 - приём депозитов
+        deposit_rate = settings['cb_rate'] - self.delta
+        assert np.all(deposit_rate > 0.01)
+        deposits = self._aggregate(deposit_world, deposit_bank, deposit_volume, deposit_combo,
+                                   n_combos['deposit'])
+        self._schedule(self.deposit_coupons, self.deposit_maturing, deposits, deposit_rate, 'deposit', self.day)
+        deposits_to_get = deposits.sum(axis=2)
+        self.deposit_volume += deposits_to_get
+        reserves_to_cb = settings['cb_reserve_rate'] * deposits_to_get
+
+        # Одобрение кредитов
+        credit_rate = settings['cb_rate'] + self.delta
+        approved = self._underwrite(credit_world, credit_bank, credit_volume)
+        credits = self._aggregate(credit_world[approved], credit_bank[approved], credit_volume[approved],
+                                  credit_combo[approved], n_combos['credit'])
+        self._schedule(self.credit_coupons, self.credit_maturing, credits, credit_rate, 'credit', self.day)
+        credits_to_give = credits.sum(axis=2)
+        self.credit_volume += credits_to_give
+
+        # Дневной проход по книгам
+        slot = self.day % self.horizon
+        deposit_coupon, deposit_matured = self.deposit_coupons[slot].copy(), self.deposit_maturing[slot].copy()
+        credit_coupon, credit_matured = self.credit_coupons[slot].copy(), self.credit_maturing[slot].copy()
+        self.mbk_count -= self.mbk_maturing[slot]
+        self.deposit_volume -= deposit_matured
+        self.credit_volume -= credit_matured
+        for wheel in (self.deposit_coupons, self.deposit_maturing, self.credit_coupons,
+                      self.credit_maturing, self.mbk_maturing):
+            wheel[slot] = 0
+
+        current_obligations = deposit_matured + deposit_coupon + credits_to_give
+        current_inflows = credit_matured + credit_coupon + deposits_to_get
+        self.cb_cash += reserves_to_cb.sum(axis=1)
+
+        # Расчёты банков
+        self.cash += current_inflows - current_obligations
+        self.cash -= settings['bank_fixed_costs'] + self.cash * settings['bank_operating_costs']
+        solved = self.cash >= 0
+        loan_amount = np.where(solved, 0, -self.cash + self.rng.integers(1e5, 1e6, self.cash.shape))
+
+        # Проход и расчёты ЦБ
+        self.cb_cash += self.cb_coupons[slot] + self.cb_maturing[slot]
+        self.cb_cash -= settings['bank_fixed_costs'] + self.cb_cash * settings['bank_operating_costs']
+        self.cb_count -= self.cb_maturing_count[slot]
+        for wheel in (self.cb_coupons, self.cb_maturing, self.cb_maturing_count):
+            wheel[slot] = 0
+        self.day += 1
+
+        # Незакрывшиеся банки отправляем на МБК
+        self._clear_interbank(solved, loan_amount)
+
+        self.set_reliability()
+        self.set_delta()
+
+        system_liquidity = self.cash.sum(axis=1)
+        self.system_liquidity_history.append(system_liquidity + self.cb_cash)
+        self.system_mbk_credits.append(self.mbk_count.sum(axis=1))
+        self.system_credits_history.append(self.credit_volume.sum(axis=1))
+        self.system_deposits_history.append(self.deposit_volume.sum(axis=1))
+        self.cb_cash_history.append(self.cb_cash.copy())
+        self.cb_credits_history.append(self.cb_count.copy())
+        self.hhi_history.append(self.hhi_index(system_liquidity))
+
+    def run(self, n_steps):
+        """
+        Запускает симуляцию всех миров на n_steps дней
+        :param n_steps: Количество шагов модели
+        """
+        for _ in range(n_steps):
+            self.step()
+
+    def trajectories(self):
+        """
+        Траектории в том же виде, что и у ансамбля: имя -> массив (K, записи),
+        с теми же шагами записи метрик, что и у BankModel (metrics_stride, metrics_strides)
+        """
+        histories = {'liquidity': np.array(self.system_liquidity_history).T,
+                     'hhi': np.array(self.hhi_history).T,
+                     'mbk_credits': np.array(self.system_mbk_credits, dtype=np.float64).T,
+                     'cb_credits': np.array(self.cb_credits_history, dtype=np.float64).T}
+        result = {}
+        for name, metric in tracked_strides(self.settings).items():
+            # Ликвидность записана и за день 0, остальные ряды - с дня 1
+            first = 0 if metric['initial'] else metric['stride']
+            days = np.arange(first, self.day + 1, metric['stride'])
+            result[name] = histories[name][:, days if metric['initial'] else days - 1]
+        return result
+
+    def _string_representation(self):
+        return f'Batched model: {self.n_worlds} worlds x {self.n_banks} banks, day {self.day}'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def run_batched(n_worlds, steps, settings=None, seed=None, cb_cash=1e12):
+    """
+    Прогоняет n_worlds миров одним пакетным движком
+    :return: EnsembleResult, сравнимый с ensemble.run_ensemble
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    model = BatchedBankModel(settings, n_worlds=n_worlds, rng=np.random.default_rng(seed_sequence))
+    model.create_world(cb_cash=cb_cash)
+    model.run(steps)
+    return EnsembleResult(model.trajectories(), seed_sequence.entropy, steps, tracked_strides(model.settings))
@@ -0,0 +1,153 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from settings import settings
+
+# Матрица замеров: количество банков, границы количества заявок в день и горизонт
+BANKS = [20, 100, 350]
+AMOUNT_BOUNDS = {'low': (10, 100), 'base': (10, 1000), 'high': (100, 3000)}
+HORIZONS = [50, 500, 2000]
+QUICK = {'banks': [20, 100], 'amounts': ['base'], 'horizons': [50]}
+
+
+def _case_settings(n_banks, amount):
+    return dict(settings, banks_number=n_banks, liquid_distribution='real' if n_banks <= 20 else 'pareto',
+                deposit_amount_bound=AMOUNT_BOUNDS[amount], credit_amount_bound=AMOUNT_BOUNDS[amount],
+                ledger_retention='off')
+
+
+def peak_rss_mb():
+    """
+    Пик резидентной памяти текущего процесса в мегабайтах: ru_maxrss на Linux
+    в килобайтах, а на macOS - в байтах
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure(case):
+    # Замер одного случая в отдельном процессе, чтобы пик RSS относился только к нему
+    from agents import BankModel
+    n_banks, amount, steps, seed, trace = case
+    model = BankModel(_case_settings(n_banks, amount), rng=seed)
+    model.create_world()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    model.run(steps)
+    seconds = time.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1] if trace else None
+    tracemalloc.stop()
+    flows = model.system_deposits.n_applications + model.system_credits.n_applications
+    return {'banks': n_banks, 'amount': amount, 'steps': steps, 'seed': seed,
+            'seconds': seconds,
+            'steps_per_sec': steps / seconds,
+            'flows_per_sec': flows / seconds,
+            'peak_rss_mb': peak_rss_mb(),
+            'tracemalloc_peak_mb': None if traced_peak is None else traced_peak / 2 ** 20}
+
+
+def import_seconds(module='agents', repeat=3):
+    """
+    Время импорта модуля в свежем интерпретаторе (лучшее из repeat попыток)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(banks=BANKS, amounts=AMOUNT_BOUNDS, horizons=HORIZONS, seed=0, trace=False):
+    """
+    Прогоняет матрицу замеров, каждый случай - в новом процессе
+    :param trace: Дополнительно замерить пик памяти через tracemalloc (замедляет прогон)
+    :return: Словарь с окружением и списком результатов по случаям
+    """
+    context = multiprocessing.get_context('spawn')
+    cases = [(n_banks, amount, steps, seed, trace)
+             for n_banks, amount, steps in itertools.product(banks, amounts, horizons)]
+    results = []
+    for case in cases:
+        with context.Pool(1) as pool:
+            result = pool.apply(_measure, (case,))
+        print(f"{result['banks']:>5} banks  {result['amount']:>4}  {result['steps']:>5} steps  "
+              f"{result['steps_per_sec']:9.1f} steps/s  {result['flows_per_sec']:11.0f} flows/s  "
+              f"{result['peak_rss_mb']:8.1f} MB RSS")
+        results.append(result)
+    return {'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'machine': platform.machine(), 'processor': platform.processor(),
+                            'platform': sys.platform},
+            'import_seconds': import_seconds(),
+            'cases': results}
+
+
+def _key(case):
+    return case['banks'], case['amount'], case['steps']
+
+
+def compare(current, baseline, threshold=0.2):
+    """
+    Сравнивает замеры с базовыми: регрессия - падение скорости или рост памяти
+    или времени импорта больше чем на threshold
+    :return: Список описаний регрессий
+    """
+    regressions = []
+    reference = {_key(case): case for case in baseline['cases']}
+    for case in current['cases']:
+        base = reference.get(_key(case))
+        if base is None:
+            continue
+        name = f'{case["banks"]} banks, {case["amount"]}, {case["steps"]} steps'
+        if case['steps_per_sec'] < base['steps_per_sec'] * (1 - threshold):
+            regressions.append(f'{name}: {case["steps_per_sec"]:.1f} steps/s '
+                               f'vs {base["steps_per_sec"]:.1f} in baseline')
+        if case['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f'{name}: {case["peak_rss_mb"]:.1f} MB RSS '
+                               f'vs {base["peak_rss_mb"]:.1f} in baseline')
+    if current['import_seconds'] > baseline['import_seconds'] * (1 + threshold):
+        regressions.append(f'import agents: {current["import_seconds"]:.2f} s '
+                           f'vs {baseline["import_seconds"]:.2f} in baseline')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Замеры скорости и памяти BankModel')
+    parser.add_argument('--quick', action='store_true', help='малая матрица для быстрой проверки')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace', action='store_true', help='замерять пик памяти через tracemalloc')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline', default=None, help='JSON с базовыми замерами для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        matrix = {'banks': QUICK['banks'], 'amounts': QUICK['amounts'], 'horizons': QUICK['horizons']}
+    else:
+        matrix = {'banks': BANKS, 'amounts': list(AMOUNT_BOUNDS), 'horizons': HORIZONS}
+    results = run_benchmarks(seed=args.seed, trace=args.trace, **matrix)
+    with open(args.out, 'w') as file:
+        json.dump(results, file, indent=1)
+    print(f'Saved results to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions against baseline')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
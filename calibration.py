@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from agents import BankModel
+from metrics import hhi
+from settings import settings as default_settings, real
+from sweep import apply_overrides, config_hash, latin_hypercube, _code_version, _INDEXED_KEY
+
+# Версия самой калибровки: config_hash покрывает только модули модели, а от этого
+# модуля зависят расстояние, статистики и остановка прогонов
+CALIBRATION_VERSION = _code_version([sys.modules[__name__]])
+
+
+class CalibrationTarget:
+    """
+    Наблюдаемые статистики, к которым подгоняются настройки: уровень HHI и
+    распределение долей банков в кэше. Расстояние - взвешенная сумма
+    относительной ошибки HHI и расстояния полной вариации между долями
+    банков, упорядоченными по убыванию.
+    """
+    def __init__(self, shares=real, hhi_level=None, hhi_weight=1.0, shares_weight=1.0, window=30):
+        """
+        :param shares: Наблюдаемые доли банков, по умолчанию - real из settings.py
+        :param hhi_level: Наблюдаемый HHI, по умолчанию - HHI долей shares
+        :param window: HHI модели усредняется за последние window записанных дней
+        """
+        self.shares = np.sort(np.asarray(shares, dtype=np.float64))[::-1] / np.sum(shares)
+        self.hhi_level = hhi(self.shares) if hhi_level is None else float(hhi_level)
+        self.hhi_weight = hhi_weight
+        self.shares_weight = shares_weight
+        self.window = window
+
+    def statistics(self, model):
+        """
+        Статистики модели на текущий день: средний HHI за окно и доли банков по убыванию
+        """
+        cash = np.array([bank.cash for bank in model.banks], dtype=np.float64)
+        history = model.hhi_history
+        return {'hhi': float(np.mean(history[-self.window:])) if len(history) else hhi(cash),
+                'shares': (np.sort(cash)[::-1] / cash.sum()).tolist()}
+
+    def distance(self, statistics):
+        shares = np.asarray(statistics['shares'])
+        if len(shares) != len(self.shares):
+            raise ValueError(f'Target has {len(self.shares)} shares, model has {len(shares)} banks')
+        with np.errstate(invalid='ignore'):
+            hhi_error = abs(statistics['hhi'] / self.hhi_level - 1)
+            shares_error = 0.5 * np.abs(shares - self.shares).sum()
+        distance = self.hhi_weight * hhi_error + self.shares_weight * shares_error
+        return float(distance) if np.isfinite(distance) else float('inf')
+
+    def to_dict(self):
+        return {'shares': self.shares.tolist(), 'hhi_level': self.hhi_level, 'hhi_weight': self.hhi_weight,
+                'shares_weight': self.shares_weight, 'window': self.window}
+
+    def _string_representation(self):
+        return f'Target HHI {self.hhi_level:.0f} and {len(self.shares)} bank shares'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def evaluate(settings, steps, seed, target, check_every=30, stop_distance=None, cb_cash=1e12):
+    """
+    Прогон модели в одной точке с проверками каждые check_every дней. Прогон
+    останавливается, если модель разошлась (кэш не конечен) или если расстояние
+    до цели на проверке больше stop_distance.
+    :param seed: Seed генератора прогона; один seed для всех точек даёт общие случайные числа
+    :return: {'distance', 'hhi', 'shares', 'steps', 'stopped'}, stopped - None,
+        'diverged', 'invalid' (не выполнилась проверка модели, например ставка
+        депозита не выше 0.01, или настройки недопустимы) или 'distance'
+    """
+    model = BankModel(settings, rng=np.random.default_rng(seed))
+    model.create_world(cb_cash=cb_cash)
+    done = 0
+    stopped = None
+    while done < steps:
+        chunk = min(check_every, steps - done)
+        try:
+            model.run(chunk)
+        except (AssertionError, ValueError):
+            return {'hhi': float('nan'), 'shares': [], 'distance': float('inf'), 'steps': done,
+                    'stopped': 'invalid'}
+        done += chunk
+        statistics = target.statistics(model)
+        distance = target.distance(statistics)
+        if distance == float('inf'):
+            stopped = 'diverged'
+            break
+        if stop_distance is not None and done < steps and distance > stop_distance:
+            stopped = 'distance'
+            break
+    return dict(statistics, distance=distance, steps=done, stopped=stopped)
+
+
+def _evaluate(args):
+    settings, steps, seed, target, check_every, stop_distance, cb_cash, path = args
+    result = evaluate(settings, steps, seed, target, check_every, stop_distance, cb_cash)
+    # Пишем во временный файл и переименовываем, чтобы не оставить битый кэш
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(dict(result, stop_distance=stop_distance), file)
+    os.replace(temporary, path)
+    return result
+
+
+def _cached(path, stop_distance):
+    # Результат из кэша, если он годится при текущем пороге остановки
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        result = json.load(file)
+    cached_stop = result.pop('stop_distance')
+    # Остановленный прогон остановился бы и при более строгом пороге
+    if result['stopped'] == 'distance' and (stop_distance is None or stop_distance > cached_stop):
+        return None
+    return result
+
+
+class CalibrationResult:
+    """
+    Все оценённые точки калибровки: evaluations - список словарей с раундом,
+    подстановками, расстоянием, статистиками и причиной остановки
+    """
+    def __init__(self, evaluations, bounds, target, seed, steps):
+        self.evaluations = evaluations
+        self.bounds = bounds
+        self.target = target
+        self.seed = seed
+        self.steps = steps
+
+    @property
+    def best(self):
+        """
+        Лучшая из досчитанных до конца точек
+        """
+        complete = [evaluation for evaluation in self.evaluations if evaluation['stopped'] is None]
+        return min(complete or self.evaluations, key=lambda evaluation: evaluation['distance'])
+
+    def best_settings(self, settings=None):
+        return apply_overrides(self.best['overrides'], settings)
+
+    def count(self, field, value=True):
+        return sum(1 for evaluation in self.evaluations if evaluation[field] == value)
+
+    def steps_saved(self):
+        # Шаги, которые не пришлось считать благодаря остановке и кэшу
+        return sum(self.steps if evaluation['cached'] else self.steps - evaluation['steps']
+                   for evaluation in self.evaluations)
+
+    def to_json(self, path):
+        report = {'best': self.best, 'bounds': self.bounds, 'target': self.target.to_dict(),
+                  'seed': self.seed, 'steps': self.steps, 'evaluations': self.evaluations}
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=1, default=float)
+
+    def __len__(self):
+        return len(self.evaluations)
+
+    def _string_representation(self):
+        best = self.best
+        stopped = len(self) - self.count('stopped', None)
+        return (f'Calibration of {len(self)} points ({stopped} stopped early, {self.count("cached")} cached), '
+                f'best distance {best["distance"]:.4f} at {best["overrides"]}')
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def _local_bounds(bounds, center, width):
+    # Прямоугольник вокруг center с долей width от исходных интервалов, не выходящий за bounds
+    result = {}
+    for key, (low, high) in bounds.items():
+        half = width * (high - low) / 2
+        result[key] = (max(low, center[key] - half), min(high, center[key] + half))
+    return result
+
+
+def calibrate(bounds, target=None, steps=365, n_initial=16, n_rounds=3, n_per_round=8, shrink=0.5, seed=0,
+              settings=None, integer=(), check_every=30, stop_factor=3.0, stop_distance=None,
+              cache_dir='calibration_cache', processes=None, cb_cash=1e12):
+    """
+    Подбор настроек, при которых модель воспроизводит цель target. Первый раунд -
+    латинский гиперкуб из n_initial точек в bounds, каждый следующий - n_per_round
+    точек вокруг лучшей точки в прямоугольнике, который сужается в shrink раз за
+    раунд. Точки раунда считаются параллельно; прогоны, которые на проверке хуже
+    лучшей точки больше чем в stop_factor раз, останавливаются. Все точки считаются
+    с одним seed, поэтому различия между ними не тонут в шуме. Результаты
+    сохраняются в cache_dir, и повторная калибровка их не пересчитывает.
+    :param bounds: {ключ настроек: (нижняя граница, верхняя граница)}, ключи вида
+        'deposit_volume_bound[1]' меняют один элемент кортежа
+    :param integer: Ключи, значения которых округляются до целых
+    :param stop_distance: Порог остановки для первого раунда
+    :param processes: Количество процессов; 1 - считать в текущем процессе
+    :return: CalibrationResult
+    """
+    settings = default_settings if settings is None else settings
+    target = CalibrationTarget() if target is None else target
+    for key in bounds:
+        match = _INDEXED_KEY.match(key)
+        if (match.group(1) if match else key) not in settings:
+            raise ValueError(f'Unknown settings key {key!r}')
+    os.makedirs(cache_dir, exist_ok=True)
+    # Без seed все точки всё равно получают один общий seed
+    seed = np.random.SeedSequence(seed).entropy
+    rng = np.random.default_rng(seed)
+    evaluations = []
+
+    pool = ProcessPoolExecutor(processes) if processes != 1 else None
+    try:
+        for round_number in range(n_rounds):
+            if round_number == 0:
+                points = latin_hypercube(bounds, n_initial, rng, integer)
+            else:
+                width = shrink ** round_number
+                center = CalibrationResult(evaluations, bounds, target, seed, steps).best['overrides']
+                points = latin_hypercube(_local_bounds(bounds, center, width), n_per_round, rng, integer)
+            if evaluations:
+                best = CalibrationResult(evaluations, bounds, target, seed, steps).best['distance']
+                stop_distance = stop_factor * best if stop_distance is None else min(stop_distance,
+                                                                                      stop_factor * best)
+
+            results = [None] * len(points)
+            tasks = []
+            for number, overrides in enumerate(points):
+                point_settings = apply_overrides(overrides, settings)
+                key = json.dumps({'run': config_hash(point_settings, seed, steps, cb_cash),
+                                  'target': target.to_dict(), 'check_every': check_every,
+                                  'calibration': CALIBRATION_VERSION}, sort_keys=True)
+                path = os.path.join(cache_dir, f'{hashlib.sha256(key.encode()).hexdigest()}.json')
+                results[number] = _cached(path, stop_distance)
+                if results[number] is None:
+                    tasks.append((number, (point_settings, steps, seed, target, check_every, stop_distance,
+                                           cb_cash, path)))
+
+            computed = map(_evaluate, [task for _, task in tasks]) if pool is None else \
+                pool.map(_evaluate, [task for _, task in tasks])
+            cached = [result is not None for result in results]
+            for (number, _), result in zip(tasks, computed):
+                results[number] = result
+            for overrides, result, from_cache in zip(points, results, cached):
+                evaluations.append(dict(result, round=round_number, overrides=overrides, cached=from_cache))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return CalibrationResult(evaluations, bounds, target, seed, steps)
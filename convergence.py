@@ -0,0 +1,243 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import numpy as np
+from agents import BankModel
+from settings import settings as default_settings
+
+# Метрики, по которым по умолчанию решается, что прогон вышел на стационарный режим
+STEADY_METRICS = ('system_liquidity', 'hhi', 'mbk_credits')
+# Свои допуски метрик: количество кредитов МБК меняется всплесками и шумит сильнее остальных
+STEADY_TOLERANCES = {'mbk_credits': 0.25}
+
+
+def mser(series, batch=5):
+    """
+    Длина разогрева по правилу MSER-b: ряд усредняется пачками по batch значений,
+    и отбрасывается столько первых пачек d, чтобы минимизировать
+    sum((y[d:] - mean(y[d:]))²) / (m - d)², d не больше половины пачек
+    :return: (длина разогрева в значениях ряда, True если минимум не на границе поиска)
+    """
+    series = np.asarray(series, dtype=np.float64)
+    m = len(series) // batch
+    if m < 4:
+        return 0, False
+    means = series[:m * batch].reshape(m, batch).mean(axis=1)
+    # Суммы и суммы квадратов хвостов y[d:] для всех d сразу
+    tail_sum = np.cumsum(means[::-1])[::-1]
+    tail_squares = np.cumsum(means[::-1] ** 2)[::-1]
+    count = np.arange(m, 0, -1)
+    statistic = (tail_squares - tail_sum ** 2 / count) / count ** 2
+    d = int(np.argmin(statistic[:m // 2 + 1]))
+    return d * batch, d < m // 2
+
+
+def batch_means(series, n_batches=20, level=0.95):
+    """
+    Среднее ряда и полуширина доверительного интервала методом средних по пачкам:
+    ряд делится на n_batches пачек, их средние считаются независимыми
+    :return: (среднее, полуширина интервала)
+    """
+    series = np.asarray(series, dtype=np.float64)
+    size = len(series) // n_batches
+    if size == 0:
+        return float(series.mean()) if len(series) else float('nan'), float('inf')
+    # Лишние значения отбрасываются в начале ряда, ближе к разогреву
+    means = series[len(series) - size * n_batches:].reshape(n_batches, size).mean(axis=1)
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    return float(means.mean()), float(z * means.std(ddof=1) / np.sqrt(n_batches))
+
+
+class SteadyState:
+    """
+    Критерий стационарного режима прогона: у каждой метрики разогрев по MSER
+    закончился, а полуширина интервала среднего после разогрева по средним
+    пачек не больше tolerance от среднего
+    """
+    def __init__(self, metrics=STEADY_METRICS, tolerance=0.05, tolerances=None, min_steps=100, batch=5,
+                 n_batches=20, level=0.95):
+        """
+        :param metrics: Имена метрик MetricsRegistry, которые должны выйти на стационарный режим
+        :param tolerance: Допустимая относительная полуширина интервала среднего
+        :param tolerances: Свои допуски отдельных метрик, по умолчанию STEADY_TOLERANCES
+        :param min_steps: Раньше этого дня прогон не останавливается
+        """
+        self.metrics = tuple(metrics)
+        self.tolerance = tolerance
+        self.tolerances = STEADY_TOLERANCES if tolerances is None else tolerances
+        self.min_steps = min_steps
+        self.batch = batch
+        self.n_batches = n_batches
+        self.level = level
+
+    def check(self, model):
+        """
+        Проверяет все метрики модели
+        :return: (True если все метрики стационарны, {метрика: подробности})
+        """
+        details = {name: self.metric(model.recorder.series(name), self.tolerances.get(name, self.tolerance))
+                   for name in self.metrics}
+        steady = model.day >= self.min_steps and all(detail['steady'] for detail in details.values())
+        return steady, details
+
+    def metric(self, series, tolerance):
+        warmup, settled = mser(series, self.batch)
+        mean, half_width = batch_means(series[warmup:], self.n_batches, self.level)
+        return {'warmup': warmup, 'mean': mean, 'half_width': half_width,
+                'steady': bool(settled and half_width <= tolerance * abs(mean))}
+
+    def _string_representation(self):
+        return f'Steady state of {", ".join(self.metrics)} within {100 * self.tolerance:g} %'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def run_until_steady(model, max_steps, criterion=None, check_every=50):
+    """
+    Запускает симуляцию модели кусками по check_every дней, пока метрики не выйдут
+    на стационарный режим или модель не проработает max_steps дней
+    :param model: BankModel или ShardedBankModel
+    :param criterion: SteadyState, по умолчанию - ликвидность, HHI и кредиты МБК
+    :return: Отчёт: reason ('steady' или 'max_steps'), steps - дней в этом вызове,
+        day, metrics - разогрев, среднее и полуширина интервала по метрикам
+    """
+    criterion = SteadyState() if criterion is None else criterion
+    done = 0
+    reason = 'max_steps'
+    details = {}
+    while done < max_steps:
+        chunk = min(check_every, max_steps - done)
+        model.run(chunk)
+        done += chunk
+        steady, details = criterion.check(model)
+        if steady:
+            reason = 'steady'
+            break
+    return {'reason': reason, 'steps': done, 'day': model.day, 'metrics': details}
+
+
+def steady_replicate(settings, max_steps, seed, criterion=None, check_every=50, cb_cash=1e12):
+    """
+    Один прогон до стационарного режима (см. run_until_steady)
+    :return: Отчёт о прогоне
+    """
+    model = BankModel(settings, rng=np.random.default_rng(seed))
+    model.create_world(cb_cash=cb_cash)
+    return run_until_steady(model, max_steps, criterion, check_every)
+
+
+def _steady_replicate(args):
+    return steady_replicate(*args)
+
+
+class AdaptiveResult:
+    """
+    Прогоны адаптивной серии: reports - отчёты прогонов, estimates[name] -
+    стационарные средние метрики по прогонам, reason - почему серия остановилась
+    """
+    def __init__(self, reports, metrics, reason, level, seed):
+        self.reports = reports
+        self.metrics = metrics
+        self.reason = reason
+        self.level = level
+        self.seed = seed
+
+    @property
+    def estimates(self):
+        return {name: np.array([report['metrics'][name]['mean'] for report in self.reports])
+                for name in self.metrics}
+
+    def interval(self, name):
+        """
+        Среднее по прогонам и полуширина его доверительного интервала
+        """
+        values = self.estimates[name]
+        if len(values) < 2:
+            return float(values.mean()), float('inf')
+        z = NormalDist().inv_cdf(0.5 + self.level / 2)
+        return float(values.mean()), float(z * values.std(ddof=1) / np.sqrt(len(values)))
+
+    def reasons(self):
+        """
+        Сколько прогонов остановилось по каждой причине
+        """
+        result = {}
+        for report in self.reports:
+            result[report['reason']] = result.get(report['reason'], 0) + 1
+        return result
+
+    def steps(self):
+        return np.array([report['steps'] for report in self.reports])
+
+    def summary(self):
+        return {'reason': self.reason, 'runs': len(self), 'steps': int(self.steps().sum()),
+                'run_reasons': self.reasons(),
+                'metrics': {name: dict(zip(('mean', 'half_width'), self.interval(name))) for name in self.metrics}}
+
+    def __len__(self):
+        return len(self.reports)
+
+    def _string_representation(self):
+        lines = [f'{len(self)} runs, stopped by {self.reason}, {self.steps().sum()} steps in total, '
+                 f'runs stopped by {self.reasons()}']
+        for name in self.metrics:
+            mean, half_width = self.interval(name)
+            lines.append(f'{name:>18}: {mean:.6g} ± {half_width:.3g}')
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def run_adaptive(max_steps, metrics=('system_liquidity', 'hhi'), target_width=0.01, min_runs=5, max_runs=200,
+                 criterion=None, check_every=50, settings=None, seed=None, processes=None, cb_cash=1e12,
+                 level=0.95):
+    """
+    Серия прогонов до стационарного режима, в которую прогоны добавляются
+    пачками, пока интервал стационарного среднего каждой метрики из metrics не
+    станет уже target_width от среднего. Прогон i получает i-й поток из
+    SeedSequence(seed).spawn, а серия обрывается на первом прогоне, после
+    которого точность достигнута, поэтому результат не зависит от числа процессов.
+    :param metrics: Метрики, по точности которых решается, хватит ли прогонов;
+        должны входить в метрики criterion
+    :param target_width: Допустимая относительная полуширина интервала
+    :param criterion: SteadyState для каждого прогона, по умолчанию - SteadyState()
+    :param processes: Количество процессов; 1 - считать в текущем процессе
+    :return: AdaptiveResult, reason - 'precision' или 'max_runs'
+    """
+    settings = default_settings if settings is None else settings
+    criterion = SteadyState() if criterion is None else criterion
+    if set(metrics) - set(criterion.metrics):
+        raise ValueError(f'Metrics {sorted(set(metrics) - set(criterion.metrics))} are not in {criterion}')
+    seed_sequence = np.random.SeedSequence(seed)
+    reports = []
+    result = AdaptiveResult(reports, tuple(metrics), 'max_runs', level, seed_sequence.entropy)
+
+    def precise():
+        return len(reports) >= max(min_runs, 2) and all(half_width <= target_width * abs(mean)
+                                                        for mean, half_width in map(result.interval, metrics))
+
+    pool = ProcessPoolExecutor(processes) if processes != 1 else None
+    try:
+        while len(reports) < max_runs:
+            # Первая пачка - min_runs прогонов, дальше - по прогону на процесс
+            size = min_runs if not reports else (processes or os.cpu_count() if pool is not None else 1)
+            tasks = [(settings, max_steps, child, criterion, check_every, cb_cash)
+                     for child in seed_sequence.spawn(min(size, max_runs - len(reports)))]
+            for report in map(_steady_replicate, tasks) if pool is None else pool.map(_steady_replicate, tasks):
+                reports.append(report)
+                # Лишние прогоны пачки отбрасываются
+                if precise():
+                    result.reason = 'precision'
+                    return result
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return result
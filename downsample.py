@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def _buckets(values, n_buckets, fill):
+    # Ряд, дополненный значением fill до n_buckets корзин равной длины: массив (корзины, длина корзины)
+    size = -(-len(values) // n_buckets)
+    n_buckets = -(-len(values) // size)
+    padded = np.full(n_buckets * size, fill, dtype=np.float64)
+    padded[:len(values)] = values
+    return padded.reshape(n_buckets, size), size
+
+
+def minmax(x, y, n_buckets=1000):
+    """
+    Прореживание ряда по корзинам: из каждой корзины остаются минимум и максимум
+    в исходном порядке, поэтому выбросы и размах ряда на графике сохраняются
+    :param n_buckets: Количество корзин, обычно - ширина графика в пикселях
+    :return: (x, y) не длиннее 2 * n_buckets + 2 точек
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    if len(y) <= 2 * n_buckets:
+        return x, y
+    # NaN не выбирается ни минимумом, ни максимумом
+    low, size = _buckets(np.where(np.isnan(y), np.inf, y), n_buckets, np.inf)
+    high, _ = _buckets(np.where(np.isnan(y), -np.inf, y), n_buckets, -np.inf)
+    start = np.arange(len(low)) * size
+    first = start + np.minimum(low.argmin(axis=1), high.argmax(axis=1))
+    second = start + np.maximum(low.argmin(axis=1), high.argmax(axis=1))
+    index = np.unique(np.concatenate(([0], first, second, [len(y) - 1])))
+    return x[index], y[index]
+
+
+def lttb(x, y, n_out=1000):
+    """
+    Прореживание Largest-Triangle-Three-Buckets: первая и последняя точки
+    сохраняются, из каждой корзины между ними выбирается точка, которая
+    образует наибольший треугольник с уже выбранной точкой и средним
+    следующей корзины
+    :return: (x, y) из n_out точек
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return x, y
+    xf = x.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Средние корзин через накопленные суммы по значениям без NaN, иначе один NaN
+    # портит средние всех следующих корзин; последняя "корзина" - последняя точка
+    valid = ~np.isnan(y)
+    x_sum = np.concatenate(([0], np.cumsum(np.where(valid, xf, 0))))
+    y_sum = np.concatenate(([0], np.nancumsum(y)))
+    count_sum = np.concatenate(([0], np.cumsum(valid)))
+    count = count_sum[edges[1:]] - count_sum[edges[:-1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.append((x_sum[edges[1:]] - x_sum[edges[:-1]]) / count, xf[-1])
+        y_mean = np.append((y_sum[edges[1:]] - y_sum[edges[:-1]]) / count, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    # Вершина треугольника - последняя выбранная точка, которая не NaN
+    a = int(np.argmax(valid))
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        area = np.abs((xf[a] - x_mean[bucket + 1]) * (y[start:end] - y[a]) -
+                      (xf[a] - xf[start:end]) * (y_mean[bucket + 1] - y[a]))
+        if np.isnan(area).all():
+            # Корзина целиком из NaN, или NaN вершина либо среднее следующей корзины:
+            # берём самую удалённую от вершины точку
+            area = np.abs(y[start:end] - y[a])
+        chosen = start + (int(np.nanargmax(area)) if not np.isnan(area).all() else 0)
+        if valid[chosen]:
+            a = chosen
+        selected[bucket + 1] = chosen
+    return x[selected], y[selected]
+
+
+def envelope(x, low, high, n_buckets=1000):
+    """
+    Прореживание полосы (low, high): в каждой корзине остаются минимум нижней
+    и максимум верхней границы, поэтому полоса на графике не сужается
+    :return: (x начала корзин, нижняя граница, верхняя граница)
+    """
+    x = np.asarray(x)
+    if len(x) <= n_buckets:
+        return x, np.asarray(low), np.asarray(high)
+    low, size = _buckets(low, n_buckets, np.inf)
+    high, _ = _buckets(high, n_buckets, -np.inf)
+    return x[::size], low.min(axis=1), high.max(axis=1)
+
+
+# Способы прореживания линий: имя -> функция(x, y, количество точек)
+METHODS = {'minmax': lambda x, y, points: minmax(x, y, points // 2),
+           'lttb': lttb,
+           'none': lambda x, y, points: (x, y)}
+
+
+def downsample(x, y, points=2000, method='minmax'):
+    """
+    Прореживает ряд для отрисовки примерно до points точек
+    :param method: 'minmax', 'lttb' или 'none'
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown downsampling method {method!r}, expected one of {list(METHODS)}')
+    return METHODS[method](x, y, points)
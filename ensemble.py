@@ -0,0 +1,101 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from agents import BankModel
+from metrics import MetricsRegistry
+from settings import settings as default_settings
+
+# Траектории модели, которые собираются с каждого прогона
+TRACKED = {'liquidity': 'system_liquidity_history',
+           'hhi': 'hhi_history',
+           'mbk_credits': 'system_mbk_credits',
+           'cb_credits': 'cb_credits_history'}
+# Метрики MetricsRegistry, из которых берутся траектории TRACKED
+TRACKED_METRICS = {'liquidity': 'system_liquidity',
+                   'hhi': 'hhi',
+                   'mbk_credits': 'mbk_credits',
+                   'cb_credits': 'cb_credits'}
+
+
+def tracked_strides(settings):
+    """
+    Шаги записи траекторий TRACKED при настройках settings (см. MetricsRegistry.strides)
+    """
+    strides = MetricsRegistry.default(settings).strides()
+    return {name: strides[metric] for name, metric in TRACKED_METRICS.items()}
+
+
+def replicate(settings, steps, seed, cb_cash=1e12):
+    """
+    Один прогон модели с собственным генератором случайных чисел
+    :param seed: SeedSequence (или целое число) для np.random.Generator прогона
+    :return: Словарь траекторий TRACKED
+    """
+    model = BankModel(settings, rng=np.random.default_rng(seed))
+    model.create_world(cb_cash=cb_cash)
+    model.run(steps)
+    return {name: np.asarray(getattr(model, attribute), dtype=np.float64)
+            for name, attribute in TRACKED.items()}
+
+
+def _replicate(args):
+    return replicate(*args)
+
+
+class EnsembleResult:
+    """
+    Траектории всех прогонов ансамбля: trajectories[name] - массив (прогоны, записи),
+    metrics[name] - шаг записи траектории (см. tracked_strides)
+    """
+    def __init__(self, trajectories, seed, steps, metrics=None):
+        self.trajectories = trajectories
+        self.seed = seed
+        self.steps = steps
+        self.metrics = {} if metrics is None else metrics
+
+    def mean(self, name):
+        return self.trajectories[name].mean(axis=0)
+
+    def quantiles(self, name, q=(0.05, 0.5, 0.95)):
+        """
+        Полосы квантилей траектории по прогонам
+        :return: Массив (len(q), шаги)
+        """
+        return np.quantile(self.trajectories[name], q, axis=0)
+
+    def summary(self, q=(0.05, 0.5, 0.95)):
+        return {name: {'mean': self.mean(name), 'quantiles': dict(zip(q, self.quantiles(name, q)))}
+                for name in self.trajectories}
+
+    def __len__(self):
+        return len(next(iter(self.trajectories.values())))
+
+    def _string_representation(self):
+        return f'Ensemble of {len(self)} runs, {self.steps} steps, seed {self.seed}'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def run_ensemble(n_runs, steps, settings=None, seed=None, processes=None, cb_cash=1e12):
+    """
+    Запускает n_runs независимых прогонов модели в пуле процессов.
+    Каждый прогон получает свой поток случайных чисел из SeedSequence(seed).spawn,
+    поэтому результат воспроизводим и не зависит от числа процессов.
+    :param processes: Количество процессов; 1 - считать в текущем процессе
+    :return: EnsembleResult
+    """
+    settings = default_settings if settings is None else settings
+    seed_sequence = np.random.SeedSequence(seed)
+    tasks = [(settings, steps, child, cb_cash) for child in seed_sequence.spawn(n_runs)]
+
+    if processes == 1:
+        results = [_replicate(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_replicate, tasks))
+
+    trajectories = {name: np.stack([result[name] for result in results]) for name in TRACKED}
+    return EnsembleResult(trajectories, seed_sequence.entropy, steps, tracked_strides(settings))
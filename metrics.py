@@ -0,0 +1,226 @@
+from functools import cached_property
+import numpy as np
+
+
+def hhi(cash):
+    """
+    Индекс Херфиндаля-Хиршмана по массиву кэша банков (доли в процентах)
+    """
+    return float((((cash / cash.sum()) * 100) ** 2).sum())
+
+
+def gini(cash):
+    """
+    Коэффициент Джини распределения кэша между банками
+    """
+    ordered = np.sort(cash)
+    n = len(ordered)
+    total = ordered.sum()
+    if n == 0 or total == 0:
+        return 0.0
+    return float(2 * (np.arange(1, n + 1) * ordered).sum() / (n * total) - (n + 1) / n)
+
+
+def top_share(cash, k):
+    """
+    Доля k крупнейших банков в суммарном кэше
+    """
+    k = min(k, len(cash))
+    return float(np.partition(cash, len(cash) - k)[len(cash) - k:].sum() / cash.sum())
+
+
+class ModelState:
+    """
+    Состояние модели на конец дня, из которого метрики берут данные.
+    Массивы собираются с банков лениво и только один раз за день,
+    поэтому день без метрик к записи ничего не стоит.
+    """
+    def __init__(self, model, day):
+        self.model = model
+        self.day = day
+
+    @cached_property
+    def cash(self):
+        return np.array([bank.cash for bank in self.model.banks], dtype=np.float64)
+
+    @cached_property
+    def reliability(self):
+        return np.array([bank.reliability for bank in self.model.banks], dtype=np.float64)
+
+    @cached_property
+    def delta(self):
+        return np.array([bank.delta for bank in self.model.banks], dtype=np.float64)
+
+    @property
+    def cb_cash(self):
+        return self.model.cb.cash
+
+    @cached_property
+    def credit_totals(self):
+        return self.model.book_totals('credits')
+
+    @cached_property
+    def deposit_totals(self):
+        return self.model.book_totals('deposits')
+
+    def credit_column(self, flow_type):
+        # Количество и объём кредитов банков одного типа потока
+        from agents import FLOW_CODES  # agents сам импортирует этот модуль
+        counts, volumes = self.credit_totals
+        return counts[:, FLOW_CODES[flow_type]], volumes[:, FLOW_CODES[flow_type]]
+
+
+class Metric:
+    def __init__(self, name, function, stride=1, initial=None):
+        """
+        :param function: function(ModelState) -> число или массив постоянной формы
+        :param stride: Записывать метрику раз в stride дней
+        :param initial: Функция для записи стартового состояния в create_world
+            (True - та же function); None - метрика в день 0 не пишется
+        """
+        if stride < 1:
+            raise ValueError(f'Stride of metric {name!r} must be positive, got {stride}')
+        self.name = name
+        self.function = function
+        self.stride = int(stride)
+        self.initial = function if initial is True else initial
+
+    def days(self, n_days):
+        """
+        Дни, в которые метрика записывалась за n_days дней модели
+        """
+        first = 0 if self.initial is not None else self.stride
+        return np.arange(first, n_days + 1, self.stride)
+
+    def _string_representation(self):
+        return f'Metric {self.name} every {self.stride} days'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def below_reliability(threshold):
+    """
+    Метрика: количество банков с надёжностью ниже threshold
+    """
+    return lambda state: int((state.reliability < threshold).sum())
+
+
+def top_k_share(k):
+    """
+    Метрика: доля k крупнейших банков в кэше сектора
+    """
+    return lambda state: top_share(state.cash, k)
+
+
+# Встроенные метрики: имя -> (функция, функция стартового состояния)
+BUILTIN = {
+    # В день 0 ЦБ ещё не входит в ликвидность сектора
+    'system_liquidity': (lambda state: state.cash.sum() + state.cb_cash, lambda state: state.cash.sum()),
+    'mbk_credits': (lambda state: int(state.credit_column('mbk')[0].sum()), None),
+    'credits_volume': (lambda state: state.credit_totals[1].sum(), None),
+    'deposits_volume': (lambda state: state.deposit_totals[1].sum(), None),
+    'cb_cash': (lambda state: state.cb_cash, True),
+    'cb_credits': (lambda state: state.model.cb.credits.count('cb'), None),
+    'hhi': (lambda state: hhi(state.cash), None),
+    'bank_cash': (lambda state: state.cash, True),
+    'bank_reliability': (lambda state: state.reliability, True),
+    'bank_delta': (lambda state: state.delta, True),
+    'bank_deposits': (lambda state: state.deposit_totals[1], None),
+    'bank_credits': (lambda state: state.credit_totals[1], None),
+    'gini': (lambda state: gini(state.cash), None),
+    'top5_share': (top_k_share(5), None),
+    'below_reliability': (below_reliability(0.6), None),
+    'mbk_volume': (lambda state: state.credit_column('mbk')[1].sum(), None),
+    'cb_volume': (lambda state: state.model.cb.credits.total('cb'), None),
+}
+
+
+class MetricsRegistry:
+    """
+    Набор метрик, которые BankModel записывает в recorder в конце дня.
+    Метрики сгруппированы по шагу записи: в день, когда ни одна метрика
+    не записывается, состояние модели даже не собирается.
+    """
+    def __init__(self, metrics=()):
+        self.metrics = {}
+        self._by_stride = {}
+        for metric in metrics:
+            self.add(metric)
+
+    @classmethod
+    def default(cls, settings):
+        """
+        Встроенные метрики с шагом записи из настроек:
+        'metrics_stride' - общий шаг, 'metrics_strides' - шаг отдельных метрик
+        """
+        stride = settings.get('metrics_stride', 1)
+        strides = settings.get('metrics_strides', {})
+        return cls([Metric(name, function, strides.get(name, stride), initial)
+                    for name, (function, initial) in BUILTIN.items()])
+
+    def add(self, metric, function=None, stride=1, initial=None):
+        """
+        Добавляет метрику: объект Metric или имя и функция
+        """
+        if not isinstance(metric, Metric):
+            metric = Metric(metric, function, stride, initial)
+        if metric.name in self.metrics:
+            self.remove(metric.name)
+        self.metrics[metric.name] = metric
+        self._by_stride.setdefault(metric.stride, []).append(metric)
+        return metric
+
+    def remove(self, name):
+        metric = self.metrics.pop(name)
+        self._by_stride[metric.stride].remove(metric)
+        if not self._by_stride[metric.stride]:
+            del self._by_stride[metric.stride]
+
+    def set_stride(self, name, stride):
+        metric = self.metrics[name]
+        self.add(Metric(name, metric.function, stride, metric.initial))
+
+    def record(self, model, recorder, day):
+        """
+        Записывает метрики, шаг которых приходится на день day
+        """
+        state = None
+        for stride, metrics in self._by_stride.items():
+            if day % stride:
+                continue
+            state = ModelState(model, day) if state is None else state
+            for metric in metrics:
+                recorder.append(metric.name, metric.function(state))
+
+    def record_initial(self, model, recorder):
+        # Стартовое состояние (день 0) для метрик с функцией initial
+        state = ModelState(model, 0)
+        for metric in self.metrics.values():
+            if metric.initial is not None:
+                recorder.append(metric.name, metric.initial(state))
+
+    def strides(self):
+        return {name: {'stride': metric.stride, 'initial': metric.initial is not None}
+                for name, metric in self.metrics.items()}
+
+    def __contains__(self, name):
+        return name in self.metrics
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+    def __len__(self):
+        return len(self.metrics)
+
+    def _string_representation(self):
+        return f'Registry of {len(self.metrics)} metrics'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
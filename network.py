@@ -0,0 +1,216 @@
+import numpy as np
+
+
+class ExposureNetwork:
+    """
+    Разреженная матрица требований банков друг к другу по кредитам МБК и
+    требований ЦБ к банкам. Каждая пара (кредитор, заёмщик) хранится один раз
+    с суммарным объёмом и количеством живых кредитов; погашения заранее
+    разложены по дням, поэтому обновление за день не зависит от размера книг.
+    """
+    def __init__(self, n_banks):
+        self.n_banks = n_banks
+        self.cb = n_banks  # номер узла ЦБ
+        self._volume = {}  # кредитор * (n_banks + 1) + заёмщик -> объём
+        self._count = {}
+        self._maturing = {}  # день -> [(ключи, объёмы)]
+        self._edges = None
+
+    def add(self, lender, borrower, volume, maturity_day):
+        """
+        Записывает выданные кредиты
+        :param lender: Номера кредиторов (self.cb - ЦБ)
+        :param borrower: Номера заёмщиков
+        :param maturity_day: День модели, в начале которого кредит погашается
+        """
+        keys = np.asarray(lender, dtype=np.int64) * (self.n_banks + 1) + np.asarray(borrower, dtype=np.int64)
+        volume = np.asarray(volume, dtype=np.float64)
+        maturity_day = np.asarray(maturity_day, dtype=np.int64)
+        for key, amount in zip(keys.tolist(), volume.tolist()):
+            self._volume[key] = self._volume.get(key, 0) + amount
+            self._count[key] = self._count.get(key, 0) + 1
+        for day in np.unique(maturity_day).tolist():
+            mine = maturity_day == day
+            self._maturing.setdefault(day, []).append((keys[mine], volume[mine]))
+        self._edges = None
+
+    def expire(self, day):
+        """
+        Убирает кредиты, которые погашаются в день day
+        """
+        for keys, volume in self._maturing.pop(day, []):
+            for key, amount in zip(keys.tolist(), volume.tolist()):
+                self._count[key] -= 1
+                if self._count[key]:
+                    self._volume[key] -= amount
+                else:
+                    # Вместе с последним кредитом пары уходит и накопленная ошибка округления
+                    del self._count[key], self._volume[key]
+            self._edges = None
+
+    def _all_edges(self):
+        if self._edges is None:
+            keys = np.fromiter(self._volume.keys(), dtype=np.int64, count=len(self._volume))
+            volume = np.fromiter(self._volume.values(), dtype=np.float64, count=len(self._volume))
+            self._edges = (keys // (self.n_banks + 1), keys % (self.n_banks + 1), volume)
+        return self._edges
+
+    def edges(self):
+        """
+        Требования по МБК в виде троек массивов (кредитор, заёмщик, объём)
+        """
+        lender, borrower, volume = self._all_edges()
+        interbank = lender != self.cb
+        return lender[interbank], borrower[interbank], volume[interbank]
+
+    def dense(self):
+        """
+        Матрица требований МБК (кредитор, заёмщик) формы (n_banks, n_banks)
+        """
+        lender, borrower, volume = self.edges()
+        matrix = np.zeros((self.n_banks, self.n_banks))
+        matrix[lender, borrower] = volume
+        return matrix
+
+    def cb_exposure(self):
+        """
+        Долг каждого банка перед ЦБ
+        """
+        lender, borrower, volume = self._all_edges()
+        from_cb = lender == self.cb
+        return np.bincount(borrower[from_cb], weights=volume[from_cb], minlength=self.n_banks)
+
+    def assets(self):
+        # Требования каждого банка к другим банкам
+        lender, _, volume = self.edges()
+        return np.bincount(lender, weights=volume, minlength=self.n_banks)
+
+    def liabilities(self):
+        # Долг каждого банка перед другими банками
+        _, borrower, volume = self.edges()
+        return np.bincount(borrower, weights=volume, minlength=self.n_banks)
+
+    def get_state(self, prefix, arrays):
+        """
+        Состояние для контрольной точки BankModel: живые кредиты по дням погашения
+        """
+        days, keys, volumes = [], [], []
+        for day, entries in self._maturing.items():
+            for entry_keys, entry_volume in entries:
+                days.append(np.full(len(entry_keys), day))
+                keys.append(entry_keys)
+                volumes.append(entry_volume)
+        arrays[f'{prefix}.day'] = np.concatenate(days) if days else np.empty(0, dtype=np.int64)
+        arrays[f'{prefix}.key'] = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+        arrays[f'{prefix}.volume'] = np.concatenate(volumes) if volumes else np.empty(0)
+        # Суммы по парам сохраняются как есть, чтобы не зависеть от порядка сложения
+        arrays[f'{prefix}.pair_key'] = np.fromiter(self._volume.keys(), dtype=np.int64, count=len(self._volume))
+        arrays[f'{prefix}.pair_volume'] = np.fromiter(self._volume.values(), dtype=np.float64,
+                                                      count=len(self._volume))
+        arrays[f'{prefix}.pair_count'] = np.fromiter(self._count.values(), dtype=np.int64, count=len(self._count))
+        return {'n_banks': self.n_banks}
+
+    @classmethod
+    def from_state(cls, meta, arrays, prefix):
+        network = cls(meta['n_banks'])
+        keys = arrays[f'{prefix}.key']
+        network.add(keys // (network.n_banks + 1), keys % (network.n_banks + 1),
+                    arrays[f'{prefix}.volume'], arrays[f'{prefix}.day'])
+        pair_keys = arrays[f'{prefix}.pair_key'].tolist()
+        network._volume = dict(zip(pair_keys, arrays[f'{prefix}.pair_volume'].tolist()))
+        network._count = dict(zip(pair_keys, arrays[f'{prefix}.pair_count'].tolist()))
+        return network
+
+    def __len__(self):
+        return len(self._volume)
+
+    def _string_representation(self):
+        return f'Exposure network of {self.n_banks} banks with {len(self)} links'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def eisenberg_noe(network, external_assets, other_liabilities=None, tolerance=1e-9, max_iterations=1000):
+    """
+    Вектор клиринговых платежей Эйзенберга-Ное: каждый банк платит по обязательствам
+    столько, сколько может, и делит платёж между кредиторами пропорционально долгу.
+    Итерация p = min(p̄, max(0, e + Πᵀp)) от p = p̄ сходится к наибольшему вектору клиринга.
+    :param external_assets: Активы банков вне МБК (e)
+    :param other_liabilities: Обязательства вне МБК, по умолчанию долг перед ЦБ;
+        входят в p̄, и ЦБ получает свою долю платежа, но сам не банкротится
+    :return: (платежи p, маска дефолтов)
+    """
+    lender, borrower, volume = network.edges()
+    other = network.cb_exposure() if other_liabilities is None else np.asarray(other_liabilities)
+    obligations = network.liabilities() + other
+    share = np.divide(volume, obligations[borrower], out=np.zeros_like(volume), where=obligations[borrower] > 0)
+    payments = obligations.copy()
+    for _ in range(max_iterations):
+        received = np.bincount(lender, weights=share * payments[borrower], minlength=network.n_banks)
+        updated = np.minimum(obligations, np.maximum(0, external_assets + received))
+        if np.abs(updated - payments).max(initial=0) <= tolerance * max(obligations.max(initial=0), 1):
+            payments = updated
+            break
+        payments = updated
+    return payments, payments < obligations - tolerance * np.maximum(obligations, 1)
+
+
+def debt_rank(network, equity, shocked, shock=1.0, weights=None):
+    """
+    DebtRank: доля экономической ценности системы, которая теряется, когда
+    банки shocked теряют долю shock капитала. Потери кредитора от заёмщика -
+    min(1, требование / капитал кредитора), умноженное на бедствие заёмщика;
+    каждый банк передаёт бедствие дальше один раз (Battiston et al., 2012).
+    :param equity: Капитал банков
+    :param shocked: Номера или маска банков с начальным шоком
+    :param weights: Экономический вес банков, по умолчанию - доля в требованиях МБК
+    :return: (DebtRank, уровни бедствия банков h)
+    """
+    lender, borrower, volume = network.edges()
+    equity = np.asarray(equity, dtype=np.float64)
+    impact = np.minimum(1, np.divide(volume, equity[lender], out=np.ones_like(volume), where=equity[lender] > 0))
+    if weights is None:
+        assets = network.assets()
+        weights = assets / assets.sum() if assets.sum() else np.full(network.n_banks, 1 / network.n_banks)
+
+    distress = np.zeros(network.n_banks)
+    distress[shocked] = shock
+    initial = distress.copy()
+    # 0 - без бедствия, 1 - в бедствии (передаёт его на этом шаге), 2 - уже передал
+    status = np.where(distress > 0, 1, 0)
+    while (status == 1).any():
+        active = status[borrower] == 1
+        losses = np.bincount(lender[active], weights=impact[active] * distress[borrower[active]],
+                             minlength=network.n_banks)
+        distress = np.minimum(1, distress + losses)
+        status = np.where(status == 1, 2, status)
+        status = np.where((status == 0) & (distress > 0), 1, status)
+    return float(weights @ distress - weights @ initial), distress
+
+
+def default_cascade(network, equity, defaulted, loss_given_default=1.0):
+    """
+    Каскад дефолтов: кредиторы дефолтных банков теряют loss_given_default их
+    требований, банк с потерями не меньше капитала сам объявляет дефолт
+    :param defaulted: Номера или маска банков, которые объявили дефолт первыми
+    :return: (маска дефолтов, номер раунда дефолта банка или -1)
+    """
+    lender, borrower, volume = network.edges()
+    equity = np.asarray(equity, dtype=np.float64)
+    failed = np.zeros(network.n_banks, dtype=bool)
+    failed[defaulted] = True
+    rounds = np.where(failed, 0, -1)
+    round_number = 0
+    while True:
+        round_number += 1
+        losses = np.bincount(lender, weights=loss_given_default * volume * failed[borrower],
+                             minlength=network.n_banks)
+        new = ~failed & (losses >= equity)
+        if not new.any():
+            return failed, rounds
+        failed |= new
+        rounds[new] = round_number
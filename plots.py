@@ -1,6 +1,225 @@
-from runner import simulation
-from agents import *
-from settings import settings
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+import seaborn as sns
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib import style
+from artifacts import load_artifact
+from downsample import downsample, envelope
 
-simulation(steps = 500)
+style.use('ggplot')
+
+# Линии длиннее MAX_POINTS точек прореживаются перед отрисовкой: 'minmax', 'lttb' или 'none'
+MAX_POINTS = 2000
+DOWNSAMPLE = 'minmax'
+# Полосы квантилей веера ансамбля, от широкой к узкой
+FAN_QUANTILES = ((0.05, 0.95), (0.25, 0.75))
+
+
+def _plot(ax, x, y, **kwargs):
+    # Линия на оси ax по прореженному ряду
+    x, y = downsample(x, np.asarray(y), MAX_POINTS, DOWNSAMPLE)
+    return ax.plot(x, y, **kwargs)
+
+
+def _bank_cash(artifact, *banks):
+    # Ряды кэша отдельных банков (номера сверх количества банков пропускаются)
+    cash = artifact['bank_cash']
+    return [(i, cash[:, i]) for i in banks if i < cash.shape[1]]
+
+
+#1 Ликвидность системы
+def liquidity_figure(artifact):
+    fig, axs = plt.subplots(1, 2)
+    for label, (_, cash) in zip(['Банк 1', 'Банк 2'], _bank_cash(artifact, 2, 3)):
+        _plot(axs[0], artifact.days('bank_cash'), cash, label=label)
+    axs[0].set_title('Ликвидности банков')
+    axs[0].set_xlabel('Шаг модели')
+    axs[0].set_ylabel('Рубли')
+    axs[0].legend()
+    _plot(axs[1], artifact.days('system_liquidity'), artifact['system_liquidity'], color='g')
+    axs[1].set_title('Ликвидность сектора')
+    axs[1].set_xlabel('Шаг модели')
+    return fig
+
+
+#2 Кредиты и депозиты в модели
+def deposits_credits_figure(artifact):
+    fig = plt.figure()
+    _plot(plt.gca(), artifact.days('deposits_volume'), artifact['deposits_volume'], label='Депозиты')
+    _plot(plt.gca(), artifact.days('credits_volume'), artifact['credits_volume'], label='Кредиты')
+    plt.legend()
+    plt.ylabel('Рубли')
+    plt.xlabel('Шаг модели')
+    plt.title('Депозиты и кредиты в системе')
+    return fig
+
+
+#3 Динамика рынка МБК
+def mbk_figure(artifact):
+    fig = plt.figure()
+    _plot(plt.gca(), artifact.days('mbk_credits'), artifact['mbk_credits'], color='royalblue', ls='--')
+    plt.xlabel('Шаг модели')
+    plt.ylabel('Количество кредитов')
+    plt.title('Рынок МБК')
+    return fig
+
+
+#4 Показатели ЦБ
+def cb_figure(artifact):
+    fig, axs = plt.subplots(1, 2)
+    _plot(axs[1], artifact.days('cb_cash'), artifact['cb_cash'])
+    axs[1].set_xlabel('Шаг модели')
+    axs[1].set_title('Резервы ЦБ')
+    axs[1].set_ylabel('Рубли')
+    _plot(axs[0], artifact.days('cb_credits'), artifact['cb_credits'], color='royalblue', ls='dotted')
+    axs[0].set_ylabel('Кол-во кредитов')
+    axs[0].set_xlabel('Шаг модели')
+    axs[0].set_title('Кредиты ЦБ')
+    return fig
+
+
+#5 Индекс ХХИ
+def hhi_figure(artifact):
+    fig = plt.figure()
+    _plot(plt.gca(), artifact.days('hhi'), artifact['hhi'], ls='--')
+    plt.xlabel('Шаг модели')
+    plt.title('Индекс Херфиндаля-Хиршмана')
+    return fig
+
+
+#6 Распределение банков
+def distribution_figure(artifact):
+    data = pd.DataFrame({'Bank': artifact.meta['banks'],
+                         'Cash': np.array(artifact['bank_cash'][-1])})
+    data_sorted = data.sort_values(by='Cash', ascending=False)
+    fig = plt.figure(figsize=(15, 7))
+    sns.barplot(data=data_sorted, x='Cash', y='Bank', palette='magma', hue='Bank', legend=False)
+    plt.xticks(fontsize=8)
+    plt.xlabel('Банки')
+    plt.ylabel('Ликвидность')
+    plt.title('Распределение ликвидности банков')
+    return fig
+
+
+# 7 Просто ликвидность системы
+def system_liquidity_figure(artifact):
+    fig = plt.figure()
+    _plot(plt.gca(), artifact.days('system_liquidity'), artifact['system_liquidity'], color='g')
+    plt.title('Ликвидность сектора')
+    plt.xlabel('Шаг модели')
+    plt.ylabel('Рубли')
+    return fig
+
+
+# 8 Просто 3 банка
+def banks_figure(artifact):
+    fig = plt.figure()
+    for label, (_, cash) in zip(['Банк 1', 'Банк 2', 'Банк 3'], _bank_cash(artifact, 0, 10, 16)):
+        _plot(plt.gca(), artifact.days('bank_cash'), cash, label=label)
+    plt.title('Ликвидность отдельных банков')
+    plt.xlabel('Шаг модели')
+    plt.ylabel('Рубли')
+    return fig
+
+
+def fan_chart(ax, runs, days=None, bands=FAN_QUANTILES, color='tab:blue'):
+    """
+    Веер ансамбля на оси ax: полосы квантилей bands по прогонам и медиана вместо
+    линии на каждый прогон; полосы и медиана прорежены до MAX_POINTS точек
+    :param runs: Массив (прогоны, записи)
+    :param days: Дни модели записей (Artifact.days), по умолчанию - номера записей
+    """
+    runs = np.asarray(runs)
+    steps = np.arange(runs.shape[1]) if days is None else np.asarray(days)
+    levels = sorted({q for band in bands for q in band} | {0.5})
+    quantiles = dict(zip(levels, np.quantile(runs, levels, axis=0)))
+    for number, (low, high) in enumerate(bands):
+        x, lower, upper = envelope(steps, quantiles[low], quantiles[high], MAX_POINTS // 2)
+        ax.fill_between(x, lower, upper, alpha=0.2 + 0.15 * number, color=color, lw=0,
+                        label=f'{100 * low:g}-{100 * high:g} %')
+    _plot(ax, steps, quantiles[0.5], color=color, label='Медиана')
+
+
+ENSEMBLE_TITLES = {'liquidity': 'Ликвидность сектора', 'hhi': 'Индекс Херфиндаля-Хиршмана',
+                   'mbk_credits': 'Рынок МБК', 'cb_credits': 'Кредиты ЦБ'}
+
+
+# Ансамбль: веера всех рядов на одном рисунке
+def ensemble_figure(artifact, bands=FAN_QUANTILES):
+    fig, axs = plt.subplots(2, 2, figsize=(12, 8))
+    for ax, (name, title) in zip(axs.flat, ENSEMBLE_TITLES.items()):
+        fan_chart(ax, artifact[name], artifact.days(name), bands)
+        ax.set_title(title)
+        ax.set_xlabel('Шаг модели')
+    return fig
+
+
+# Ансамбль: веер одного ряда
+def fan_figure(artifact, name, bands=FAN_QUANTILES):
+    fig = plt.figure()
+    fan_chart(plt.gca(), artifact[name], artifact.days(name), bands)
+    plt.title(f'{ENSEMBLE_TITLES.get(name, name)}: {artifact.meta["runs"]} прогонов')
+    plt.xlabel('Шаг модели')
+    plt.legend()
+    return fig
+
+
+FIGURES = [liquidity_figure, deposits_credits_figure, mbk_figure, cb_figure,
+           hhi_figure, distribution_figure, system_liquidity_figure, banks_figure]
+
+
+def figures(artifact):
+    """
+    Функции графиков отчёта по артефакту: function(artifact) -> Figure
+    """
+    if artifact.kind == 'ensemble':
+        return [ensemble_figure] + [partial(fan_figure, name=name) for name in artifact.names()]
+    return FIGURES
+
+
+def report(artifact):
+    """
+    Строит все графики по сохранённому артефакту, не запуская симуляцию
+    :param artifact: Artifact или путь к нему
+    """
+    if isinstance(artifact, str):
+        artifact = load_artifact(artifact)
+    return [figure(artifact) for figure in figures(artifact)]
+
+
+def _render(args):
+    path, number, file_name, dpi = args
+    # Процесс рисует без окон; артефакт открывается заново через отображение в память
+    matplotlib.use('Agg')
+    artifact = load_artifact(path)
+    fig = figures(artifact)[number](artifact)
+    fig.savefig(file_name, dpi=dpi)
+    plt.close(fig)
+    return file_name
+
+
+def render_report(path, out, processes=None, fmt='png', dpi=100):
+    """
+    Сохраняет все графики отчёта по артефакту в файлы out/figure_N.fmt, рисуя их
+    параллельно в пуле процессов без графического интерфейса
+    :param path: Путь к артефакту
+    :param processes: Количество процессов; 1 - рисовать в текущем процессе
+    :return: Пути к файлам графиков
+    """
+    os.makedirs(out, exist_ok=True)
+    tasks = [(path, number, os.path.join(out, f'figure_{number + 1}.{fmt}'), dpi)
+             for number in range(len(figures(load_artifact(path))))]
+    if processes == 1:
+        return [_render(task) for task in tasks]
+    with ProcessPoolExecutor(min(processes or os.cpu_count(), len(tasks))) as pool:
+        return list(pool.map(_render, tasks))
+
+
+if __name__ == '__main__':
+    report(sys.argv[1] if len(sys.argv) > 1 else 'results/run')
+    plt.show()
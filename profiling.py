@@ -0,0 +1,189 @@
+import cProfile
+import csv
+import json
+import pstats
+from time import perf_counter
+import numpy as np
+
+# Фазы шага BankModel.run в порядке выполнения
+PHASES = ['generation', 'distribution', 'validate', 'solve', 'cb', 'clearing', 'restart', 'metrics']
+COUNTERS = ['flows_scanned', 'unsolved_banks', 'mbk_attempts', 'cb_rescues']
+
+
+class _NullPhase:
+    # Пустой контекст: при выключенном профилировании фаза ничего не замеряет
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullProfiler:
+    """
+    Профилировщик по умолчанию: все вызовы ничего не делают
+    """
+    enabled = False
+
+    def start_step(self):
+        pass
+
+    def end_step(self):
+        pass
+
+    def phase(self, name, bank=None):
+        return _NULL_PHASE
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'bank', 'start')
+
+    def __init__(self, profiler, name, bank):
+        self.profiler = profiler
+        self.name = name
+        self.bank = bank
+
+    def __enter__(self):
+        if self.name == self.profiler.cprofile_phase:
+            self.profiler.cprofile.enable()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        if self.name == self.profiler.cprofile_phase:
+            self.profiler.cprofile.disable()
+        self.profiler._add(self.name, elapsed, self.bank)
+        return False
+
+
+class StepProfiler:
+    """
+    Замер времени фаз шага BankModel.run и счётчики шага (просмотренные заявки,
+    попытки МБК, санации ЦБ). По строке на шаг: секунды по фазам и значения счётчиков.
+    """
+    enabled = True
+
+    def __init__(self, per_bank=False, cprofile_phase=None):
+        """
+        :param per_bank: Замерять validate каждого банка отдельно
+        :param cprofile_phase: Имя фазы, которую дополнительно обернуть в cProfile
+        """
+        if cprofile_phase is not None and cprofile_phase not in PHASES:
+            raise ValueError(f'Unknown phase {cprofile_phase!r}, expected one of {PHASES}')
+        self.per_bank = per_bank
+        self.cprofile_phase = cprofile_phase
+        self.cprofile = cProfile.Profile() if cprofile_phase is not None else None
+        self.rows = []
+        self.bank_rows = []
+        self._row = None
+        self._banks = None
+        self._step_start = 0
+
+    def start_step(self):
+        self._row = dict.fromkeys(PHASES + COUNTERS, 0)
+        self._banks = {}
+        self._step_start = perf_counter()
+
+    def end_step(self):
+        self._row['total'] = perf_counter() - self._step_start
+        self.rows.append(self._row)
+        if self.per_bank:
+            self.bank_rows.append(self._banks)
+
+    def phase(self, name, bank=None):
+        """
+        Контекст, время которого прибавляется к фазе name текущего шага
+        :param bank: Номер банка, для фаз, которые выполняются по банкам
+        """
+        return _Phase(self, name, bank)
+
+    def _add(self, name, elapsed, bank):
+        self._row[name] += elapsed
+        if bank is not None and self.per_bank and name == 'validate':
+            self._banks[bank] = self._banks.get(bank, 0) + elapsed
+
+    def count(self, name, value=1):
+        self._row[name] = self._row.get(name, 0) + value
+
+    def __len__(self):
+        return len(self.rows)
+
+    def columns(self):
+        return ['step'] + [name for name in self.rows[0]] if self.rows else ['step'] + PHASES + COUNTERS
+
+    def array(self, name):
+        """
+        Значения фазы или счётчика name по шагам
+        """
+        return np.array([row[name] for row in self.rows], dtype=np.float64)
+
+    def validate_by_bank(self):
+        """
+        Время validate по банкам: массив (шаги, банки)
+        """
+        if not self.per_bank:
+            raise ValueError('Per-bank timing is off, create StepProfiler(per_bank=True)')
+        n_banks = max((max(row, default=-1) for row in self.bank_rows), default=-1) + 1
+        result = np.zeros((len(self.bank_rows), n_banks))
+        for step, row in enumerate(self.bank_rows):
+            for bank, seconds in row.items():
+                result[step, bank] = seconds
+        return result
+
+    def summary(self):
+        """
+        Итог по фазам: суммарное время, среднее на шаг и доля от времени шагов
+        """
+        total = sum(row['total'] for row in self.rows)
+        result = {}
+        for name in PHASES:
+            seconds = sum(row[name] for row in self.rows)
+            result[name] = {'seconds': seconds,
+                            'per_step': seconds / len(self.rows) if self.rows else 0,
+                            'share': seconds / total if total else 0}
+        return result
+
+    def stats(self):
+        """
+        pstats.Stats для фазы, обёрнутой в cProfile
+        """
+        if self.cprofile is None:
+            raise ValueError('No phase is wrapped in cProfile')
+        return pstats.Stats(self.cprofile)
+
+    def to_json(self, path):
+        report = {'summary': self.summary(),
+                  'steps': [dict(row, step=step) for step, row in enumerate(self.rows)]}
+        if self.per_bank:
+            report['validate_by_bank'] = self.validate_by_bank().tolist()
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=1)
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=self.columns())
+            writer.writeheader()
+            for step, row in enumerate(self.rows):
+                writer.writerow(dict(row, step=step))
+
+    def _string_representation(self):
+        lines = [f'Profile of {len(self.rows)} steps']
+        for name, phase in self.summary().items():
+            lines.append(f'{name:>12}: {phase["seconds"]:9.4f} s {100 * phase["share"]:6.1f} %')
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
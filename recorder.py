@@ -0,0 +1,186 @@
+import json
+import os
+import numpy as np
+
+
+class HistoryRecorder:
+    """
+    Запись траекторий модели в заранее выделенные буферы NumPy.
+    Каждый ряд (series) копит значения в своём буфере; заполненный буфер
+    сбрасывается кусками (chunk): в память, если path не задан, или в файлы
+    path/<ряд>/<номер>.npy, и тогда память не растёт на сколь угодно длинных прогонах.
+    """
+    def __init__(self, path=None, chunk_size=4096, chunk_bytes=8 * 2 ** 20):
+        """
+        :param path: Папка для кусков на диске; None - хранить всё в памяти
+        :param chunk_size: Максимум строк в одном куске
+        :param chunk_bytes: Максимальный размер буфера одного ряда в байтах
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_bytes = chunk_bytes
+        self._buffers = {}
+        self._counts = {}
+        self._chunks = {}  # куски в памяти (path is None) или количество кусков на диске
+        self._lengths = {}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def _create(self, name, value):
+        value = np.asarray(value)
+        rows = max(1, min(self.chunk_size, self.chunk_bytes // max(value.nbytes, 1)))
+        self._buffers[name] = np.empty((rows,) + value.shape, dtype=value.dtype)
+        self._counts[name] = 0
+        self._chunks[name] = [] if self.path is None else 0
+        self._lengths[name] = 0
+        if self.path is not None:
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+
+    def append(self, name, value):
+        """
+        Дописывает одно значение (число или массив постоянной формы) в ряд name
+        """
+        if name not in self._buffers:
+            self._create(name, value)
+        buffer = self._buffers[name]
+        buffer[self._counts[name]] = value
+        self._counts[name] += 1
+        self._lengths[name] += 1
+        if self._counts[name] == len(buffer):
+            self._flush_series(name)
+
+    def extend(self, name, values):
+        """
+        Дописывает в ряд name сразу много значений (первая ось values - шаги)
+        """
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+        if name not in self._buffers:
+            self._create(name, values[0])
+        self._flush_series(name)
+        chunk = np.array(values, dtype=self._buffers[name].dtype)
+        if self.path is None:
+            self._chunks[name].append(chunk)
+        else:
+            np.save(os.path.join(self.path, name, f'{self._chunks[name]:06d}.npy'), chunk)
+            self._chunks[name] += 1
+        self._lengths[name] += len(values)
+
+    def _flush_series(self, name):
+        count = self._counts[name]
+        if count == 0:
+            return
+        chunk = self._buffers[name][:count].copy()
+        if self.path is None:
+            self._chunks[name].append(chunk)
+        else:
+            np.save(os.path.join(self.path, name, f'{self._chunks[name]:06d}.npy'), chunk)
+            self._chunks[name] += 1
+        self._counts[name] = 0
+
+    def flush(self):
+        """
+        Сбрасывает все неполные буферы и обновляет manifest.json
+        """
+        for name in self._buffers:
+            self._flush_series(name)
+        if self.path is not None:
+            manifest = {name: {'length': self._lengths[name],
+                               'shape': list(buffer.shape[1:]),
+                               'dtype': buffer.dtype.str}
+                        for name, buffer in self._buffers.items()}
+            with open(os.path.join(self.path, 'manifest.json'), 'w') as file:
+                json.dump(manifest, file, indent=1)
+
+    def series(self, name):
+        """
+        Весь ряд name одним массивом (куски с диска читаются через RecordReader)
+        """
+        if name not in self._buffers:
+            raise KeyError(f'Series {name!r} was not recorded')
+        tail = self._buffers[name][:self._counts[name]]
+        if self.path is None:
+            chunks = self._chunks[name]
+        else:
+            chunks = list(RecordReader(self.path).chunks(name, self._chunks[name]))
+        return np.concatenate(chunks + [tail]) if chunks else tail.copy()
+
+    def last(self, name):
+        """
+        Последнее записанное значение ряда
+        """
+        if self._counts[name]:
+            return self._buffers[name][self._counts[name] - 1]
+        return self.series(name)[-1]
+
+    def names(self):
+        return list(self._buffers)
+
+    def length(self, name):
+        return self._lengths[name]
+
+    @property
+    def nbytes(self):
+        # Память под буферы и куски, которые остались в памяти
+        total = sum(buffer.nbytes for buffer in self._buffers.values())
+        if self.path is None:
+            total += sum(chunk.nbytes for chunks in self._chunks.values() for chunk in chunks)
+        return total
+
+    def __contains__(self, name):
+        return name in self._buffers
+
+    def _string_representation(self):
+        where = 'memory' if self.path is None else self.path
+        return f'Recorder of {len(self._buffers)} series in {where}'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+class RecordReader:
+    """
+    Чтение рядов, сброшенных HistoryRecorder на диск. Куски читаются только
+    при обращении к ряду, по желанию - через отображение в память (mmap).
+    """
+    def __init__(self, path, mmap=False):
+        self.path = path
+        self.mmap_mode = 'r' if mmap else None
+
+    def names(self):
+        return sorted(entry for entry in os.listdir(self.path)
+                      if os.path.isdir(os.path.join(self.path, entry)))
+
+    def chunks(self, name, limit=None):
+        """
+        Куски ряда name по порядку
+        :param limit: Сколько первых кусков читать
+        """
+        files = sorted(os.listdir(os.path.join(self.path, name)))
+        for file in files[:limit]:
+            yield np.load(os.path.join(self.path, name, file), mmap_mode=self.mmap_mode)
+
+    def series(self, name):
+        """
+        Весь ряд name одним массивом
+        """
+        chunks = list(self.chunks(name))
+        if not chunks:
+            raise KeyError(f'Series {name!r} has no chunks in {self.path}')
+        return np.concatenate(chunks)
+
+    def __getitem__(self, name):
+        return self.series(name)
+
+    def _string_representation(self):
+        return f'Record reader for {self.path}'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
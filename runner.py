@@ -1,11 +1,10 @@
-from agents import *
+import argparse
+import json
+import sys
+from agents import BankModel
 from settings import settings
-import matplotlib.pyplot as plt
-from matplotlib import style
-import seaborn as sns
-import pandas as pd
 
-style.use('ggplot')
+
 def simulation(steps):
     model = BankModel(settings)
     model.create_world()
@@ -13,95 +12,149 @@ def simulation(steps):
     return model.system_liquidity_history
 
 
-model = BankModel(settings)
-model.create_world(cb_cash=0)
-# Меняет количество дней симуляции
-model.run(50)
-
-y = [cash_list[-1] for cash_list in model.banks_dict.values()]
-x = model.banks_dict.keys()
-data = {'Bank': x,
-        'Cash': y}
-data = pd.DataFrame(data)
-data_sorted = data.sort_values(by='Cash', ascending=False)
-
-
-#1 Ликвидность системы
-fig1, axs = plt.subplots(1,2)
-axs[0].plot(model.banks[2].cash_history, label='Банк 1')
-axs[0].plot(model.banks[3].cash_history, label='Банк 2')
-axs[0].set_title('Ликвидности банков')
-axs[0].set_xlabel('Шаг модели')
-axs[0].set_ylabel('Рубли')
-axs[0].legend()
-axs[1].plot(model.system_liquidity_history, color='g')
-axs[1].set_title('Ликвидность сектора')
-axs[1].set_xlabel('Шаг модели')
-
-#2 Кредиты и депозиты в модели
-plt.figure(2)
-plt.plot(model.system_deposits_history, label='Депозиты')
-plt.plot(model.system_credits_history, label='Кредиты')
-plt.legend()
-plt.ylabel('Рубли')
-plt.xlabel('Шаг модели')
-plt.title('Депозиты и кредиты в системе')
-
-#3 Динамика рынка МБК
-plt.figure(3)
-plt.plot(model.system_mbk_credits, color='royalblue', ls='--')
-plt.xlabel('Шаг модели')
-plt.ylabel('Количество кредитов')
-plt.title('Рынок МБК')
-
-#4 Показатели ЦБ
-fig1, axs = plt.subplots(1,2)
-# # Создаем первое полотно
-axs[1].plot(model.cb.cash_history)
-axs[1].set_xlabel('Шаг модели')
-axs[1].set_title('Резервы ЦБ')
-axs[1].set_ylabel('Рубли')
-axs[0].plot(model.cb_credits_history, color='royalblue', ls='dotted')
-axs[0].set_ylabel('Кол-во кредитов')
-axs[0].set_xlabel('Шаг модели')
-axs[0].set_title('Кредиты ЦБ')
-
-
-#5 Индекс ХХИ
-plt.figure(5)
-plt.plot(model.hhi_history, ls='--')
-plt.xlabel('Шаг модели')
-plt.title('Индекс Херфиндаля-Хиршмана')
-
-#6 Распределение банков
-plt.figure(6, figsize=(15,7))
-sns.barplot(data = data_sorted, x = 'Cash', y = 'Bank', palette='magma', hue= 'Bank', legend=False)
-plt.xticks(fontsize=8)
-plt.xlabel('Банки')
-plt.ylabel('Ликвидность')
-plt.title('Распределение ликвидности банков')
-
-# 7 Просто ликвидность системы
-plt.figure(7)
-plt.plot(model.system_liquidity_history, color='g')
-plt.title('Ликвидность сектора')
-plt.xlabel('Шаг модели')
-plt.ylabel('Рубли')
-
-# 8 Просто 3 банка
-plt.figure(8)
-plt.plot(model.banks[0].cash_history, label='Банк 1')
-plt.plot(model.banks[10].cash_history, label='Банк 2')
-plt.plot(model.banks[16].cash_history, label='Банк 3')
-plt.title('Ликвидность отдельных банков')
-plt.xlabel('Шаг модели')
-plt.ylabel('Рубли')
-
-# axs[1,0].plot(model.banks[2].reliability_history)
-# axs[1,0].plot(model.banks[3].reliability_history)
-# axs[1,1].plot(model.system_mbk_credits)
-plt.show()
-
-#plt.plot(model.system_deposits_history)
-#plt.plot(model.system_credits_history)
-
+def _settings(overrides):
+    # Настройки из settings.py с подстановками из JSON-строки --set
+    return dict(settings, **json.loads(overrides)) if overrides else settings
+
+
+def run_command(args):
+    from artifacts import save_artifact
+    profiler = None
+    if args.profile or args.profile_phase:
+        from profiling import StepProfiler
+        profiler = StepProfiler(per_bank=args.profile_banks, cprofile_phase=args.profile_phase)
+    if args.resume:
+        # Продолжаем с контрольной точки: настройки и состояние берутся из неё
+        model = BankModel.restore(args.resume, profiler=profiler)
+    else:
+        model = BankModel(_settings(args.set), rng=args.seed, profiler=profiler)
+        model.create_world(cb_cash=args.cb_cash)
+    if args.until_steady:
+        from convergence import run_until_steady
+        report = run_until_steady(model, args.steps)
+        print(f'Stopped by {report["reason"]} after {report["steps"]} steps')
+        for name, metric in report['metrics'].items():
+            print(f'{name:>18}: warm-up {metric["warmup"]}, mean {metric["mean"]:.6g} ± {metric["half_width"]:.3g}')
+    else:
+        model.run(args.steps)
+    save_artifact(model, args.out, seed=args.seed)
+    print(f'Saved {model.day} days to {args.out}')
+    if args.checkpoint:
+        model.checkpoint(args.checkpoint)
+        print(f'Saved checkpoint of day {model.day} to {args.checkpoint}')
+    if profiler is not None:
+        print(profiler)
+        if args.profile:
+            if args.profile.endswith('.csv'):
+                profiler.to_csv(args.profile)
+            else:
+                profiler.to_json(args.profile)
+        if args.profile_phase:
+            profiler.stats().sort_stats('cumulative').print_stats(15)
+
+
+def ensemble_command(args):
+    from artifacts import save_ensemble
+    model_settings = _settings(args.set)
+    if args.engine == 'batched':
+        from batched import run_batched
+        result = run_batched(args.runs, args.steps, model_settings, seed=args.seed, cb_cash=args.cb_cash)
+    else:
+        from ensemble import run_ensemble
+        result = run_ensemble(args.runs, args.steps, model_settings, seed=args.seed,
+                              processes=args.processes, cb_cash=args.cb_cash)
+    save_ensemble(result, args.out, model_settings)
+    print(f'Saved {len(result)} runs of {args.steps} steps to {args.out}')
+
+
+def calibrate_command(args):
+    import os
+    from calibration import calibrate
+    bounds = {key: tuple(value) for key, value in json.loads(args.bounds).items()}
+    result = calibrate(bounds, steps=args.steps, n_initial=args.initial, n_rounds=args.rounds,
+                       n_per_round=args.per_round, seed=args.seed, settings=_settings(args.set),
+                       integer=args.integer, check_every=args.check_every, stop_factor=args.stop_factor,
+                       cache_dir=args.cache, processes=args.processes, cb_cash=args.cb_cash)
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    result.to_json(args.out)
+    print(result)
+    print(f'Saved {len(result)} points to {args.out}')
+
+
+def plot_command(args):
+    # Графические библиотеки нужны только здесь
+    import matplotlib
+    if not args.show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from plots import report, render_report
+
+    if args.show:
+        report(args.artifact)
+        plt.show()
+        return
+    # Файлы графиков рисуются параллельно, по процессу на график
+    files = render_report(args.artifact, args.out, processes=args.processes)
+    print(f'Saved {len(files)} figures to {args.out}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m runner',
+                                     description='Агентная модель банковского сектора России')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='один прогон модели с сохранением артефакта')
+    run.add_argument('--steps', type=int, default=50)
+    run.add_argument('--out', default='results/run')
+    run.add_argument('--until-steady', action='store_true',
+                     help='остановиться раньше --steps, когда метрики выйдут на стационарный режим')
+    run.add_argument('--checkpoint', default=None, help='сохранить состояние модели в конце прогона')
+    run.add_argument('--resume', default=None, help='продолжить прогон с контрольной точки')
+    run.add_argument('--profile', default=None, help='файл .json или .csv для времени фаз по шагам')
+    run.add_argument('--profile-banks', action='store_true', help='замерять validate по банкам')
+    run.add_argument('--profile-phase', default=None, help='фаза шага, которую обернуть в cProfile')
+    run.set_defaults(handler=run_command)
+
+    ensemble = commands.add_parser('ensemble', help='ансамбль независимых прогонов')
+    ensemble.add_argument('--runs', type=int, default=100)
+    ensemble.add_argument('--steps', type=int, default=500)
+    ensemble.add_argument('--processes', type=int, default=None)
+    ensemble.add_argument('--engine', choices=['pool', 'batched'], default='pool')
+    ensemble.add_argument('--out', default='results/ensemble')
+    ensemble.set_defaults(handler=ensemble_command)
+
+    calibration = commands.add_parser('calibrate', help='подбор настроек под наблюдаемые HHI и доли банков')
+    calibration.add_argument('--bounds', required=True, help='границы поиска в виде JSON, '
+                                                             'например \'{"cb_rate": [0.05, 0.2]}\'')
+    calibration.add_argument('--integer', nargs='*', default=(), help='ключи с целыми значениями')
+    calibration.add_argument('--steps', type=int, default=365)
+    calibration.add_argument('--initial', type=int, default=16, help='точек в первом раунде')
+    calibration.add_argument('--rounds', type=int, default=3)
+    calibration.add_argument('--per-round', type=int, default=8, help='точек в следующих раундах')
+    calibration.add_argument('--check-every', type=int, default=30, help='дней между проверками остановки')
+    calibration.add_argument('--stop-factor', type=float, default=3.0,
+                             help='останавливать прогоны хуже лучшей точки во столько раз')
+    calibration.add_argument('--processes', type=int, default=None)
+    calibration.add_argument('--cache', default='calibration_cache')
+    calibration.add_argument('--out', default='results/calibration.json')
+    calibration.set_defaults(handler=calibrate_command)
+
+    for command in (run, ensemble, calibration):
+        command.add_argument('--seed', type=int, default=None)
+        command.add_argument('--cb-cash', type=float, default=1e12)
+        command.add_argument('--set', default=None, help='подстановки настроек в виде JSON, '
+                                                         'например \'{"cb_rate": 0.08}\'')
+
+    plot = commands.add_parser('plot', help='графики по сохранённому артефакту')
+    plot.add_argument('artifact')
+    plot.add_argument('--out', default='results/figures')
+    plot.add_argument('--show', action='store_true', help='показать окна вместо сохранения в файлы')
+    plot.add_argument('--processes', type=int, default=None, help='процессов для отрисовки файлов')
+    plot.set_defaults(handler=plot_command)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
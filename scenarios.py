@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import numpy as np
+from agents import BankModel
+from ensemble import TRACKED
+from settings import settings as default_settings
+
+
+def paired_replicate(settings, shocks, steps, seed, cb_cash=1e12):
+    """
+    Пара прогонов - базовый и с шоками - на общих случайных числах: обе модели
+    получают одну entropy потоков RandomStreams, поэтому до первого шока
+    траектории совпадают, а после расходятся только из-за самого шока
+    :param shocks: {номер шага: {ключ настроек: значение}}
+    :return: (траектории базового прогона, траектории прогона с шоками)
+    """
+    settings = dict(settings, random_streams='common')
+    result = []
+    for schedule in ({}, shocks):
+        model = BankModel(settings, rng=np.random.default_rng(seed), shocks=schedule)
+        model.create_world(cb_cash=cb_cash)
+        model.run(steps)
+        result.append({name: np.asarray(getattr(model, attribute), dtype=np.float64)
+                       for name, attribute in TRACKED.items()})
+    return tuple(result)
+
+
+def _paired_replicate(args):
+    return paired_replicate(*args)
+
+
+class PairedResult:
+    """
+    Траектории парных прогонов: baseline[name] и shocked[name] - массивы (пары, шаги)
+    """
+    def __init__(self, baseline, shocked, shocks, seed, steps):
+        self.baseline = baseline
+        self.shocked = shocked
+        self.shocks = shocks
+        self.seed = seed
+        self.steps = steps
+
+    def difference(self, name):
+        """
+        Разности шок минус база по парам: массив (пары, шаги)
+        """
+        return self.shocked[name] - self.baseline[name]
+
+    def mean(self, name):
+        return self.difference(name).mean(axis=0)
+
+    def interval(self, name, level=0.95):
+        """
+        Доверительный интервал средней разности по шагам (нормальное приближение)
+        :return: (нижняя граница, верхняя граница) - массивы длины шагов
+        """
+        difference = self.difference(name)
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        half_width = z * difference.std(axis=0, ddof=1) / np.sqrt(len(difference))
+        mean = difference.mean(axis=0)
+        return mean - half_width, mean + half_width
+
+    def variance_reduction(self, name):
+        """
+        Во сколько раз дисперсия парной разности меньше, чем у разности
+        независимых прогонов (по шагам после первого шока)
+        """
+        after = slice(min(self.shocks, default=0) + 1, None)
+        independent = self.baseline[name][:, after].var(axis=0, ddof=1) + \
+            self.shocked[name][:, after].var(axis=0, ddof=1)
+        paired = self.difference(name)[:, after].var(axis=0, ddof=1)
+        return float(independent.sum() / paired.sum()) if paired.sum() else float('inf')
+
+    def summary(self, level=0.95):
+        return {name: {'mean': self.mean(name), 'interval': self.interval(name, level)}
+                for name in self.baseline}
+
+    def __len__(self):
+        return len(next(iter(self.baseline.values())))
+
+    def _string_representation(self):
+        return f'{len(self)} paired runs, {self.steps} steps, shocks at steps {sorted(self.shocks)}'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+def run_paired(shocks, n_pairs, steps, settings=None, seed=None, processes=None, cb_cash=1e12):
+    """
+    Запускает n_pairs пар прогонов (база и шоки) в пуле процессов. Пары получают
+    свои потоки из SeedSequence(seed).spawn, внутри пары потоки общие.
+    :param shocks: {номер шага: {ключ настроек: значение}}, например {365: {'cb_rate': 0.2}}
+    :param processes: Количество процессов; 1 - считать в текущем процессе
+    :return: PairedResult
+    """
+    settings = default_settings if settings is None else settings
+    seed_sequence = np.random.SeedSequence(seed)
+    tasks = [(settings, shocks, steps, child, cb_cash) for child in seed_sequence.spawn(n_pairs)]
+
+    if processes == 1:
+        results = [_paired_replicate(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_paired_replicate, tasks))
+
+    baseline = {name: np.stack([result[0][name] for result in results]) for name in TRACKED}
+    shocked = {name: np.stack([result[1][name] for result in results]) for name in TRACKED}
+    return PairedResult(baseline, shocked, shocks, seed_sequence.entropy, steps)
@@ -5,7 +5,13 @@ real = [0.45, 0.14, 0.08, 0.06, 0.05,
 
 uniform = [0.05] * 20
 
-settings = {"liquid_distribution": real,
+settings = {"banks_number": 20,
+            # Стартовые доли ликвидности: список долей или 'real', 'uniform', 'pareto', 'lognormal'
+            "liquid_distribution": real,
+            # Параметр сгенерированного распределения: alpha для 'pareto', sigma для 'lognormal'
+            "liquid_distribution_param": None,
+            # Распределение заявок по банкам: 'uniform', 'proportional' (по кэшу), 'delta' (по привлекательности)
+            "applications_routing": 'uniform',
             "deposit_amount_bound": (10, 1000),
             "credit_amount_bound": (10, 1000),
             "deposit_volume_bound": (10000, 10000000),
@@ -21,7 +27,26 @@ settings = {"liquid_distribution": real,
             "payment_period": [30, 90],
             "bank_start_cash": 1e11,
             "bank_fixed_costs": 0,
-            "bank_operating_costs": 0.02
+            "bank_operating_costs": 0.02,
+            # Поиск кредиторов на МБК: 'random' - свой случайный порядок для каждого заёмщика,
+            # 'queue' - одна случайная очередь кредиторов на всех
+            "mbk_matching": 'random',
+            # Хранение журнала заявок: 'off', 'full' или количество последних дней;
+            # None - 'full', а при записи траекторий на диск - 'off'
+            "ledger_retention": None,
+            # Запись метрик раз в metrics_stride дней; metrics_strides - свой шаг для отдельных метрик
+            "metrics_stride": 1,
+            "metrics_strides": {},
+            # Случайные числа: 'shared' - один генератор на модель, 'common' - свои потоки
+            # по назначениям, дням и банкам (общие случайные числа для сравнения сценариев)
+            "random_streams": 'shared',
+            # Горизонт прогноза кэша для надёжности банка в днях; 0 - надёжность по текущему кэшу
+            "reliability_horizon": 0,
+            # Надёжность банка - кэш, делённый на reliability_scale
+            "reliability_scale": 2e6,
+            # Пороги надёжности (>= первый, > второй, > третий) и надбавки delta к ставкам банка
+            "delta_thresholds": (1, 0.75, 0.6),
+            "delta_rates": (0.03, 0.02, 0.01)
 
             }
 
@@ -0,0 +1,357 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from agents import (Bank, BankModel, FlowBatch, ApplicationLedger, RandomStreams, FLOW_CODES, FLOW_TYPES,
+                    liquidity_shares, routing_weights, clear_interbank, ledger_retention)
+from metrics import MetricsRegistry
+from network import ExposureNetwork
+from profiling import NULL_PROFILER
+from recorder import HistoryRecorder
+
+# Поля общего состояния банков: имя -> число столбцов на банк
+_FIELDS = {'cash': 1, 'reliability': 1, 'delta': 1, 'reserves': 1, 'loan_amount': 1, 'solved': 1,
+           'deposit_counts': len(FLOW_TYPES), 'deposit_volumes': len(FLOW_TYPES),
+           'credit_counts': len(FLOW_TYPES), 'credit_volumes': len(FLOW_TYPES)}
+
+
+class SharedState:
+    """
+    Скалярное состояние банков и итоги их книг в разделяемой памяти: массивы
+    (количество банков,) или (количество банков, len(FLOW_TYPES)) поверх одного
+    буфера, который видят координатор и все процессы-шарды
+    """
+    def __init__(self, n_banks, name=None):
+        width = sum(_FIELDS.values())
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=8 * n_banks * width)
+        self.name = self.memory.name
+        block = np.ndarray((width, n_banks), dtype=np.float64, buffer=self.memory.buf)
+        if name is None:
+            block[:] = 0
+        self.arrays = {}
+        row = 0
+        for field, columns in _FIELDS.items():
+            view = block[row:row + columns]
+            self.arrays[field] = view[0] if columns == 1 else view.T
+            row += columns
+
+    def __getattr__(self, field):
+        try:
+            return self.__dict__['arrays'][field]
+        except KeyError:
+            raise AttributeError(field) from None
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def _shard_worker(connection, shared_name, n_banks, indices, settings, entropy):
+    """
+    Процесс-шард: держит банки indices с их книгами и выполняет для них
+    пофазные команды координатора. Ответ на команду - сигнал, что фаза
+    закончена (барьер перед межбанковскими шагами)
+    """
+    shared = SharedState(n_banks, shared_name)
+    streams = RandomStreams(common=True, entropy=entropy)
+    banks = {i: Bank(f'Bank_{i + 1}', streams.get('world', bank=i), settings, keep_history=False)
+             for i in indices}
+    try:
+        while True:
+            command, payload = connection.recv()
+            if command == 'world':
+                for i, bank in banks.items():
+                    bank.cash = shared.cash[i]
+                    bank.set_reliability()
+                    bank.set_delta()
+                    shared.reliability[i], shared.delta[i] = bank.reliability, bank.delta
+
+            elif command == 'settings':
+                for bank in banks.values():
+                    bank.settings = payload
+                    bank.fixed_costs = payload['bank_fixed_costs']
+                    bank.operating_costs = payload['bank_operating_costs']
+
+            elif command == 'day':
+                day, applications = payload
+                for i, (deposit_apps, credit_apps) in applications.items():
+                    bank = banks[i]
+                    bank.deposit_apps, bank.credit_apps = deposit_apps, credit_apps
+                    bank.rng = streams.get('underwriting', day, i)
+                    bank.validate()
+                    bank.rng = streams.get('funding', day, i)
+                    bank.solve()
+                    shared.cash[i] = bank.cash
+                    shared.reserves[i] = bank.reserves_to_cb
+                    shared.solved[i] = bank.solved
+                    shared.loan_amount[i] = 0 if bank.solved else bank.loan_amount
+
+            elif command == 'restart':
+                # Кредиты дня в порядке BankModel._book_loans, затем конец дня банков
+                for book, flow_type, owners, volume, rate, maturity, payment_period in payload:
+                    for i in np.unique(owners):
+                        if i in banks:
+                            mine = owners == i
+                            getattr(banks[i], book).append_arrays(volume[mine], rate, maturity[mine],
+                                                                  payment_period[mine], FLOW_CODES[flow_type])
+                for i, bank in banks.items():
+                    bank.cash = shared.cash[i]
+                    if not bank.solved:
+                        bank.loan_amount = 0
+                        bank.solved = True
+                    bank.restart()
+                    shared.reliability[i], shared.delta[i] = bank.reliability, bank.delta
+                    shared.deposit_counts[i] = bank.deposits.counts
+                    shared.deposit_volumes[i] = bank.deposits.volumes
+                    shared.credit_counts[i] = bank.credits.counts
+                    shared.credit_volumes[i] = bank.credits.volumes
+
+            elif command == 'stop':
+                break
+            connection.send(None)
+    finally:
+        shared.close()
+
+
+class BankView:
+    """
+    Банк глазами координатора: скалярное состояние из разделяемой памяти
+    """
+    def __init__(self, shared, index):
+        self.shared = shared
+        self.index = index
+        self.name = f'Bank_{index + 1}'
+
+    @property
+    def cash(self):
+        return self.shared.cash[self.index]
+
+    @property
+    def reliability(self):
+        return self.shared.reliability[self.index]
+
+    @property
+    def delta(self):
+        return self.shared.delta[self.index]
+
+    def _string_representation(self):
+        return self.name
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
+
+
+class ShardedBankModel:
+    """
+    Одна банковская система, разделённая между процессами. Банки с их книгами
+    распределены по шардам; validate, solve и restart банков шарды выполняют
+    параллельно, а координатор после каждой такой фазы (барьер) делает общие
+    шаги: генерацию и раздачу заявок, ЦБ, клиринг МБК и запись метрик.
+    Случайные числа - общие потоки RandomStreams по назначениям, дням и банкам,
+    поэтому прогон совпадает с BankModel при random_streams='common' и тем же rng
+    при любом количестве шардов.
+    """
+    def __init__(self, start_settings, n_shards=None, rng=None, recorder=None, profiler=None,
+                 metrics=None, shocks=None):
+        """
+        :param n_shards: Количество процессов-шардов, по умолчанию - число ядер
+        """
+        self.settings = dict(start_settings, random_streams='common')
+        self.streams = RandomStreams(rng, common=True)
+        self.recorder = HistoryRecorder() if recorder is None else recorder
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.metrics = MetricsRegistry.default(self.settings) if metrics is None else metrics
+        self.shocks = {int(step): dict(changes) for step, changes in (shocks or {}).items()}
+        self.day = 0
+
+        n_banks = self.settings.get('banks_number', 20)
+        self.shared = SharedState(n_banks)
+        self.banks = [BankView(self.shared, i) for i in range(n_banks)]
+        self.cb = Bank('Central_Bank', self.streams.get('world', bank=n_banks), self.settings,
+                       self.recorder.path is None)
+        self.exposures = ExposureNetwork(n_banks)
+
+        retention = ledger_retention(self.settings, self.recorder)
+        self.system_deposits = ApplicationLedger('deposit', retention)
+        self.system_credits = ApplicationLedger('credit', retention)
+
+        # Банки делятся между шардами непрерывными блоками
+        n_shards = min(n_shards or multiprocessing.cpu_count(), n_banks)
+        self.partition = np.array_split(np.arange(n_banks), n_shards)
+        self.connections = []
+        self.workers = []
+        for indices in self.partition:
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_shard_worker, daemon=True,
+                args=(child, self.shared.name, n_banks, indices.tolist(), self.settings, self.streams.entropy))
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def _broadcast(self, command, payloads=None):
+        # Команда всем шардам и ожидание, пока каждый её выполнит
+        for shard, connection in enumerate(self.connections):
+            connection.send((command, None if payloads is None else payloads[shard]))
+        for connection in self.connections:
+            connection.recv()
+
+    def create_world(self, cb_cash=1e12):
+        self.cb.cash += cb_cash
+        if self.cb.keep_history:
+            self.cb.cash_history.append(self.cb.cash)
+        self.shared.cash[:] = liquidity_shares(self.settings, len(self.banks), self.streams.get('world')) * 1e10
+        self._broadcast('world')
+        self.metrics.record_initial(self, self.recorder)
+
+    def book_totals(self, book):
+        """
+        Текущие количество и объём потоков по банкам и типам (см. BankModel.book_totals)
+        """
+        prefix = 'deposit' if book == 'deposits' else 'credit'
+        return (getattr(self.shared, f'{prefix}_counts').astype(np.int64),
+                getattr(self.shared, f'{prefix}_volumes').copy())
+
+    def impose_shock(self, changes):
+        self.settings = dict(self.settings, **changes)
+        self.cb.settings = self.settings
+        self.cb.fixed_costs = self.settings['bank_fixed_costs']
+        self.cb.operating_costs = self.settings['bank_operating_costs']
+        self._broadcast('settings', [self.settings] * len(self.connections))
+
+    def _generate(self, flow_type, cash, delta):
+        rng = self.streams.get(flow_type, self.day)
+        bounds = self.settings[f'{flow_type}_amount_bound']
+        routing = self.settings.get('applications_routing', 'uniform')
+        top_rate = max(self.settings.get('delta_rates', (0.03, 0.02, 0.01)))
+        return FlowBatch.generate(flow_type, rng.integers(bounds[0], bounds[1]), len(self.banks), self.settings,
+                                  rng, routing_weights(routing, flow_type, cash, delta, top_rate))
+
+    def _clear_interbank(self):
+        # Клиринг МБК по разделяемому кэшу; кредиты возвращаются для записи в книги шардов
+        solved = np.flatnonzero(self.shared.solved)
+        unsolved = np.flatnonzero(self.shared.solved == 0)
+        if not len(unsolved):
+            return []
+        creditor_cash = self.shared.cash[solved].copy()
+        loan_amounts = self.shared.loan_amount[unsolved].copy()
+        (mbk_borrower, mbk_creditor, mbk_volume), (cb_borrower, cb_volume) = clear_interbank(
+            loan_amounts, creditor_cash, self.streams.get('interbank', self.day),
+            self.settings.get('mbk_matching', 'random'))
+        self.profiler.count('mbk_attempts', len(mbk_volume))
+        self.profiler.count('cb_rescues', len(cb_volume))
+
+        self.shared.cash[solved] = creditor_cash
+        self.shared.cash[unsolved] += loan_amounts
+        self.cb.cash -= cb_volume.sum()
+
+        rng = self.streams.get('loans', self.day)
+        loans = []
+        for flow_type, borrowers, creditors, volume in (('mbk', unsolved[mbk_borrower], solved[mbk_creditor],
+                                                         mbk_volume),
+                                                        ('cb', unsolved[cb_borrower], None, cb_volume)):
+            if len(volume) == 0:
+                continue
+            maturity = rng.choice(self.settings[f'{flow_type}_maturity'], len(volume))
+            payment_period = rng.choice(self.settings['payment_period'], len(volume))
+            lenders = creditors if creditors is not None else np.full(len(volume), self.exposures.cb)
+            self.exposures.add(lenders, borrowers, volume, self.day + 1 + maturity)
+            loans.append(('deposits', flow_type, borrowers, volume, self.settings['cb_rate'], maturity,
+                          payment_period))
+            if creditors is not None:
+                loans.append(('credits', flow_type, creditors, volume, self.settings['cb_rate'], maturity,
+                              payment_period))
+            else:
+                self.cb.credits.append_arrays(volume, self.settings['cb_rate'], maturity, payment_period,
+                                              FLOW_CODES['cb'])
+        return loans
+
+    def run(self, n_steps):
+        """
+        Запускает симуляцию на n_steps дней (см. BankModel.run)
+        """
+        profiler = self.profiler
+        n_banks = len(self.banks)
+        for _ in range(n_steps):
+            profiler.start_step()
+            if self.day in self.shocks:
+                self.impose_shock(self.shocks[self.day])
+            self.exposures.expire(self.day)
+
+            with profiler.phase('generation'):
+                cash = self.shared.cash.copy()
+                delta = self.shared.delta.copy()
+                deposit_supply = self._generate('deposit', cash, delta)
+                self.system_deposits.record(deposit_supply)
+                credit_supply = self._generate('credit', cash, delta)
+                self.system_credits.record(credit_supply)
+            profiler.count('flows_scanned', len(deposit_supply) + len(credit_supply))
+
+            with profiler.phase('distribution'):
+                applications = list(zip(deposit_supply.split(n_banks), credit_supply.split(n_banks)))
+                payloads = [(self.day, {i: applications[i] for i in indices}) for indices in self.partition]
+
+            # Банки шардов принимают заявки и закрывают день параллельно
+            with profiler.phase('validate'):
+                self._broadcast('day', payloads)
+                for reserves in self.shared.reserves:
+                    self.cb.cash += reserves
+            profiler.count('unsolved_banks', int(n_banks - self.shared.solved.sum()))
+
+            with profiler.phase('cb'):
+                self.cb.validate()
+                self.cb.solve()
+
+            with profiler.phase('clearing'):
+                loans = self._clear_interbank()
+
+            with profiler.phase('restart'):
+                self._broadcast('restart', [loans] * len(self.connections))
+
+            self.day += 1
+            if self.cb.keep_history:
+                self.cb.cash_history.append(self.cb.cash)
+            with profiler.phase('metrics'):
+                self.metrics.record(self, self.recorder, self.day)
+
+            profiler.end_step()
+
+        self.recorder.flush()
+
+    # Анализ сети требований тот же, что у BankModel: ему нужны только exposures и кэш банков
+    clearing_vector = BankModel.clearing_vector
+    debt_rank = BankModel.debt_rank
+    default_cascade = BankModel.default_cascade
+
+    def close(self):
+        """
+        Останавливает процессы-шарды и освобождает разделяемую память
+        """
+        if not self.workers:
+            return
+        for connection in self.connections:
+            connection.send(('stop', None))
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.shared.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _string_representation(self):
+        return f'Sharded model of {len(self.banks)} banks in {len(self.workers)} shards, day {self.day}'
+
+    def __repr__(self):
+        return self._string_representation()
+
+    def __str__(self):
+        return self._string_representation()
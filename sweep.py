@@ -0,0 +1,145 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import agents
+import ensemble
+import metrics
+import network
+import profiling
+import recorder
+import settings as settings_module
+from ensemble import replicate
+from settings import settings as default_settings
+
+# Модули, от которых зависят траектории прогона
+MODEL_MODULES = [agents, ensemble, metrics, network, profiling, recorder, settings_module]
+
+
+def _code_version(modules):
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+
+# Версия кода модели: при изменении любого модуля модели старый кэш перестаёт подходить
+CODE_VERSION = _code_version(MODEL_MODULES)
+
+_INDEXED_KEY = re.compile(r'^(\w+)\[(\d+)\]$')
+
+
+def apply_overrides(overrides, settings=None):
+    """
+    Возвращает копию настроек с подставленными значениями.
+    Ключ вида 'deposit_amount_bound[1]' меняет один элемент кортежа или списка
+    """
+    result = dict(default_settings if settings is None else settings)
+    for key, value in overrides.items():
+        match = _INDEXED_KEY.match(key)
+        if match:
+            name, index = match.group(1), int(match.group(2))
+            item = list(result[name])
+            item[index] = value
+            result[name] = type(result[name])(item)
+        else:
+            result[key] = value
+    return result
+
+
+def grid(**ranges):
+    """
+    Полный перебор значений по ключам настроек
+    :return: Список словарей с подстановками
+    """
+    keys = list(ranges)
+    return [dict(zip(keys, values)) for values in itertools.product(*ranges.values())]
+
+
+def latin_hypercube(bounds, n, seed=None, integer=()):
+    """
+    Латинский гиперкуб из n точек в прямоугольнике bounds
+    :param bounds: {ключ: (нижняя граница, верхняя граница)}
+    :param integer: Ключи, значения которых округляются до целых
+    :return: Список словарей с подстановками
+    """
+    rng = np.random.default_rng(seed)
+    points = [{} for _ in range(n)]
+    for key, (low, high) in bounds.items():
+        # По одной точке в каждом из n равных интервалов, интервалы перемешаны
+        unit = (rng.permutation(n) + rng.uniform(size=n)) / n
+        values = low + unit * (high - low)
+        for point, value in zip(points, values):
+            point[key] = int(round(value)) if key in integer else float(value)
+    return points
+
+
+def config_hash(settings, seed, steps, cb_cash=1e12, replication=0):
+    """
+    Ключ кэша прогона: настройки, seed, номер повтора, число шагов и версия кода.
+    Прогон без seed невоспроизводим, и ключа кэша у него нет
+    """
+    if seed is None:
+        raise ValueError('A cached run needs an explicit seed, got None')
+    payload = json.dumps({'settings': settings, 'seed': seed, 'replication': replication,
+                          'steps': steps, 'cb_cash': cb_cash, 'code': CODE_VERSION},
+                         sort_keys=True, default=float)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _run_point(args):
+    settings, steps, seed, replication, cb_cash, path = args
+    child = np.random.SeedSequence(seed).spawn(replication + 1)[replication]
+    result = replicate(settings, steps, child, cb_cash)
+
+    # Пишем во временный файл и переименовываем, чтобы не оставить битый кэш
+    temporary = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(temporary, settings=json.dumps(settings, default=float), **result)
+    os.replace(temporary, path)
+    return result
+
+
+def load_cached(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files if name != 'settings'}
+
+
+def run_sweep(points, steps, seed=0, replications=1, cache_dir='sweep_cache', settings=None,
+              processes=None, cb_cash=1e12):
+    """
+    Прогоняет модель во всех точках перебора параллельно. Результат каждого прогона
+    сохраняется в cache_dir в сжатом виде; точки, которые уже есть в кэше, не пересчитываются.
+    :param points: Список словарей с подстановками (grid, latin_hypercube)
+    :param seed: Seed перебора; обязателен, потому что результаты кэшируются
+    :param replications: Количество прогонов с разными потоками случайных чисел на точку
+    :return: Список (подстановки, [траектории по повторам])
+    """
+    if seed is None:
+        raise ValueError('run_sweep caches its runs and needs an explicit seed, got None')
+    os.makedirs(cache_dir, exist_ok=True)
+    tasks = []
+    paths = []
+    for overrides in points:
+        point_settings = apply_overrides(overrides, settings)
+        point_paths = []
+        for replication in range(replications):
+            key = config_hash(point_settings, seed, steps, cb_cash, replication)
+            path = os.path.join(cache_dir, f'{key}.npz')
+            point_paths.append(path)
+            if not os.path.exists(path):
+                tasks.append((point_settings, steps, seed, replication, cb_cash, path))
+        paths.append(point_paths)
+
+    if tasks:
+        if processes == 1:
+            [_run_point(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                list(pool.map(_run_point, tasks))
+
+    return [(overrides, [load_cached(path) for path in point_paths])
+            for overrides, point_paths in zip(points, paths)]
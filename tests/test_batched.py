@@ -0,0 +1,25 @@
+import numpy as np
+from batched import run_batched
+from ensemble import run_ensemble
+
+
+def test_batched_engine_matches_pooled_ensemble():
+    batched = run_batched(100, 40, seed=1)
+    pooled = run_ensemble(16, 40, seed=2, processes=1)
+    assert batched.metrics == pooled.metrics
+    for name, runs in pooled.trajectories.items():
+        assert batched.trajectories[name].shape[1:] == runs.shape[1:]
+        # Средние по дням прогона сравниваются с учётом разброса обоих ансамблей
+        x = batched.trajectories[name].mean(axis=1)
+        y = runs.mean(axis=1)
+        error = np.hypot(x.std(ddof=1) / np.sqrt(len(x)), y.std(ddof=1) / np.sqrt(len(y)))
+        assert abs(x.mean() - y.mean()) <= 4 * error + 1e-9 * abs(y.mean()), name
+    np.testing.assert_allclose(batched.trajectories['liquidity'][:, 0], pooled.trajectories['liquidity'][0, 0])
+
+
+def test_batched_engine_is_reproducible():
+    first = run_batched(4, 20, seed=5)
+    second = run_batched(4, 20, seed=5)
+    for name, runs in first.trajectories.items():
+        np.testing.assert_array_equal(second.trajectories[name], runs)
+    assert not np.array_equal(first.trajectories['liquidity'][0], first.trajectories['liquidity'][1])
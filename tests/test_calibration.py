@@ -0,0 +1,19 @@
+import calibration
+from calibration import calibrate
+
+
+def calibrate_small(cache_dir):
+    return calibrate({'cb_reserve_rate': (0.1, 0.3)}, steps=30, n_initial=2, n_rounds=1, seed=5,
+                     cache_dir=str(cache_dir), processes=1)
+
+
+def test_cache_is_reused_and_versioned(tmp_path, monkeypatch):
+    first = calibrate_small(tmp_path)
+    assert first.count('cached') == 0
+    second = calibrate_small(tmp_path)
+    assert second.count('cached') == len(second)
+    assert [evaluation['distance'] for evaluation in second.evaluations] == \
+        [evaluation['distance'] for evaluation in first.evaluations]
+    # Изменённый модуль калибровки не должен получать старые результаты
+    monkeypatch.setattr(calibration, 'CALIBRATION_VERSION', 'edited')
+    assert calibrate_small(tmp_path).count('cached') == 0
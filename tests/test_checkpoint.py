@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from agents import BankModel
+from settings import settings
+
+
+def state(model):
+    return (np.array(model.system_liquidity_history), np.array(model.hhi_history),
+            np.array([bank.cash for bank in model.banks]), model.exposures.dense())
+
+
+def test_restore_continues_bit_for_bit(tmp_path):
+    for random_streams in ('shared', 'common'):
+        model = BankModel(dict(settings, random_streams=random_streams), rng=3)
+        model.create_world()
+        model.run(60)
+        path = str(tmp_path / f'{random_streams}.npz')
+        model.checkpoint(path)
+        restored = BankModel.restore(path)
+        model.run(40)
+        restored.run(40)
+        assert restored.day == model.day
+        for expected, actual in zip(state(model), state(restored)):
+            np.testing.assert_array_equal(actual, expected)
+
+
+def test_restore_keeps_bank_generators_separate(tmp_path):
+    model = BankModel(dict(settings, random_streams='common'), rng=3)
+    model.create_world()
+    model.run(10)
+    path = str(tmp_path / 'common.npz')
+    model.checkpoint(path)
+    restored = BankModel.restore(path)
+    generators = [bank.rng for bank in restored.banks + [restored.cb]]
+    assert all(rng is not restored.rng for rng in generators)
+    assert len({id(rng) for rng in generators}) == len(generators)
+    for bank, original in zip(restored.banks + [restored.cb], model.banks + [model.cb]):
+        assert bank.rng.bit_generator.state == original.rng.bit_generator.state
+    # В режиме 'shared' банки по-прежнему берут числа из генератора модели
+    shared = BankModel(settings, rng=3)
+    shared.create_world()
+    shared.run(5)
+    shared.checkpoint(path)
+    restored = BankModel.restore(path)
+    assert all(bank.rng is restored.rng for bank in restored.banks + [restored.cb])
+
+
+def test_fork_branches_are_distinct_and_reproducible():
+    model = BankModel(settings, rng=3)
+    model.create_world()
+    model.run(20)
+    with pytest.raises(ValueError):
+        model.fork(2, None)
+    branches = model.fork(3, seed=7)
+    again = model.fork(3, seed=7)
+    for branch in branches + again:
+        branch.run(15)
+    liquidity = [np.array(branch.system_liquidity_history) for branch in branches]
+    assert not np.array_equal(liquidity[0], liquidity[1])
+    assert not np.array_equal(liquidity[1], liquidity[2])
+    for branch, repeated in zip(branches, again):
+        np.testing.assert_array_equal(repeated.system_liquidity_history, branch.system_liquidity_history)
+    # Ветки начинаются с состояния модели
+    np.testing.assert_array_equal(liquidity[0][:21], model.system_liquidity_history)
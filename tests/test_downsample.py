@@ -0,0 +1,36 @@
+import numpy as np
+from downsample import envelope, lttb, minmax
+
+
+def series_with_spike():
+    y = np.random.default_rng(0).normal(size=100000)
+    y[54321] = 1e6
+    return np.arange(len(y)), y
+
+
+def test_lttb_keeps_spike_after_nan():
+    x, y = series_with_spike()
+    y[7] = np.nan
+    sampled_x, sampled_y = lttb(x, y, 1000)
+    assert len(sampled_y) == 1000
+    assert 54321 in sampled_x
+    # Ряд, который начинается с NaN и содержит длинный пропуск
+    y[0] = np.nan
+    y[200:900] = np.nan
+    assert 54321 in lttb(x, y, 1000)[0]
+
+
+def test_minmax_keeps_spike_and_ends():
+    x, y = series_with_spike()
+    y[7] = np.nan
+    sampled_x, sampled_y = minmax(x, y, 500)
+    assert len(sampled_y) <= 2 * 500 + 2
+    assert 54321 in sampled_x
+    assert sampled_x[0] == 0 and sampled_x[-1] == len(y) - 1
+
+
+def test_envelope_does_not_narrow_band():
+    x, y = series_with_spike()
+    _, low, high = envelope(x, y - 1, y + 1, 100)
+    assert low.min() == (y - 1).min()
+    assert high.max() == 1e6 + 1
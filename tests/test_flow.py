@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from agents import BankModel, Flow, HistoryList
+from settings import settings
+
+
+def test_given_volume_keeps_its_type_terms():
+    for flow_type in ('deposit', 'credit', 'mbk', 'cb'):
+        flow = Flow(flow_type, 5000.0, rng=1)
+        assert flow.volume == 5000
+        assert flow.maturity in settings[f'{flow_type}_maturity']
+        assert flow.payment_period in settings['payment_period'] and flow.days_to_pay == flow.payment_period
+
+
+def test_volume_is_drawn_only_for_client_flows():
+    low, high = settings['credit_volume_bound']
+    assert low <= Flow('credit', rng=2).volume <= high
+    assert Flow('mbk', rng=2).volume is None
+
+
+def test_unknown_type_and_missing_generator_are_rejected():
+    with pytest.raises(ValueError):
+        Flow('flow', 100.0, rng=0)
+    with pytest.raises(ValueError):
+        Flow('deposit')
+
+
+def test_model_flows_come_from_the_model_streams():
+    def flows(seed):
+        model = BankModel(dict(settings, random_streams='common'), rng=seed)
+        model.create_world()
+        model.run(3)
+        return model.flows('deposit', 5)
+
+    first, again, other = flows(1), flows(1), flows(2)
+    assert [flow.volume for flow in first] == [flow.volume for flow in again]
+    assert [flow.volume for flow in first] != [flow.volume for flow in other]
+    assert len({flow.volume for flow in first}) == len(first)
+    book = HistoryList(first)
+    assert book.count('deposit') == 5 and np.isclose(book.total(), sum(flow.volume for flow in first))
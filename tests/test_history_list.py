@@ -0,0 +1,43 @@
+import numpy as np
+from agents import HistoryList, FLOW_TYPES
+
+
+class ReferenceBook:
+    """
+    Прежняя книга со сроками, которые уменьшаются у каждого потока каждый день
+    """
+    def __init__(self):
+        self.flows = []  # [объём, ставка, срок, дней до выплаты, период, тип]
+
+    def append(self, volume, rate, maturity, payment_period, flow_type):
+        for row in zip(volume, rate, maturity, payment_period, payment_period, flow_type):
+            self.flows.append([row[0], row[1], row[2], row[4], row[3], row[5]])
+
+    def roll(self):
+        coupon = sum(volume * rate / (360 / period) for volume, rate, _, days, period, _ in self.flows if days == 0)
+        matured = sum(flow[0] for flow in self.flows if flow[2] == 0)
+        self.flows = [flow for flow in self.flows if flow[2] != 0]
+        for flow in self.flows:
+            flow[2] -= 1
+            flow[3] = flow[4] if flow[3] == 0 else flow[3] - 1
+        return coupon, matured
+
+    def counts(self):
+        return np.bincount([flow[5] for flow in self.flows], minlength=len(FLOW_TYPES))
+
+
+def test_calendar_roll_matches_per_flow_decrement():
+    rng = np.random.default_rng(0)
+    book = HistoryList(keep_history=False)
+    reference = ReferenceBook()
+    for day in range(400):
+        n = int(rng.integers(0, 8))
+        columns = (rng.uniform(1e4, 1e7, n), rng.uniform(0.05, 0.2, n), rng.choice([0, 1, 30, 90, 180, 360], n),
+                   rng.choice([1, 30, 90], n), rng.integers(0, len(FLOW_TYPES), n))
+        book.append_arrays(*columns)
+        reference.append(*columns)
+        coupon, matured = book.roll()
+        expected_coupon, expected_matured = reference.roll()
+        assert np.isclose(coupon, expected_coupon, rtol=1e-12, atol=1e-6)
+        assert np.isclose(matured, expected_matured, rtol=1e-12, atol=1e-6)
+        np.testing.assert_array_equal(book.counts, reference.counts())
@@ -0,0 +1,18 @@
+import json
+import subprocess
+import sys
+from conftest import ROOT
+
+# Бюджет времени импорта runner в секундах
+IMPORT_BUDGET = 1.0
+PLOTTING = ['matplotlib', 'seaborn', 'pandas']
+
+
+def test_runner_import_is_headless_and_fast():
+    code = ('import sys, time, json; start = time.perf_counter(); import runner; '
+            'print(json.dumps({"seconds": time.perf_counter() - start, '
+            f'"loaded": [name for name in {PLOTTING!r} if name in sys.modules]}}))')
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout)
+    assert result['loaded'] == []
+    assert result['seconds'] < IMPORT_BUDGET
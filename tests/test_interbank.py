@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from agents import BankModel, clear_interbank
+from settings import settings
+
+MATCHINGS = ('random', 'queue')
+
+
+def check_conservation(loan_amounts, creditor_cash, matching, seed=0):
+    cash = creditor_cash.copy()
+    (borrower, creditor, volume), (rescued, remainder) = clear_interbank(
+        loan_amounts, cash, np.random.default_rng(seed), matching)
+    assert np.all(volume >= 0) and np.all(remainder >= 0) and np.all(cash >= -1e-6)
+    # Кредиторы отдали ровно то, что записано в кредиты МБК
+    np.testing.assert_allclose(creditor_cash - cash, np.bincount(creditor, volume, len(cash)), atol=1e-6)
+    # Каждый заёмщик получил всю потребность от кредиторов и ЦБ
+    received = np.bincount(borrower, volume, len(loan_amounts)) + np.bincount(rescued, remainder,
+                                                                              len(loan_amounts))
+    np.testing.assert_allclose(received, loan_amounts, rtol=1e-12)
+    np.testing.assert_allclose((creditor_cash - cash).sum() + remainder.sum(), loan_amounts.sum(), rtol=1e-12)
+    return (borrower, creditor, volume), (rescued, remainder), cash
+
+
+@pytest.mark.parametrize('matching', MATCHINGS)
+def test_need_is_covered_by_creditors_and_cb(matching):
+    rng = np.random.default_rng(1)
+    for seed in range(200):
+        loan_amounts = rng.uniform(1, 100, rng.integers(1, 6))
+        creditor_cash = rng.uniform(0, 60, rng.integers(1, 8))
+        check_conservation(loan_amounts, creditor_cash, matching, seed)
+
+
+@pytest.mark.parametrize('matching', MATCHINGS)
+def test_creditors_without_cash_lend_nothing(matching):
+    loan_amounts = np.array([30.0, 50.0])
+    creditor_cash = np.array([0.0, 40.0, 0.0, 20.0])
+    (_, creditor, volume), (rescued, remainder), cash = check_conservation(loan_amounts, creditor_cash, matching)
+    assert not np.any(volume[np.isin(creditor, [0, 2])] > 0)
+    np.testing.assert_array_equal(cash, 0)
+    assert remainder.sum() == pytest.approx(20.0)
+
+
+@pytest.mark.parametrize('matching', MATCHINGS)
+def test_without_creditors_cb_rescues_everything(matching):
+    loan_amounts = np.array([30.0, 50.0, 5.0])
+    (borrower, _, volume), (rescued, remainder), _ = check_conservation(loan_amounts, np.empty(0), matching)
+    assert len(volume) == 0 or not np.any(volume > 0)
+    np.testing.assert_array_equal(rescued, [0, 1, 2])
+    np.testing.assert_array_equal(remainder, loan_amounts)
+
+
+def test_unknown_matching_is_rejected():
+    with pytest.raises(ValueError):
+        clear_interbank(np.ones(1), np.ones(1), np.random.default_rng(0), 'auction')
+
+
+@pytest.mark.parametrize('matching', MATCHINGS)
+def test_model_clearing_conserves_cash(matching):
+    model = BankModel(dict(settings, mbk_matching=matching), rng=2)
+    model.create_world()
+    model.run(20)
+    for bank in model.banks[:4]:
+        bank.loan_amount = 5e10
+        bank.cash -= 5e10
+    model.unsolved_banks = model.banks[:4]
+    model.solved_banks = model.banks[4:]
+    borrowers_cash = [bank.cash for bank in model.banks[:4]]
+    creditors_cash = sum(bank.cash for bank in model.banks[4:])
+    cb_cash = model.cb.cash
+    model.clear_interbank()
+    # Заёмщики получили всю потребность, кредиторы и ЦБ отдали её вместе
+    np.testing.assert_allclose([bank.cash for bank in model.banks[:4]], np.add(borrowers_cash, 5e10))
+    lent = creditors_cash - sum(bank.cash for bank in model.banks[4:])
+    assert lent + cb_cash - model.cb.cash == pytest.approx(4 * 5e10, rel=1e-12)
+    assert all(bank.solved and bank.loan_amount == 0 for bank in model.banks[:4])
+    assert all(bank.cash >= 0 for bank in model.banks[4:])
@@ -0,0 +1,64 @@
+import numpy as np
+from agents import Bank, BankModel, HistoryList, FLOW_CODES, FLOW_TYPES, LADDER_COLUMNS
+from settings import settings
+
+
+def random_book(rng, days=50, flow_types=FLOW_TYPES):
+    codes = [FLOW_CODES[flow_type] for flow_type in flow_types]
+    book = HistoryList(keep_history=False)
+    for _ in range(days):
+        n = int(rng.integers(0, 6))
+        book.append_arrays(rng.uniform(1e4, 1e7, n), rng.uniform(0.05, 0.2, n), rng.choice([0, 10, 90, 180], n),
+                           rng.choice([1, 30, 90], n), rng.choice(codes, n))
+        book.roll()
+    return book
+
+
+def test_ladder_predicts_the_next_rolls():
+    book = random_book(np.random.default_rng(0))
+    coupons, principal = book.ladder(300)
+    assert coupons.shape == principal.shape == (300, len(FLOW_TYPES))
+    for day in range(300):
+        coupon, matured = book.roll()
+        assert np.isclose(coupons[day].sum(), coupon, rtol=1e-12, atol=1e-6)
+        assert np.isclose(principal[day].sum(), matured, rtol=1e-12, atol=1e-6)
+    assert book.count() == 0
+
+
+def test_ladder_by_type_on_one_flow():
+    book = HistoryList(keep_history=False)
+    # Кредит МБК 3600 под 10 % на 61 день с выплатами раз в 30 дней: купоны на 30-й и 61-й проход
+    book.append_arrays([3600.0], 0.1, 61, 30, FLOW_CODES['mbk'])
+    coupons, principal = book.ladder(70)
+    mbk = FLOW_CODES['mbk']
+    assert np.flatnonzero(coupons[:, mbk]).tolist() == [30, 61]
+    np.testing.assert_allclose(coupons[[30, 61], mbk], 3600 * 0.1 / 12)
+    assert np.flatnonzero(principal[:, mbk]).tolist() == [61]
+    assert principal.sum() == 3600 and coupons.sum() == coupons[:, mbk].sum()
+
+
+def test_liquidity_gap_is_cash_plus_cumulative_net_inflows():
+    rng = np.random.default_rng(1)
+    bank = Bank('Bank_1', rng, settings, keep_history=False)
+    bank.cash = 5e6
+    # В лестницу входят кредиты и депозиты клиентов, МБК и ЦБ
+    bank.credits = random_book(rng, flow_types=['credit', 'mbk', 'cb'])
+    bank.deposits = random_book(rng, flow_types=['deposit', 'mbk', 'cb'])
+    ladder = bank.liquidity_ladder(200)
+    assert ladder.shape == (200, len(LADDER_COLUMNS))
+    gap = bank.liquidity_gap(200)
+    cash = bank.cash
+    for day in range(200):
+        cash += sum(bank.credits.roll()) - sum(bank.deposits.roll())
+        assert np.isclose(gap[day], cash, rtol=1e-12, atol=1e-3)
+
+
+def test_system_ladder_sums_bank_ladders():
+    model = BankModel(settings, rng=2)
+    model.create_world()
+    model.run(30)
+    ladders = model.liquidity_ladders(90)
+    assert ladders.shape == (len(model.banks), 90, len(LADDER_COLUMNS))
+    np.testing.assert_allclose(model.liquidity_ladder(90), ladders.sum(axis=0))
+    np.testing.assert_allclose(model.liquidity_ladder(90, include_cb=True) - model.liquidity_ladder(90),
+                               model.cb.liquidity_ladder(90))
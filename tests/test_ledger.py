@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from agents import ApplicationLedger, BankModel, FlowBatch
+from settings import settings
+
+
+def batch(day, n):
+    # Заявки дня day с объёмами, по которым видно день и номер заявки
+    volume = day * 100 + np.arange(n, dtype=np.float64)
+    return FlowBatch('deposit', volume, np.full(n, 0.05), np.full(n, 180), np.full(n, 30), np.arange(n) % 3)
+
+
+def fill(ledger, sizes):
+    for day, n in enumerate(sizes):
+        ledger.record(batch(day, n))
+    return ledger
+
+
+SIZES = [3, 0, 40, 7, 1, 25, 2]
+
+
+def test_full_retention_keeps_every_day():
+    ledger = fill(ApplicationLedger('deposit', 'full'), SIZES)
+    assert list(ledger.days()) == list(range(len(SIZES)))
+    assert ledger.n_applications == sum(SIZES)
+    for day, n in enumerate(SIZES):
+        np.testing.assert_array_equal(ledger.day(day).volume, batch(day, n).volume)
+        np.testing.assert_array_equal(ledger.day(day).bank, batch(day, n).bank)
+
+
+def test_window_retention_keeps_last_days():
+    ledger = fill(ApplicationLedger('deposit', 3), SIZES)
+    assert list(ledger.days()) == [4, 5, 6]
+    assert ledger.n_days == len(SIZES) and ledger.n_applications == sum(SIZES)
+    for day in ledger.days():
+        np.testing.assert_array_equal(ledger.day(day).volume, batch(day, SIZES[day]).volume)
+    with pytest.raises(KeyError):
+        ledger.day(3)
+
+
+def test_off_retention_keeps_only_counters():
+    ledger = fill(ApplicationLedger('deposit', 'off'), SIZES)
+    assert list(ledger.days()) == []
+    assert ledger.n_days == len(SIZES) and ledger.n_applications == sum(SIZES)
+    with pytest.raises(KeyError):
+        ledger.day(len(SIZES) - 1)
+
+
+@pytest.mark.parametrize('retention', ['never', 0, -2, 2.5])
+def test_unsupported_retention_is_rejected(retention):
+    with pytest.raises(ValueError):
+        ApplicationLedger('deposit', retention)
+
+
+def test_retention_does_not_change_the_model():
+    runs = {}
+    for retention in ('full', 5, 'off'):
+        model = BankModel(dict(settings, ledger_retention=retention), rng=4)
+        model.create_world()
+        model.run(30)
+        runs[retention] = model
+    np.testing.assert_array_equal(runs['off'].system_liquidity_history, runs['full'].system_liquidity_history)
+    np.testing.assert_array_equal(runs[5].system_liquidity_history, runs['full'].system_liquidity_history)
+    assert list(runs[5].system_deposits.days()) == list(range(25, 30))
+    for day in runs[5].system_deposits.days():
+        np.testing.assert_array_equal(runs[5].system_deposits.day(day).volume,
+                                      runs['full'].system_deposits.day(day).volume)
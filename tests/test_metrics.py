@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from agents import BankModel
+from metrics import Metric, MetricsRegistry, gini, hhi, top_share
+from settings import settings
+
+
+def test_concentration_measures():
+    assert hhi(np.array([1.0, 1.0, 1.0, 1.0])) == pytest.approx(2500)
+    assert hhi(np.array([5.0, 0.0])) == pytest.approx(10000)
+    assert gini(np.full(4, 3.0)) == pytest.approx(0)
+    # Весь кэш у одного из n банков: (n - 1) / n
+    assert gini(np.array([0.0, 0.0, 0.0, 8.0])) == pytest.approx(0.75)
+    assert gini(np.array([1.0, 2.0, 3.0, 4.0])) == pytest.approx(0.25)
+    assert gini(np.zeros(3)) == 0
+    assert top_share(np.array([1.0, 4.0, 2.0, 3.0]), 2) == pytest.approx(0.7)
+    assert top_share(np.array([1.0, 4.0]), 5) == pytest.approx(1)
+
+
+def test_metric_days_and_strides():
+    assert list(Metric('a', len, 3).days(10)) == [3, 6, 9]
+    assert list(Metric('b', len, 3, initial=True).days(10)) == [0, 3, 6, 9]
+    with pytest.raises(ValueError):
+        Metric('c', len, 0)
+    registry = MetricsRegistry.default(dict(settings, metrics_stride=2, metrics_strides={'hhi': 5}))
+    strides = registry.strides()
+    assert strides['hhi'] == {'stride': 5, 'initial': False}
+    assert strides['bank_cash'] == {'stride': 2, 'initial': True}
+    registry.set_stride('hhi', 7)
+    assert registry['hhi'].stride == 7 and len(registry) == len(strides)
+
+
+def test_recorded_series_follow_their_strides():
+    model = BankModel(dict(settings, metrics_stride=3, metrics_strides={'hhi': 4}), rng=1)
+    model.metrics.add('liquidity_copy', lambda state: state.cash.sum() + state.cb_cash, stride=1)
+    model.create_world()
+    model.run(20)
+    for name, metric in model.metrics.metrics.items():
+        assert model.recorder.length(name) == len(metric.days(20)), name
+    full = model.recorder.series('liquidity_copy')
+    # Ряд с шагом 3 - это каждое третье значение ежедневного ряда
+    np.testing.assert_allclose(model.recorder.series('system_liquidity')[1:], full[2::3])
+    assert model.recorder.series('hhi')[-1] == pytest.approx(hhi(np.array([bank.cash for bank in model.banks])))
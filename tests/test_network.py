@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from network import ExposureNetwork, debt_rank, default_cascade, eisenberg_noe
+
+
+def chain():
+    # Банк 0 кредитует банк 1 на 50, банк 1 - банк 2 на 20
+    network = ExposureNetwork(3)
+    network.add([0, 1], [1, 2], [50.0, 20.0], [100, 100])
+    return network
+
+
+def test_expire_removes_loans_on_their_day():
+    network = ExposureNetwork(3)
+    network.add([0, 0, network.cb], [1, 1, 2], [10.0, 5.0, 3.0], [5, 7, 5])
+    assert network.dense()[0, 1] == 15
+    np.testing.assert_array_equal(network.cb_exposure(), [0, 0, 3])
+    network.expire(5)
+    assert network.dense()[0, 1] == 5
+    np.testing.assert_array_equal(network.cb_exposure(), [0, 0, 0])
+    assert len(network) == 1
+    network.expire(6)
+    assert len(network) == 1
+    network.expire(7)
+    assert len(network) == 0
+    np.testing.assert_array_equal(network.dense(), np.zeros((3, 3)))
+
+
+def test_eisenberg_noe_clearing_vector():
+    # 0 должен 1 двадцать, 1 должен 2 десять; вне МБК у банка 0 только 5
+    network = ExposureNetwork(3)
+    network.add([1, 2], [0, 1], [20.0, 10.0], [100, 100])
+    payments, defaults = eisenberg_noe(network, np.array([5.0, 0.0, 0.0]))
+    np.testing.assert_allclose(payments, [5, 5, 0])
+    np.testing.assert_array_equal(defaults, [True, True, False])
+    payments, defaults = eisenberg_noe(network, np.array([25.0, 0.0, 0.0]))
+    np.testing.assert_allclose(payments, [20, 10, 0])
+    assert not defaults.any()
+
+
+def test_eisenberg_noe_cycle_with_cb_debt():
+    # Кольцо 0 -> 1 -> 2 -> 0: 0 должен 1 двадцать, 1 должен 2 десять, 2 должен 0 десять
+    network = ExposureNetwork(3)
+    network.add([1, 2, 0], [0, 1, 2], [20.0, 10.0, 10.0], [100, 100, 100])
+    # p0 = min(20, 5 + p2), p1 = min(10, p0), p2 = min(10, p1)
+    payments, defaults = eisenberg_noe(network, np.array([5.0, 0.0, 0.0]))
+    np.testing.assert_allclose(payments, [15, 10, 10])
+    np.testing.assert_array_equal(defaults, [True, False, False])
+    # Долг банка 1 перед ЦБ забирает половину его платежа: p0 = 5 + p0 / 2
+    network.add([network.cb], [1], [10.0], [100])
+    payments, defaults = eisenberg_noe(network, np.array([5.0, 0.0, 0.0]))
+    np.testing.assert_allclose(payments, [10, 10, 5])
+    np.testing.assert_array_equal(defaults, [True, True, True])
+    payments, _ = eisenberg_noe(network, np.array([5.0, 0.0, 0.0]), other_liabilities=np.zeros(3))
+    np.testing.assert_allclose(payments, [15, 10, 10])
+
+
+def test_debt_rank_on_chain():
+    rank, distress = debt_rank(chain(), np.array([100.0, 10.0, 10.0]), [2])
+    # Банк 1 теряет min(1, 20 / 10) = 1, банк 0 - min(1, 50 / 100) * 1 = 0.5
+    np.testing.assert_allclose(distress, [0.5, 1, 1])
+    # Веса - доли в требованиях МБК: 50 / 70 и 20 / 70, у банка 2 требований нет
+    assert rank == pytest.approx((50 * 0.5 + 20 * 1) / 70)
+    rank, distress = debt_rank(chain(), np.array([100.0, 10.0, 10.0]), [2], shock=0.2)
+    np.testing.assert_allclose(distress, [0.1, 0.2, 0.2])
+
+
+def test_default_cascade_order():
+    failed, rounds = default_cascade(chain(), np.array([100.0, 10.0, 10.0]), [2])
+    np.testing.assert_array_equal(failed, [False, True, True])
+    np.testing.assert_array_equal(rounds, [-1, 1, 0])
+    failed, rounds = default_cascade(chain(), np.array([40.0, 10.0, 10.0]), [2])
+    np.testing.assert_array_equal(rounds, [2, 1, 0])
+    failed, rounds = default_cascade(chain(), np.array([40.0, 10.0, 10.0]), [2], loss_given_default=0.4)
+    np.testing.assert_array_equal(rounds, [-1, -1, 0])
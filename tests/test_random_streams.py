@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from agents import BankModel, RandomStreams
+from ensemble import run_ensemble
+from settings import settings
+
+
+def liquidity(seed, random_streams):
+    model = BankModel(dict(settings, random_streams=random_streams), rng=seed)
+    model.create_world()
+    model.run(30)
+    return np.array(model.system_liquidity_history)
+
+
+@pytest.mark.parametrize('random_streams', ['shared', 'common'])
+def test_same_seed_same_run(random_streams):
+    np.testing.assert_array_equal(liquidity(11, random_streams), liquidity(11, random_streams))
+    assert not np.array_equal(liquidity(11, random_streams), liquidity(12, random_streams))
+
+
+def test_common_streams_depend_only_on_key():
+    streams = RandomStreams(entropy=123, common=True)
+    again = RandomStreams(rng=99, entropy=123, common=True)
+    draw = streams.get('deposit', 5).random(4)
+    # Порядок и количество запросов не влияют на числа потока
+    again.get('credit', 5).random(100)
+    np.testing.assert_array_equal(again.get('deposit', 5).random(4), draw)
+    keys = [('deposit', 5, None), ('credit', 5, None), ('deposit', 6, None), ('deposit', 5, 0), ('deposit', 5, 1)]
+    draws = [streams.get(*key).random() for key in keys]
+    assert len(set(draws)) == len(keys)
+
+
+def test_shared_streams_use_one_generator():
+    streams = RandomStreams(rng=3)
+    assert streams.get('deposit', 1) is streams.get('loans', 7, bank=2) is streams.rng
+
+
+def test_ensemble_does_not_depend_on_processes():
+    serial = run_ensemble(3, 20, seed=8, processes=1)
+    parallel = run_ensemble(3, 20, seed=8, processes=2)
+    assert serial.seed == parallel.seed == 8
+    for name, runs in serial.trajectories.items():
+        np.testing.assert_array_equal(parallel.trajectories[name], runs)
+    # Прогоны ансамбля получают разные потоки
+    liquidity_runs = serial.trajectories['liquidity']
+    assert not np.array_equal(liquidity_runs[0], liquidity_runs[1])
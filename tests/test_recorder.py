@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from agents import BankModel
+from recorder import HistoryRecorder, RecordReader
+from settings import settings
+
+
+def record(recorder, n):
+    for day in range(n):
+        recorder.append('liquidity', float(day))
+        recorder.append('cash', np.arange(3) + day)
+    recorder.extend('liquidity', np.arange(n, n + 5, dtype=np.float64))
+    recorder.flush()
+    return recorder
+
+
+def test_disk_recorder_matches_memory(tmp_path):
+    memory = record(HistoryRecorder(chunk_size=7), 50)
+    disk = record(HistoryRecorder(str(tmp_path), chunk_size=7), 50)
+    for name in ('liquidity', 'cash'):
+        np.testing.assert_array_equal(disk.series(name), memory.series(name))
+        assert disk.length(name) == memory.length(name)
+    np.testing.assert_array_equal(memory.series('liquidity'), np.arange(55))
+    np.testing.assert_array_equal(memory.series('cash')[-1], [49, 50, 51])
+    assert memory.last('liquidity') == disk.last('liquidity') == 54
+    reader = RecordReader(str(tmp_path), mmap=True)
+    assert reader.names() == ['cash', 'liquidity']
+    np.testing.assert_array_equal(reader['cash'], memory.series('cash'))
+    with pytest.raises(KeyError):
+        memory.series('hhi')
+
+
+def test_disk_recorder_memory_is_bounded(tmp_path):
+    recorder = HistoryRecorder(str(tmp_path), chunk_size=16)
+    record(recorder, 20)
+    before = recorder.nbytes
+    record(recorder, 2000)
+    assert recorder.nbytes == before
+    memory = record(HistoryRecorder(chunk_size=16), 2000)
+    assert memory.nbytes > 10 * before
+
+
+def test_model_with_disk_recorder_matches_memory(tmp_path):
+    runs = []
+    for recorder in (None, HistoryRecorder(str(tmp_path), chunk_size=8)):
+        model = BankModel(dict(settings, ledger_retention=5), rng=9, recorder=recorder)
+        model.create_world()
+        model.run(30)
+        runs.append(model)
+    memory, disk = runs
+    for name in memory.recorder.names():
+        np.testing.assert_array_equal(disk.recorder.series(name), memory.recorder.series(name))
+    np.testing.assert_array_equal(RecordReader(str(tmp_path))['hhi'], memory.recorder.series('hhi'))
+    # Книги банков не копят историю в списках, когда траектории пишутся на диск
+    assert memory.banks[0].reliability_history and memory.banks[0].deposits.histories['deposit']
+    assert not disk.banks[0].reliability_history and not disk.banks[0].deposits.histories['deposit']
+
+
+def test_disk_recorder_bounds_the_application_ledger(tmp_path):
+    model = BankModel(dict(settings, ledger_retention=None), rng=9,
+                      recorder=HistoryRecorder(str(tmp_path / 'default')))
+    assert model.system_deposits.retention == 'off'
+    assert BankModel(dict(settings, ledger_retention=None), rng=9).system_deposits.retention == 'full'
+    model = BankModel(dict(settings, ledger_retention=3), rng=9, recorder=HistoryRecorder(str(tmp_path / 'window')))
+    assert model.system_deposits.retention == 3
+    with pytest.raises(ValueError):
+        BankModel(dict(settings, ledger_retention='full'), rng=9, recorder=HistoryRecorder(str(tmp_path / 'full')))
@@ -0,0 +1,31 @@
+import numpy as np
+from scenarios import run_paired
+
+SHOCKS = {15: {'cb_reserve_rate': 0.4}}
+
+
+def test_pairs_share_random_numbers_until_the_shock():
+    result = run_paired(SHOCKS, 6, 40, seed=1, processes=1)
+    difference = result.difference('liquidity')
+    # Ликвидность пишется и в день 0, шок шага 15 виден с записи дня 16
+    np.testing.assert_array_equal(difference[:, :16], 0)
+    assert np.all(np.abs(difference[:, 16:]).max(axis=1) > 0)
+    # Пары получают разные потоки
+    assert not np.array_equal(result.baseline['liquidity'][0], result.baseline['liquidity'][1])
+    # Общие случайные числа убирают из разности большую часть шума
+    assert result.variance_reduction('liquidity') > 10
+    low, high = result.interval('liquidity')
+    assert np.all(low <= result.mean('liquidity')) and np.all(result.mean('liquidity') <= high)
+
+
+def test_paired_runs_without_shocks_are_identical():
+    result = run_paired({}, 3, 20, seed=2, processes=1)
+    for name in result.baseline:
+        np.testing.assert_array_equal(result.shocked[name], result.baseline[name])
+
+
+def test_paired_runs_do_not_depend_on_processes():
+    serial = run_paired(SHOCKS, 2, 25, seed=3, processes=1)
+    parallel = run_paired(SHOCKS, 2, 25, seed=3, processes=2)
+    for name in serial.baseline:
+        np.testing.assert_array_equal(parallel.difference(name), serial.difference(name))
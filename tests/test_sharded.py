@@ -0,0 +1,18 @@
+import numpy as np
+from agents import BankModel
+from settings import settings
+from sharded import ShardedBankModel
+
+
+def test_sharded_matches_common_stream_model():
+    model_settings = dict(settings, random_streams='common')
+    model = BankModel(model_settings, rng=5)
+    model.create_world()
+    model.run(40)
+    for n_shards in (1, 3):
+        with ShardedBankModel(model_settings, n_shards=n_shards, rng=5) as sharded:
+            sharded.create_world()
+            sharded.run(40)
+            for name in ('system_liquidity', 'hhi', 'mbk_credits', 'bank_cash', 'bank_credits'):
+                np.testing.assert_array_equal(sharded.recorder.series(name), model.recorder.series(name))
+            np.testing.assert_array_equal(sharded.exposures.dense(), model.exposures.dense())
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+import sweep
+from sweep import apply_overrides, config_hash, grid, latin_hypercube, run_sweep
+from settings import settings
+
+POINTS = grid(cb_reserve_rate=[0.1, 0.3])
+
+
+class Recomputed(Exception):
+    pass
+
+
+def test_repeated_sweep_is_served_from_cache(tmp_path, monkeypatch):
+    first = run_sweep(POINTS, 15, seed=2, replications=2, cache_dir=str(tmp_path), processes=1)
+    assert len(os.listdir(tmp_path)) == len(POINTS) * 2
+
+    def fail(task):
+        raise Recomputed(task)
+
+    monkeypatch.setattr(sweep, '_run_point', fail)
+    second = run_sweep(POINTS, 15, seed=2, replications=2, cache_dir=str(tmp_path), processes=1)
+    for (overrides, runs), (cached_overrides, cached_runs) in zip(first, second):
+        assert overrides == cached_overrides
+        for run, cached_run in zip(runs, cached_runs):
+            for name in run:
+                np.testing.assert_array_equal(cached_run[name], run[name])
+    # Повторы точки - разные прогоны
+    assert not np.array_equal(first[0][1][0]['liquidity'], first[0][1][1]['liquidity'])
+    # Новые шаги не берутся из кэша
+    with pytest.raises(Recomputed):
+        run_sweep(POINTS, 16, seed=2, cache_dir=str(tmp_path), processes=1)
+
+
+def test_cache_key_covers_settings_seed_and_steps():
+    key = config_hash(settings, 1, 10)
+    assert config_hash(dict(settings), 1, 10) == key
+    assert config_hash(apply_overrides({'cb_reserve_rate': 0.3}), 1, 10) != key
+    assert config_hash(settings, 2, 10) != key
+    assert config_hash(settings, 1, 11) != key
+    assert config_hash(settings, 1, 10, replication=1) != key
+
+
+def test_sweep_without_seed_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        config_hash(settings, None, 10)
+    with pytest.raises(ValueError):
+        run_sweep(POINTS, 5, seed=None, cache_dir=str(tmp_path), processes=1)
+    assert not list(tmp_path.iterdir())
+
+
+def test_overrides_and_latin_hypercube():
+    changed = apply_overrides({'deposit_volume_bound[1]': 5, 'cb_rate': 0.2})
+    assert changed['deposit_volume_bound'] == (settings['deposit_volume_bound'][0], 5)
+    assert changed['cb_rate'] == 0.2 and settings['cb_rate'] != 0.2
+    points = latin_hypercube({'cb_rate': (0.0, 1.0), 'banks_number': (5, 25)}, 10, seed=0, integer=('banks_number',))
+    # По одной точке в каждой десятой части интервала
+    np.testing.assert_array_equal(np.sort(np.floor([point['cb_rate'] * 10 for point in points])), np.arange(10))
+    assert all(isinstance(point['banks_number'], int) for point in points)
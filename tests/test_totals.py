@@ -0,0 +1,43 @@
+import numpy as np
+from agents import BankModel, HistoryList, FLOW_TYPES
+from settings import settings
+
+
+def scanned(book):
+    # Количество и объём живых потоков по типам, посчитанные по столбцам книги
+    counts = np.bincount(book.flow_type, minlength=len(FLOW_TYPES))
+    volumes = np.bincount(book.flow_type, weights=book.volume, minlength=len(FLOW_TYPES))
+    return counts, volumes
+
+
+def test_running_totals_match_live_flows():
+    rng = np.random.default_rng(1)
+    book = HistoryList(keep_history=False)
+    for day in range(300):
+        n = int(rng.integers(0, 6))
+        book.append_arrays(rng.uniform(1e4, 1e7, n), 0.1, rng.choice([0, 3, 30, 90, 180], n), 30,
+                           rng.integers(0, len(FLOW_TYPES), n))
+        book.roll()
+        counts, volumes = scanned(book)
+        np.testing.assert_array_equal(book.counts, counts)
+        np.testing.assert_allclose(book.volumes, volumes, rtol=1e-9, atol=1e-3)
+        for code, flow_type in enumerate(FLOW_TYPES):
+            assert book.count(flow_type) == counts[code]
+        assert book.count() == counts.sum()
+        assert np.isclose(book.total(), volumes.sum(), rtol=1e-9, atol=1e-3)
+
+
+def test_book_totals_and_system_volumes_sum_all_banks():
+    model = BankModel(settings, rng=6)
+    model.create_world()
+    model.run(40)
+    for book in ('deposits', 'credits'):
+        counts, volumes = model.book_totals(book)
+        assert counts.shape == volumes.shape == (len(model.banks), len(FLOW_TYPES))
+        for bank, bank_counts, bank_volumes in zip(model.banks, counts, volumes):
+            expected_counts, expected_volumes = scanned(getattr(bank, book))
+            np.testing.assert_array_equal(bank_counts, expected_counts)
+            np.testing.assert_allclose(bank_volumes, expected_volumes, rtol=1e-9)
+    # Объёмы системы - суммы по книгам всех банков, а не одного
+    assert np.isclose(model.system_credits_history[-1], model.book_totals('credits')[1].sum(), rtol=1e-12)
+    assert np.isclose(model.system_deposits_history[-1], model.book_totals('deposits')[1].sum(), rtol=1e-12)
@@ -0,0 +1,41 @@
+import numpy as np
+from agents import Bank
+
+
+def reference_underwrite(volume, cash, risk, risk_tolerance):
+    # Прежний последовательный проход Bank.validate с теми же рисковостями заявок
+    approved = np.zeros(len(volume), dtype=bool)
+    free_cash = cash
+    for i, amount in enumerate(volume):
+        if free_cash >= amount or risk[i] <= risk_tolerance:
+            approved[i] = True
+            free_cash -= amount
+    return approved
+
+
+def test_underwrite_matches_sequential_rule():
+    generator = np.random.default_rng(0)
+    bank = Bank('Bank', rng=0)
+    for seed in range(2000):
+        n = int(generator.integers(0, 60))
+        volume = generator.integers(10000, 10000000, n).astype(np.float64)
+        bank.cash = float(generator.integers(-10000000, 100000000))
+        bank.risk_tolerance = generator.uniform(0, 0.1)
+        bank.rng = np.random.default_rng(seed)
+        risk = np.random.default_rng(seed).uniform(0, 0.3, n)
+        np.testing.assert_array_equal(bank.underwrite(volume),
+                                      reference_underwrite(volume, bank.cash, risk, bank.risk_tolerance))
+
+
+def test_underwrite_long_batch():
+    # Длинная пачка, где кэш кончается и снова появляется из-за чередования помещающихся заявок
+    generator = np.random.default_rng(1)
+    bank = Bank('Bank', rng=0)
+    volume = generator.integers(10000, 10000000, 20000).astype(np.float64)
+    bank.cash = float(volume.sum() / 3)
+    bank.risk_tolerance = 0.05
+    bank.rng = np.random.default_rng(5)
+    risk = np.random.default_rng(5).uniform(0, 0.3, len(volume))
+    approved = bank.underwrite(volume)
+    np.testing.assert_array_equal(approved, reference_underwrite(volume, bank.cash, risk, bank.risk_tolerance))
+    assert 0 < approved.sum() < len(volume)